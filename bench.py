@@ -0,0 +1,230 @@
+# bench.py
+# Бенчмарк слоя БД на синтетических базах разного размера.
+#
+#   python bench.py                           # 100, 10k и 1M строк на таблицу -> bench_output.txt
+#   python bench.py --sizes 100 10000 --output baseline.json
+#   python bench.py --compare baseline.json   # код выхода 1, если есть регрессии
+#
+# Базы генерируются детерминированно (seed) и кэшируются в bench_data/;
+# замеры идут на рабочей копии, чтобы мутации не портили эталон.
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+import database
+import recurrence
+from migrations import SCHEMA_VERSION, get_schema_version
+
+DEFAULT_SIZES = (100, 10_000, 1_000_000)
+DEFAULT_SEED = 1234
+DEFAULT_REPEAT = 5
+DATA_DIR = 'bench_data'
+OUTPUT_FILE = 'bench_output.txt'
+REGRESSION_THRESHOLD = 1.25 # Медиана выросла больше чем на 25%...
+NOISE_FLOOR_MS = 0.05       # ...и больше чем на 0.05 мс (иначе это шум таймера)
+SEED_CHUNK = 50_000
+SEED_FREQUENCIES = ('daily', 'daily', 'weekly:Mon,Thu', 'monthly:1,15') # Правила повторения дейликов
+
+
+class _Rollback(Exception):
+    """Откатывает транзакцию замера, чтобы каждый повтор видел одни и те же данные."""
+
+
+# --- Синтетические данные ---
+def _dates(rng, today, days_back):
+    """Случайная дата в пределах days_back дней от today (отрицательное - в будущем)."""
+    offset = rng.randint(min(0, days_back), max(0, days_back))
+    return (today - datetime.timedelta(days=offset)).isoformat()
+
+def _seed_rows(task_type, size, rng, today):
+    for i in range(size):
+        if task_type == 'habits':
+            yield (f'Habit {i}', rng.randint(1, 10), rng.randint(0, 5), rng.randint(0, 500),
+                   rng.choice([None, _dates(rng, today, 30)]))
+        elif task_type == 'dailies':
+            yield (f'Daily {i}', rng.choice(SEED_FREQUENCIES), rng.choice([0, 1]),
+                   rng.choice([None, _dates(rng, today, 3), _dates(rng, today, 60)]),
+                   rng.randint(0, 50), rng.randint(5, 20), rng.randint(1, 10), rng.randint(0, 20))
+        elif task_type == 'todos':
+            yield (f'Todo {i}', f'Notes for todo {i}', rng.choice([None, _dates(rng, today, -30)]),
+                   _dates(rng, today, 365), int(rng.random() < 0.7), rng.randint(5, 40), rng.randint(1, 20),
+                   rng.randint(1, 4))
+        else:
+            yield (f'Reward {i}', rng.choice(['equipment', 'pet', 'custom']), rng.randint(10, 500),
+                   rng.choice(['axe.png', 'dragon.png', 'feather.png', 'creature.png']), int(rng.random() < 0.1))
+
+_SEED_SQL = {
+    'habits': 'INSERT INTO habits (name, value_xp, value_gold, counter, last_triggered) VALUES (?, ?, ?, ?, ?)',
+    'dailies': 'INSERT INTO dailies (name, frequency, completed_today, last_completed, streak, value_xp, value_gold, '
+               'penalty_hp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+    'todos': 'INSERT INTO todos (name, notes, due_date, creation_date, completed, value_xp, value_gold, difficulty) '
+             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+    'rewards': 'INSERT INTO rewards (name, type, cost, sprite_name, owned) VALUES (?, ?, ?, ?, ?)',
+}
+
+def seeded_db_path(size, seed):
+    return os.path.join(DATA_DIR, f'bench_{size}_{seed}.db')
+
+def build_database(size, seed=DEFAULT_SEED):
+    """Возвращает путь к базе с size строками в каждой таблице, создавая ее при необходимости."""
+    path = seeded_db_path(size, seed)
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        current = get_schema_version(conn) == SCHEMA_VERSION
+        conn.close()
+        if current:
+            return path
+        os.remove(path)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    database.DB_NAME = path
+    database.init_db()
+    rows_left = size - len(database.get_rewards()) # Стандартные награды уже есть
+    for task_type in ('habits', 'dailies', 'todos', 'rewards'):
+        rows = _seed_rows(task_type, size if task_type != 'rewards' else max(rows_left, 0), rng, today)
+        while True:
+            chunk = [row for _, row in zip(range(SEED_CHUNK), rows)]
+            if not chunk:
+                break
+            with database.transaction() as conn:
+                conn.executemany(_SEED_SQL[task_type], chunk)
+    with database.transaction() as conn:
+        recurrence.schedule_missing(conn, today) # Сроки дейликов - как после миграции 009
+    database.get_db_connection().execute('ANALYZE')
+    database.close_db()
+    return path
+
+# --- Замеры ---
+def _time(fn, repeat):
+    """Время каждого из repeat вызовов fn, мс (print внутри fn не выводится)."""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            fn()
+            samples.append((time.perf_counter_ns() - start) / 1e6)
+    return samples
+
+def _rolled_back(fn):
+    """fn внутри транзакции, которая затем откатывается (время COMMIT не входит в замер)."""
+    def run():
+        try:
+            with database.transaction():
+                fn()
+                raise _Rollback
+        except _Rollback:
+            pass
+    return run
+
+def _operations(size):
+    """(имя, функция) для замера; функции работают с текущим database.DB_NAME."""
+    task_id = size // 2 or 1
+    updates = iter(range(10 ** 9))
+    return [
+        ('init_db', lambda: (database.close_db(), database.init_db())),
+        ('get_tasks[habits]', lambda: database.get_tasks('habits')),
+        ('get_tasks[dailies]', lambda: database.get_tasks('dailies')),
+        ('get_tasks[todos]', lambda: database.get_tasks('todos')),
+        ('get_tasks[todos by due, page]', lambda: database.get_tasks('todos', sort=('due_date',), limit=50)),
+        ('get_rewards', lambda: database.get_rewards()),
+        ('add_task[todos]', lambda: database.add_task('todos', {'name': 'Bench todo'})),
+        ('update_task[dailies]', lambda: database.update_task('dailies', task_id, {'streak': next(updates)})),
+        ('daily_reset', _rolled_back(database.daily_reset)),
+    ]
+
+def run_benchmarks(sizes=DEFAULT_SIZES, seed=DEFAULT_SEED, repeat=DEFAULT_REPEAT, log=print):
+    """Запускает замеры и возвращает результаты в виде словаря (см. write_results)."""
+    results = []
+    saved_db_name = database.DB_NAME
+    try:
+        for size in sizes:
+            log(f"Preparing database with {size} rows per table...")
+            source = build_database(size, seed)
+            work = os.path.join(DATA_DIR, f'work_{size}.db')
+            database.close_db()
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(work + suffix):
+                    os.remove(work + suffix)
+            shutil.copyfile(source, work)
+            database.DB_NAME = work
+            for name, fn in _operations(size):
+                samples = _time(fn, repeat)
+                result = {
+                    'size': size, 'op': name, 'repeat': repeat,
+                    'min_ms': round(min(samples), 4),
+                    'median_ms': round(statistics.median(samples), 4),
+                    'mean_ms': round(statistics.fmean(samples), 4),
+                }
+                results.append(result)
+                log(f"  {name:<22} median {result['median_ms']:>10.3f} ms   min {result['min_ms']:>10.3f} ms")
+            database.close_db()
+            os.remove(work)
+    finally:
+        database.close_db()
+        database.DB_NAME = saved_db_name
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+def write_results(report, path=OUTPUT_FILE):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Сравнивает медианы с эталоном.
+
+    Возвращает список регрессий [(size, op, baseline_ms, current_ms), ...].
+    Операции, которых нет в эталоне, пропускаются.
+    """
+    expected = {(r['size'], r['op']): r['median_ms'] for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = expected.get((result['size'], result['op']))
+        if before is None:
+            continue
+        after = result['median_ms']
+        if after > before * threshold and after - before > NOISE_FLOOR_MS:
+            regressions.append((result['size'], result['op'], before, after))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the database layer on synthetic databases.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--output', default=OUTPUT_FILE, help="where to write JSON results")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.seed, args.repeat)
+    write_results(report, args.output)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for size, op, before, after in regressions:
+            print(f"REGRESSION {op} @ {size} rows: {before:.3f} ms -> {after:.3f} ms ({after / before:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
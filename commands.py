@@ -0,0 +1,429 @@
+# commands.py
+# Обратимые команды: добавление, удаление, отметка и ее снятие, правка, покупка и экипировка.
+# Команда меняет строки в БД и в той же транзакции пишет в журнал
+# (command_cells) значения каждой затронутой ячейки до и после себя. Отмена и
+# повтор - это UPDATE ... FROM по журналу: один запрос на пару (таблица,
+# колонка), сколько бы строк ни затронула команда. Удаление мягкое
+# (deleted_at); надгробия и старый журнал стирает compact() в фоне.
+import datetime
+import json
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import database
+import recurrence
+import task_events
+from game_core import gain_xp_gold, lose_xp_gold
+
+log = logging.getLogger(__name__)
+
+UNDO_LIMIT = 100        # Сколько последних команд можно отменить
+TOMBSTONE_TTL_DAYS = 7  # Через сколько дней удаленные задачи стираются окончательно
+TASK_TYPES = ('habits', 'dailies', 'todos')
+CHARACTER_COLUMNS = ('level', 'xp', 'xp_to_next_level', 'health', 'max_health', 'gold')
+# Колонки, которые меняет событие 'complete' (проекции task_events)
+COMPLETION_COLUMNS = {'dailies': ('completed_today', 'streak', 'last_completed', 'next_due'), 'todos': ('completed',)}
+
+
+# --- Журнал ---
+def _ids_json(ids):
+    return json.dumps(list(ids))
+
+def snapshot(conn, command_id, table, ids, columns):
+    """Запоминает текущие значения columns строк ids (колонка before)."""
+    for column in columns:
+        conn.execute(f'''
+            INSERT INTO command_cells (command_id, target, row_id, column_name, before)
+            SELECT ?, ?, id, ?, {column} FROM {table} WHERE id IN (SELECT value FROM json_each(?))
+        ''', (command_id, table, column, _ids_json(ids)))
+
+def capture(conn, command_id, table):
+    """Дописывает значения после команды (колонка after) для ячеек table, снятых snapshot."""
+    columns = [row[0] for row in conn.execute(
+        'SELECT DISTINCT column_name FROM command_cells WHERE command_id = ? AND target = ?', (command_id, table))]
+    for column in columns:
+        conn.execute(f'''
+            UPDATE command_cells SET after = t.{column} FROM {table} AS t
+            WHERE command_cells.command_id = ? AND command_cells.target = ? AND command_cells.column_name = ?
+              AND t.id = command_cells.row_id
+        ''', (command_id, table, column))
+
+@contextmanager
+def journaled(conn, command_id, table, ids, columns):
+    """with journaled(...): изменения колонок columns строк ids попадут в журнал команды."""
+    snapshot(conn, command_id, table, ids, columns)
+    yield
+    capture(conn, command_id, table)
+
+def journal_cell(conn, command_id, table, row_id, column, before, after):
+    """Ячейка, которой до команды не было (новая строка, новое событие)."""
+    conn.execute('''
+        INSERT INTO command_cells (command_id, target, row_id, column_name, before, after)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (command_id, table, row_id, column, before, after))
+
+def _restore(conn, command_id, side):
+    """Возвращает все ячейки команды к значениям side ('before' или 'after')."""
+    groups = conn.execute(
+        'SELECT DISTINCT target, column_name FROM command_cells WHERE command_id = ?', (command_id,)).fetchall()
+    for table, column in groups:
+        conn.execute(f'''
+            UPDATE {table} SET {column} = c.{side} FROM command_cells AS c
+            WHERE c.command_id = ? AND c.target = ? AND c.column_name = ? AND {table}.id = c.row_id
+        ''', (command_id, table, column))
+
+# События, записанные командой и еще учтенные в сводках
+_COMMAND_EVENTS = ("id IN (SELECT row_id FROM command_cells WHERE command_id = ? AND target = 'task_events') "
+                   "AND NOT reverted")
+
+def _restore_events(conn, command_id, side):
+    """
+    _restore вместе со сводками: события команды, учтенные до него, вычитаются,
+    учтенные после - добавляются. Команда может как записать событие (выполнение),
+    так и отменить его (снятая отметка).
+    """
+    task_events.roll_up_where(conn, _COMMAND_EVENTS, (command_id,), sign=-1)
+    _restore(conn, command_id, side)
+    task_events.roll_up_where(conn, _COMMAND_EVENTS, (command_id,))
+
+def undo_command(command_id):
+    """Отменяет команду по журналу (события вычитаются из сводок и помечаются reverted)."""
+    with database.transaction() as conn:
+        _restore_events(conn, command_id, 'before')
+        conn.execute('UPDATE command_journal SET undone = 1 WHERE id = ?', (command_id,))
+
+def redo_command(command_id):
+    """Повторяет отмененную команду по журналу."""
+    with database.transaction() as conn:
+        _restore_events(conn, command_id, 'after')
+        conn.execute('UPDATE command_journal SET undone = 0 WHERE id = ?', (command_id,))
+
+def touched_rows(command_id):
+    """{таблица: [id, ...]} - строки, которые меняла команда."""
+    touched = {}
+    for table, row_id in database.get_db_connection().execute(
+            'SELECT DISTINCT target, row_id FROM command_cells WHERE command_id = ? ORDER BY target, row_id',
+            (command_id,)):
+        touched.setdefault(table, []).append(row_id)
+    return touched
+
+def _forget(conn, where, params=()):
+    """Удаляет команды (и их ячейки) из журнала."""
+    conn.execute(f'DELETE FROM command_cells WHERE command_id IN (SELECT id FROM command_journal WHERE {where})', params)
+    conn.execute(f'DELETE FROM command_journal WHERE {where}', params)
+
+def run_command(command, discard_redo=False):
+    """Записывает команду в журнал и выполняет ее в БД одной транзакцией."""
+    with database.transaction() as conn:
+        if discard_redo: # Новая команда после отмены: отмененные больше не повторить
+            _forget(conn, 'undone = 1')
+        conn.execute('INSERT INTO command_journal (id, description) VALUES (?, ?)', (command.id, command.description))
+        command.run(conn)
+
+def next_command_id():
+    return database.get_db_connection().execute('SELECT COALESCE(MAX(id), 0) + 1 FROM command_journal').fetchone()[0]
+
+def compact(keep=UNDO_LIMIT, ttl_days=TOMBSTONE_TTL_DAYS):
+    """
+    Стирает журнал старше последних keep команд и удаленные задачи старше
+    ttl_days дней, на которые журнал больше не ссылается.
+
+    Возвращает число окончательно удаленных задач.
+    """
+    purged = 0
+    with database.transaction() as conn:
+        _forget(conn, 'id NOT IN (SELECT id FROM command_journal ORDER BY id DESC LIMIT ?)', (keep,))
+        for table in TASK_TYPES:
+            purged += conn.execute(f'''
+                DELETE FROM {table}
+                WHERE deleted_at IS NOT NULL AND deleted_at < datetime('now', ?)
+                  AND id NOT IN (SELECT row_id FROM command_cells WHERE target = ?)
+            ''', (f'-{ttl_days} days', table)).rowcount
+    return purged
+
+
+# --- Команды ---
+class Command(ABC):
+    """
+    Обратимое изменение (базовый класс, сам по себе не создается).
+
+    apply(store, character) меняет данные в памяти и возвращает False, если
+    делать нечего; run(conn) повторяет изменение в БД и пишет его в журнал
+    (вызывается в транзакции, возможно в потоке писателя).
+    """
+    description = 'command'
+
+    def __init__(self):
+        self.id = None
+
+    def apply(self, store, character):
+        return True
+
+    @abstractmethod
+    def run(self, conn):
+        """Изменение в БД; у каждой команды свое."""
+
+
+class AddTask(Command):
+    def __init__(self, task_type, data):
+        super().__init__()
+        self.task_type = task_type
+        self.data = data
+        self.description = f"add {task_type}"
+        self.task = None
+
+    def apply(self, store, character):
+        self.data = dict(self.data, id=store.allocate_id(self.task_type))
+        self.task = store.put(self.task_type, database.new_task_row(self.task_type, self.data))
+        return True
+
+    def run(self, conn):
+        database.add_task(self.task_type, self.data)
+        # Отмена добавления - надгробие на новой строке
+        tombstone = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        journal_cell(conn, self.id, self.task_type, self.data['id'], 'deleted_at', tombstone, None)
+
+
+class DeleteTasks(Command):
+    """Удаление одной или сразу многих задач одного типа."""
+
+    def __init__(self, task_type, task_ids):
+        super().__init__()
+        self.task_type = task_type
+        self.task_ids = list(task_ids)
+        self.description = f"delete {len(self.task_ids)} {task_type}"
+
+    def apply(self, store, character):
+        self.task_ids = [task_id for task_id in self.task_ids if store.drop(self.task_type, task_id)]
+        return bool(self.task_ids)
+
+    def run(self, conn):
+        with journaled(conn, self.id, self.task_type, self.task_ids, ('deleted_at',)):
+            database.delete_tasks(self.task_type, self.task_ids)
+
+
+class UpdateTask(Command):
+    """Правка полей задачи (название, снятие отметки и т.п.)."""
+
+    def __init__(self, task_type, task_id, updates):
+        super().__init__()
+        self.task_type = task_type
+        self.task_id = task_id
+        self.updates = updates
+        self.description = f"update {task_type} #{task_id}"
+
+    def apply(self, store, character):
+        self.updates = database.scheduled_updates(self.task_type, self.updates) # Новая frequency - новый next_due
+        database.update_statement(self.task_type, tuple(self.updates)) # Имена колонок попадут в SQL журнала
+        return store.patch(self.task_type, self.task_id, self.updates) is not None
+
+    def run(self, conn):
+        with journaled(conn, self.id, self.task_type, [self.task_id], list(self.updates)):
+            database.update_task(self.task_type, self.task_id, self.updates)
+
+
+class CompleteTask(Command):
+    """Выполнение дейлика или to-do: событие в журнал, награда персонажу."""
+
+    def __init__(self, task_type, task_id):
+        super().__init__()
+        self.task_type = task_type
+        self.task_id = task_id
+        self.description = f"complete {task_type} #{task_id}"
+        self.day = datetime.date.today().isoformat()
+        self.xp = self.gold = 0
+        self.character = None
+
+    def apply(self, store, character):
+        task = store.get(self.task_type, self.task_id)
+        if task is None or task.get('completed_today') or task.get('completed'):
+            return False # Уже выполнена: повторная отметка не дает награду второй раз
+        self.xp, self.gold = task['value_xp'], task['value_gold']
+        gain_xp_gold(character, self.xp, self.gold)
+        store.apply_event(self.task_type, self.task_id, 'complete', self.day)
+        self.character = dict(character) # Запись может уйти в БД позже, после следующих изменений в памяти
+        return True
+
+    def run(self, conn):
+        with journaled(conn, self.id, self.task_type, [self.task_id], COMPLETION_COLUMNS[self.task_type]), \
+                journaled(conn, self.id, 'character', [1], CHARACTER_COLUMNS):
+            event_id = task_events.record_event(conn, self.task_type, self.task_id, 'complete', self.day,
+                                                self.xp, self.gold)
+            journal_cell(conn, self.id, 'task_events', event_id, 'reverted', 1, 0)
+            database.update_character_data(self.character)
+
+
+class UncompleteTask(Command):
+    """
+    Снятие отметки дейлика или to-do: последнее выполнение отменяется - событие
+    помечается reverted и вычитается из сводок, стрик и last_completed
+    возвращаются, опыт и золото снимаются.
+    """
+
+    def __init__(self, task_type, task_id):
+        super().__init__()
+        self.task_type = task_type
+        self.task_id = task_id
+        self.description = f"uncomplete {task_type} #{task_id}"
+        self.today = datetime.date.today().isoformat()
+        self.xp = self.gold = 0
+        self.character = None
+
+    def apply(self, store, character):
+        task = store.get(self.task_type, self.task_id)
+        if task is None or not (task.get('completed_today') or task.get('completed')):
+            return False
+        self.xp, self.gold = task['value_xp'], task['value_gold'] # Те же, что начислил CompleteTask
+        lose_xp_gold(character, self.xp, self.gold)
+        if self.task_type == 'dailies':
+            next_due = recurrence.first_due(task['frequency'], datetime.date.fromisoformat(self.today))
+            store.patch('dailies', self.task_id, {'completed_today': 0, 'streak': max(task['streak'] - 1, 0),
+                                                  'next_due': next_due.isoformat()})
+            store.expire('dailies', self.task_id) # Прежний last_completed знает только журнал
+        else:
+            store.patch('todos', self.task_id, {'completed': 0})
+        self.character = dict(character)
+        return True
+
+    def run(self, conn):
+        with journaled(conn, self.id, self.task_type, [self.task_id], COMPLETION_COLUMNS[self.task_type]), \
+                journaled(conn, self.id, 'character', [1], CHARACTER_COLUMNS):
+            event_id = task_events.revert_event(conn, self.task_type, self.task_id, 'complete', self.today)
+            if event_id is not None:
+                journal_cell(conn, self.id, 'task_events', event_id, 'reverted', 0, 1)
+            database.update_character_data(self.character)
+
+
+class BuyReward(Command):
+    def __init__(self, reward_id):
+        super().__init__()
+        self.reward_id = reward_id
+        self.description = f"buy reward #{reward_id}"
+        self.day = datetime.date.today().isoformat()
+        self.cost = 0
+        self.character = None
+
+    def apply(self, store, character):
+        reward = store.get_reward(self.reward_id)
+        if reward is None or reward['owned']:
+            return False
+        if character['gold'] < reward['cost']:
+            log.warning("Not enough gold for %s.", reward['name'])
+            return False
+        self.cost = reward['cost']
+        character['gold'] -= self.cost
+        store.apply_event('rewards', self.reward_id, 'purchase', self.day)
+        self.character = dict(character)
+        log.debug("Bought %s for %s Gold.", reward['name'], self.cost)
+        return True
+
+    def run(self, conn):
+        with journaled(conn, self.id, 'rewards', [self.reward_id], ('owned',)), \
+                journaled(conn, self.id, 'character', [1], CHARACTER_COLUMNS):
+            event_id = task_events.record_event(conn, 'rewards', self.reward_id, 'purchase', self.day, gold=self.cost)
+            journal_cell(conn, self.id, 'task_events', event_id, 'reverted', 1, 0)
+            database.update_character_data(self.character)
+
+
+class EquipReward(Command):
+    """Экипировка предмета; другой предмет того же типа снимается."""
+
+    def __init__(self, reward_id):
+        super().__init__()
+        self.reward_id = reward_id
+        self.description = f"equip reward #{reward_id}"
+        self.reward_ids = []
+
+    def apply(self, store, character):
+        reward = store.get_reward(self.reward_id)
+        if reward is None or not reward['owned'] or reward['type'] not in ('equipment', 'pet'):
+            return False
+        same_type = [r for r in store.rewards() if r['owned'] and r['type'] == reward['type']]
+        self.reward_ids = [r['id'] for r in same_type]
+        for r in same_type:
+            r['equipped'] = int(r['id'] == self.reward_id)
+        return True
+
+    def run(self, conn):
+        with journaled(conn, self.id, 'rewards', self.reward_ids, ('equipped',)):
+            conn.execute('UPDATE rewards SET equipped = (id = ?) WHERE id IN (SELECT value FROM json_each(?))',
+                         (self.reward_id, _ids_json(self.reward_ids)))
+
+
+class CommandHistory:
+    """
+    Стеки отмены и повтора для одного профиля.
+
+    Команда применяется к памяти сразу, а в БД уходит через writer (или
+    пишется сразу без него). Отмена и повтор идут по журналу в БД, после
+    чего затронутые строки перечитываются в store, а персонаж - в character.
+    """
+
+    def __init__(self, store, character, writer=None, limit=UNDO_LIMIT):
+        self.store = store
+        self.character = character
+        self.writer = writer
+        self.limit = limit
+        self._done = []
+        self._undone = []
+        if writer:
+            writer.flush() # id берется из журнала: в очереди не должно остаться команд
+        self._next_id = next_command_id()
+
+    def can_undo(self):
+        return bool(self._done)
+
+    def can_redo(self):
+        return bool(self._undone)
+
+    def execute(self, command):
+        """Выполняет команду и кладет ее в стек отмены. Возвращает команду или None, если делать нечего."""
+        if not command.apply(self.store, self.character):
+            return None
+        command.id = self._next_id
+        self._next_id += 1
+        self._write(run_command, command, bool(self._undone), description=command.description)
+        self._undone.clear()
+        self._done.append(command)
+        del self._done[:-self.limit] # Журнал старых команд вычистит compact()
+        return command
+
+    def undo(self):
+        """Отменяет последнюю команду; возвращает ее (или None)."""
+        if not self._done:
+            return None
+        command = self._done.pop()
+        self._write(undo_command, command.id, description=f"undo {command.description}")
+        self._sync(command)
+        self._undone.append(command)
+        return command
+
+    def redo(self):
+        """Повторяет последнюю отмененную команду; возвращает ее (или None)."""
+        if not self._undone:
+            return None
+        command = self._undone.pop()
+        self._write(redo_command, command.id, description=f"redo {command.description}")
+        self._sync(command)
+        self._done.append(command)
+        return command
+
+    def clear(self):
+        """Забывает историю (например, после ежедневного сброса, который меняет те же строки)."""
+        self._done.clear()
+        self._undone.clear()
+
+    def _sync(self, command):
+        if self.writer:
+            self.writer.flush()
+        for table, ids in touched_rows(command.id).items():
+            if table == 'character':
+                self.character.update(database.get_character_data())
+            elif table != 'task_events':
+                self.store.refresh(table, ids)
+
+    def _write(self, fn, *args, description):
+        if self.writer:
+            self.writer.submit(fn, *args, description=description)
+        else:
+            fn(*args)
@@ -1,300 +1,537 @@
 # database.py
+import ast
+import json
+import logging
 import sqlite3
 import datetime
 import os
+from functools import lru_cache
+from db_connection import ConnectionManager
+from migrations import migrate
+import recurrence
+import search
+import task_events
 
-DB_NAME = 'rpg_life.db'
+log = logging.getLogger(__name__)
+
+DEFAULT_DB_NAME = 'rpg_life.db'
+DB_NAME = DEFAULT_DB_NAME # Текущая БД (активный профиль, см. profiles.py)
+LEGACY_LAST_RUN_FILE = '.last_run_date' # До миграции 005 дата последнего запуска хранилась в файле
+
+_managers = {} # DB_NAME -> ConnectionManager
+
+def register_functions(conn):
+    """Функции Python, доступные в SQL соединений приложения."""
+    # Следующий срок дейлика (task_events, daily_reset)
+    conn.create_function(recurrence.SQL_FUNCTION, 2, recurrence.next_due_sql, deterministic=True)
+
+def get_connection_manager():
+    """Возвращает менеджер соединений для текущего DB_NAME."""
+    manager = _managers.get(DB_NAME)
+    if manager is None:
+        manager = _managers[DB_NAME] = ConnectionManager(DB_NAME, on_connect=register_functions)
+    return manager
 
 def get_db_connection():
-    """Устанавливает соединение с БД."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row # Возвращает строки как словари
-    return conn
+    """Возвращает долгоживущее соединение с БД для текущего потока."""
+    return get_connection_manager().connection()
+
+def transaction():
+    """Контекстный менеджер транзакции на общем соединении."""
+    return get_connection_manager().transaction()
+
+def close_db(db_name=None):
+    """Закрывает соединения с БД db_name (без аргумента - со всеми открытыми БД)."""
+    names = list(_managers) if db_name is None else [db_name]
+    for name in names:
+        manager = _managers.pop(name, None)
+        if manager:
+            manager.close()
 
 def init_db():
-    """Инициализирует таблицы в БД, если их нет."""
+    """Создает БД или обновляет ее схему до актуальной версии."""
     if os.path.exists(DB_NAME):
-        print("Database already exists.")
-        # Возможно, здесь стоит добавить проверку и обновление схемы, если нужно
-        # return
+        log.debug("Database already exists.")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # --- Таблица персонажа ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS character (
-            id INTEGER PRIMARY KEY CHECK (id = 1), -- Только один персонаж
-            level INTEGER DEFAULT 1,
-            xp INTEGER DEFAULT 0,
-            xp_to_next_level INTEGER DEFAULT 100,
-            health INTEGER DEFAULT 100,
-            max_health INTEGER DEFAULT 100,
-            gold INTEGER DEFAULT 0
-        )
-    ''')
-    # Вставляем персонажа, если его нет
-    cursor.execute('''
-        INSERT OR IGNORE INTO character (id) VALUES (1)
-    ''')
-
-    # --- Таблица привычек (Habits) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS habits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            value_xp INTEGER DEFAULT 5,
-            value_gold INTEGER DEFAULT 1,
-            counter INTEGER DEFAULT 0,
-            last_triggered DATE  -- Renamed from last_triggered_pos since we only have positive now
-        )
-    ''')
-
-    # --- Таблица ежедневок (Dailies) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS dailies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            frequency TEXT DEFAULT 'daily', -- 'daily', 'weekly:Mon', 'monthly:1' и т.д. (пока упростим до 'daily')
-            completed_today BOOLEAN DEFAULT 0,
-            last_completed DATE,
-            streak INTEGER DEFAULT 0,
-            value_xp INTEGER DEFAULT 10,
-            value_gold INTEGER DEFAULT 5,
-            penalty_hp INTEGER DEFAULT 10 -- Штраф за невыполнение
-        )
-    ''')
-
-    # --- Таблица разовых задач (To-Dos) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS todos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            notes TEXT,
-            due_date DATE,
-            creation_date DATE DEFAULT CURRENT_DATE,
-            completed BOOLEAN DEFAULT 0,
-            value_xp INTEGER DEFAULT 20,
-            value_gold INTEGER DEFAULT 10,
-            difficulty INTEGER DEFAULT 1 -- Можно использовать для расчета ценности
-        )
-    ''')
-
-    # --- Таблица наград/инвентаря (просто) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS rewards (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            type TEXT CHECK(type IN ('equipment', 'pet', 'custom')) NOT NULL,
-            description TEXT,
-            cost INTEGER DEFAULT 0, -- Цена в золоте для покупки
-            sprite_name TEXT, -- Имя файла спрайта в assets/
-            owned BOOLEAN DEFAULT 0, -- Владеет ли игрок
-            equipped BOOLEAN DEFAULT 0 -- Экипировано ли (если применимо)
-        )
-    ''')
-    # Добавим примеры наград из спрайтов
-    cursor.execute("INSERT OR IGNORE INTO rewards (name, type, cost, sprite_name) VALUES (?, ?, ?, ?)",
-                   ('Боевой Топор', 'equipment', 50, 'axe.png'))
-    cursor.execute("INSERT OR IGNORE INTO rewards (name, type, cost, sprite_name) VALUES (?, ?, ?, ?)",
-                   ('Маленький Дракон', 'pet', 100, 'dragon.png'))
-    cursor.execute("INSERT OR IGNORE INTO rewards (name, type, cost, sprite_name) VALUES (?, ?, ?, ?)",
-                   ('Легкое Перо', 'custom', 10, 'feather.png')) # 'custom' - для пользовательских наград
-    cursor.execute("INSERT OR IGNORE INTO rewards (name, type, cost, sprite_name) VALUES (?, ?, ?, ?)",
-                   ('Магический Фамильяр', 'pet', 75, 'creature.png'))
-
-    conn.commit()
-    conn.close()
-    print("Database initialized.")
+    applied = migrate(get_connection_manager())
+    if applied:
+        with transaction() as conn:
+            # Сроки по текущим правилам повторения: миграции их не знают
+            recurrence.schedule_missing(conn, datetime.date.today())
+        log.info("Database initialized. Applied migrations: %s", applied)
+
+# --- Строки таблиц ---
+class Row:
+    """
+    Строка таблицы на __slots__: без словаря на каждый объект.
+
+    Ведет себя как dict - row['name'], row.get(), 'streak' in row, update(),
+    dict(row), сравнение со словарем, - но ключи ограничены колонками
+    запроса (новый ключ - KeyError). copy() возвращает обычный dict.
+    """
+    __slots__ = ()
+    _fields = ()
+    _field_set = frozenset()
+
+    def __getitem__(self, key):
+        if key not in self._field_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._field_set:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._field_set
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return [getattr(self, field) for field in self._fields]
+
+    def items(self):
+        return list(zip(self._fields, self.values()))
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._field_set else default
+
+    def update(self, other=(), **kwargs):
+        pairs = [(key, other[key]) for key in other.keys()] if hasattr(other, 'keys') else list(other)
+        for key, value in pairs + list(kwargs.items()):
+            self[key] = value
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Row, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+@lru_cache(maxsize=64)
+def row_class(table, columns):
+    """Класс строки table с колонками columns (кортеж); создается один раз на набор колонок."""
+    if not all(column.isidentifier() for column in columns):
+        raise ValueError(f"Invalid column names for {table}: {columns}")
+    # __init__ генерируется, как в namedtuple: присваивания без цикла вдвое быстрее dict(zip(...))
+    source = f'def __init__(self, {", ".join(columns)}):\n' + (
+        '\n'.join(f'    self.{column} = {column}' for column in columns) or '    pass')
+    namespace = {}
+    exec(source, namespace)
+    name = table.title().replace('_', '') + 'Row'
+    return type(name, (Row,), {'__slots__': columns, '_fields': columns, '_field_set': frozenset(columns),
+                               '__init__': namespace['__init__']})
+
+def query_rows(table, sql, params=()):
+    """SELECT по таблице table; строки возвращаются объектами row_class."""
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None # Кортежи: без промежуточного sqlite3.Row на каждую строку
+    cursor.execute(sql, params)
+    cls = row_class(table, tuple(description[0] for description in cursor.description))
+    return [cls(*row) for row in cursor]
+
+# Колонки, которые можно менять через update_task / update_reward. Имена колонок
+# попадают в текст SQL, поэтому все остальные ключи отклоняются.
+UPDATABLE_COLUMNS = {
+    'habits': frozenset(('name', 'value_xp', 'value_gold', 'counter', 'last_triggered')),
+    'dailies': frozenset(('name', 'frequency', 'completed_today', 'last_completed', 'streak',
+                          'value_xp', 'value_gold', 'penalty_hp', 'next_due')),
+    'todos': frozenset(('name', 'notes', 'due_date', 'creation_date', 'completed',
+                        'value_xp', 'value_gold', 'difficulty')),
+    'rewards': frozenset(('name', 'type', 'description', 'cost', 'sprite_name', 'owned', 'equipped')),
+}
+
+@lru_cache(maxsize=256)
+def update_statement(table, columns):
+    """
+    UPDATE ... SET для набора колонок columns (кортеж) по id.
+
+    Текст запроса кэшируется на (таблица, колонки). ValueError, если
+    таблица или колонка не из UPDATABLE_COLUMNS.
+    """
+    allowed = UPDATABLE_COLUMNS.get(table)
+    if allowed is None:
+        raise ValueError(f"Unknown table: {table!r}")
+    unknown = [column for column in columns if column not in allowed]
+    if unknown or not columns:
+        raise ValueError(f"Cannot update columns {unknown or columns!r} of {table}")
+    return f'UPDATE {table} SET {", ".join(f"{column} = ?" for column in columns)} WHERE id = ?'
 
 # --- Функции для получения/обновления данных ---
 
 def get_character_data():
     """Получает данные персонажа."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    char = cursor.execute('SELECT * FROM character WHERE id = 1').fetchone()
-    conn.close()
-    
-    if char:
-        # Convert tuple to dictionary using column names
-        columns = [description[0] for description in cursor.description]
-        return dict(zip(columns, char))
-    return None
+    rows = query_rows('character', 'SELECT * FROM character WHERE id = 1')
+    return rows[0] if rows else None
 
 def update_character_data(data):
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE character SET
-            level = ?, xp = ?, xp_to_next_level = ?, health = ?, max_health = ?, gold = ?
-        WHERE id = 1
-    ''', (data['level'], data['xp'], data['xp_to_next_level'], data['health'], data['max_health'], data['gold']))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE character SET
+                level = ?, xp = ?, xp_to_next_level = ?, health = ?, max_health = ?, gold = ?
+            WHERE id = 1
+        ''', (data['level'], data['xp'], data['xp_to_next_level'], data['health'], data['max_health'], data['gold']))
 
 # --- Функции для Задач (CRUD - Create, Read, Update, Delete) ---
 
-def get_tasks(task_type, include_completed=False):
+# Ключи сортировки get_tasks: колонка -> чем заменить NULL (None - колонка не
+# бывает NULL). Замена ставит задачи без срока в конец и нужна курсору:
+# сравнение с NULL не находит ни одной строки. Индексы под выражения сортировок,
+# которые предлагает UI, - миграция 008 (выражения должны совпадать).
+SORT_COLUMNS = {
+    'habits': {'id': None, 'name': None, 'value_xp': None, 'value_gold': None, 'counter': None,
+               'last_triggered': ''},
+    'dailies': {'id': None, 'name': None, 'value_xp': None, 'value_gold': None, 'penalty_hp': None,
+                'streak': None, 'last_completed': ''},
+    'todos': {'id': None, 'name': None, 'value_xp': None, 'value_gold': None, 'difficulty': None,
+              'creation_date': None, 'due_date': '9999-12-31'},
+}
+DEFAULT_SORT = {'habits': ('id',), 'dailies': ('id',), 'todos': ('creation_date',)}
+
+# Колонки, по которым get_tasks фильтрует (значение или диапазон)
+FILTER_COLUMNS = {
+    'habits': frozenset(('value_xp', 'value_gold', 'counter', 'last_triggered')),
+    'dailies': frozenset(('value_xp', 'value_gold', 'penalty_hp', 'streak', 'last_completed')),
+    'todos': frozenset(('value_xp', 'value_gold', 'difficulty', 'creation_date', 'due_date')),
+}
+
+def _sort_keys(task_type, sort):
+    """sort ('due_date', '-difficulty', ...) -> [(колонка, по убыванию), ...] с id в конце."""
+    keys = []
+    for key in sort or DEFAULT_SORT[task_type]:
+        column = key.lstrip('-')
+        if column not in SORT_COLUMNS[task_type]:
+            raise ValueError(f"Cannot sort {task_type} by {key!r}")
+        keys.append((column, key.startswith('-')))
+    if all(column != 'id' for column, _ in keys):
+        # id - в том же направлении, что и первый ключ: тогда порядок отдает один проход по индексу
+        keys.append(('id', keys[0][1]))
+    return keys
+
+def _sort_expression(task_type, column):
+    null = SORT_COLUMNS[task_type][column]
+    return column if null is None else f"COALESCE({column}, '{null}')"
+
+def _task_where(task_type, include_completed, filters, exclude=None):
+    """
+    Условия WHERE и параметры для get_tasks / count_tasks.
+
+    filters: {колонка: значение} или {колонка: (от, до)} - границы включительно,
+    None вместо границы - без ограничения. ValueError для колонки не из FILTER_COLUMNS.
+    exclude: id, которые нужно пропустить.
     """
-    Получает все задачи указанного типа ('habits', 'dailies', 'todos').
+    where = ['deleted_at IS NULL']
+    if task_type == 'todos' and not include_completed:
+        where.insert(0, 'completed = 0') # Совпадает с условием частичных индексов to-do
+    params = []
+    if exclude:
+        where.append('id NOT IN (SELECT value FROM json_each(?))')
+        params.append(json.dumps(sorted(exclude)))
+    for column, value in (filters or {}).items():
+        if column not in FILTER_COLUMNS[task_type]:
+            raise ValueError(f"Cannot filter {task_type} by {column!r}")
+        if isinstance(value, (tuple, list)):
+            low, high = value
+            if low is not None:
+                where.append(f'{column} >= ?')
+                params.append(low)
+            if high is not None:
+                where.append(f'{column} <= ?')
+                params.append(high)
+        else:
+            where.append(f'{column} = ?')
+            params.append(value)
+    return where, params
+
+def _after_clause(task_type, keys, row):
+    """Условие keyset-курсора: строки строго после row в порядке keys."""
+    exprs = [_sort_expression(task_type, column) for column, _ in keys]
+    values = [row[column] if row[column] is not None else SORT_COLUMNS[task_type][column] for column, _ in keys]
+    if len({descending for _, descending in keys}) == 1:
+        # Одно направление: сравнение кортежей. Граница по первому ключу дублируется
+        # отдельным условием - по выражению (COALESCE) SQLite ищет в индексе только так
+        op = '<' if keys[0][1] else '>'
+        return (f'{exprs[0]} {op}= ? AND ({", ".join(exprs)}) {op} ({", ".join("?" * len(exprs))})',
+                values[:1] + values)
+    # Разные направления: (a > ?) OR (a = ? AND b < ?) OR ...
+    terms, params = [], []
+    for i, (_, descending) in enumerate(keys):
+        equal = [f'{expr} = ?' for expr in exprs[:i]]
+        terms.append('(' + ' AND '.join(equal + [f'{exprs[i]} {"<" if descending else ">"} ?']) + ')')
+        params.extend(values[:i + 1])
+    return '(' + ' OR '.join(terms) + ')', params
+
+def get_tasks(task_type, include_completed=False, sort=None, filters=None, limit=None, after=None, offset=0,
+              exclude=None):
+    """
+    Получает задачи указанного типа ('habits', 'dailies', 'todos').
     
     Args:
         task_type: тип задач ('habits', 'dailies', 'todos')
         include_completed: если True, включает выполненные задачи для todos
+        sort: ключи сортировки из SORT_COLUMNS, '-' в начале - по убыванию
+            (по умолчанию DEFAULT_SORT); при равенстве ключей - по id
+        filters: {колонка: значение или (от, до)}, см. _task_where
+        limit: размер страницы (None - все строки)
+        after: последняя строка предыдущей страницы (keyset-курсор)
+        offset: пропустить строк (для прыжка к странице без курсора)
+        exclude: id, которые не возвращать (например, еще не записанные изменения)
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if task_type == 'todos' and not include_completed:
-        # Показываем только невыполненные тудушки
-        cursor.execute(f'SELECT * FROM {task_type} WHERE completed = 0 ORDER BY creation_date')
-    else:
-        cursor.execute(f'SELECT * FROM {task_type} ORDER BY id')
-    
-    tasks = cursor.fetchall()
-    
-    # Convert tuples to dictionaries using column names
-    columns = [description[0] for description in cursor.description]
-    result = [dict(zip(columns, task)) for task in tasks]
-    
-    conn.close()
-    return result
+    where, params = _task_where(task_type, include_completed, filters, exclude)
+    keys = _sort_keys(task_type, sort)
+    if after is not None:
+        clause, values = _after_clause(task_type, keys, after)
+        where.append(clause)
+        params.extend(values)
+    order = ', '.join(_sort_expression(task_type, column) + (' DESC' if descending else '')
+                      for column, descending in keys)
+    sql = f'SELECT * FROM {task_type} WHERE {" AND ".join(where)} ORDER BY {order}'
+    if limit is not None:
+        sql += ' LIMIT ? OFFSET ?'
+        params.extend((limit, offset))
+    return query_rows(task_type, sql, params)
+
+def count_tasks(task_type, include_completed=False, filters=None, exclude=None):
+    """Число задач, которое вернул бы get_tasks с теми же фильтрами."""
+    where, params = _task_where(task_type, include_completed, filters, exclude)
+    return get_db_connection().execute(
+        f'SELECT COUNT(*) FROM {task_type} WHERE {" AND ".join(where)}', params).fetchone()[0]
+
+def get_task(task_type, task_id):
+    """Получает одну задачу по id (или None, если ее нет или она удалена)."""
+    rows = query_rows(task_type, f'SELECT * FROM {task_type} WHERE id = ? AND deleted_at IS NULL', (task_id,))
+    return rows[0] if rows else None
+
+def get_rows(table, ids):
+    """Строки table с указанными id, включая удаленные (для синхронизации после отмены команды)."""
+    return query_rows(table, f'SELECT * FROM {table} WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id',
+                      (json.dumps(list(ids)),))
+
+# Колонки, которые задает add_task, и их значения по умолчанию (name обязателен)
+_INSERT_COLUMNS = {
+    'habits': (('value_xp', 5), ('value_gold', 1)),
+    'dailies': (('frequency', 'daily'), ('value_xp', 10), ('value_gold', 5), ('penalty_hp', 10), ('next_due', None)),
+    'todos': (('notes', None), ('due_date', None), ('value_xp', 20), ('value_gold', 10), ('difficulty', 1)),
+}
+
+def _scheduled(task_type, data):
+    """data нового дейлика с next_due - первым сроком по frequency начиная с сегодня."""
+    if task_type != 'dailies' or data.get('next_due'):
+        return data
+    frequency = data.get('frequency') or recurrence.DEFAULT_FREQUENCY
+    recurrence.parse(frequency) # ValueError для неизвестного правила
+    return dict(data, next_due=recurrence.first_due(frequency, datetime.date.today()).isoformat())
+
+def scheduled_updates(task_type, updates):
+    """
+    updates с пересчитанным next_due, если меняется frequency дейлика.
+
+    ValueError для неизвестного правила повторения.
+    """
+    if task_type != 'dailies' or 'frequency' not in updates or 'next_due' in updates:
+        return updates
+    return _scheduled(task_type, updates)
 
 def add_task(task_type, data):
-    """Добавляет новую задачу."""
-    conn = get_db_connection()
-    if task_type == 'habits':
-        cursor = conn.execute(
-            'INSERT INTO habits (name, value_xp, value_gold) VALUES (?, ?, ?)',
-            (data['name'], data.get('value_xp', 5), data.get('value_gold', 1))
-        )
-    elif task_type == 'dailies':
-         cursor = conn.execute(
-            'INSERT INTO dailies (name, frequency, value_xp, value_gold, penalty_hp) VALUES (?, ?, ?, ?, ?)',
-            (data['name'], data.get('frequency', 'daily'), data.get('value_xp', 10), data.get('value_gold', 5), data.get('penalty_hp', 10))
-        )
-    elif task_type == 'todos':
-         cursor = conn.execute(
-            'INSERT INTO todos (name, notes, due_date, value_xp, value_gold, difficulty) VALUES (?, ?, ?, ?, ?, ?)',
-            (data['name'], data.get('notes'), data.get('due_date'), data.get('value_xp', 20), data.get('value_gold', 10), data.get('difficulty', 1))
-        )
-    else:
-        conn.close()
-        return None
-    new_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return new_id
+    """
+    Добавляет новую задачу. Если в data есть 'id', он используется как id строки.
 
-def update_task(task_type, task_id, updates):
-    """Обновляет задачу (например, отметка о выполнении)."""
+    Возвращает id новой строки или False для неизвестного типа задачи
+    (как update_task: WriteQueue сообщает о такой записи как об отклоненной).
+    """
+    if task_type not in _INSERT_COLUMNS:
+        log.warning("Error adding task: unknown task type %r", task_type)
+        return False
+    data = _scheduled(task_type, data)
+    columns = ['name'] + [column for column, _ in _INSERT_COLUMNS[task_type]]
+    params = [data['name']] + [data.get(column, default) for column, default in _INSERT_COLUMNS[task_type]]
+    if data.get('id') is not None: # id, выделенный заранее (см. TaskStore с WriteQueue)
+        columns.insert(0, 'id')
+        params.insert(0, data['id'])
+    placeholders = ', '.join('?' * len(columns))
+    with transaction() as conn:
+        cursor = conn.execute(f'INSERT INTO {task_type} ({", ".join(columns)}) VALUES ({placeholders})', params)
+    return cursor.lastrowid
+
+def new_task_row(task_type, data):
+    """Строка задачи, какой ее вернет БД после add_task(task_type, data), без обращения к таблице."""
+    row = {}
+    for column in get_db_connection().execute(f'PRAGMA table_info({task_type})'):
+        default = column['dflt_value']
+        if default == 'CURRENT_DATE': # В SQLite это дата по UTC
+            default = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+        elif default is not None:
+            default = ast.literal_eval(default) # '5' -> 5, "'daily'" -> 'daily'
+        row[column['name']] = default
+    row['name'] = data['name']
+    data = _scheduled(task_type, data)
+    for column, default in _INSERT_COLUMNS[task_type]:
+        row[column] = data.get(column, default)
+    row['id'] = data.get('id')
+    return row_class(task_type, tuple(row))(**row)
+
+def next_task_id(task_type):
+    """Следующий id, который AUTOINCREMENT выдал бы новой строке."""
     conn = get_db_connection()
-    # Строим строку SET динамически (будьте осторожны с SQL инъекциями, если данные от пользователя!)
-    set_clause = ", ".join([f"{key} = ?" for key in updates])
-    values = list(updates.values())
-    values.append(task_id)
+    seq = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (task_type,)).fetchone()
+    max_id = conn.execute(f'SELECT MAX(id) FROM {task_type}').fetchone()[0]
+    return max(seq[0] if seq else 0, max_id or 0) + 1
 
+def update_task(task_type, task_id, updates):
+    """Обновляет задачу (например, отметка о выполнении). Колонки - только из UPDATABLE_COLUMNS."""
     try:
-        conn.execute(f'UPDATE {task_type} SET {set_clause} WHERE id = ?', tuple(values))
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Error updating task: {e}")
-    finally:
-        conn.close()
+        updates = scheduled_updates(task_type, updates)
+        sql = update_statement(task_type, tuple(updates))
+        with transaction() as conn:
+            conn.execute(sql, (*updates.values(), task_id))
+    except (sqlite3.Error, ValueError) as e:
+        log.warning("Error updating task: %s", e)
+        return False
+    return True
 
 def delete_task(task_type, task_id):
-    conn = get_db_connection()
-    conn.execute(f'DELETE FROM {task_type} WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
+    delete_tasks(task_type, [task_id])
+
+def delete_tasks(task_type, task_ids):
+    """
+    Мягко удаляет задачи: строки остаются с отметкой deleted_at и скрыты из
+    get_tasks, поэтому удаление можно отменить. Окончательно их стирает
+    commands.compact().
+    """
+    with transaction() as conn:
+        conn.execute(f'''
+            UPDATE {task_type} SET deleted_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT value FROM json_each(?)) AND deleted_at IS NULL
+        ''', (json.dumps(list(task_ids)),))
+
+# --- Журнал событий ---
+def record_task_event(task_type, task_id, kind, day=None, xp=0, gold=0, hp=0):
+    """Записывает событие (выполнение, срабатывание, покупку) и обновляет streak/counter задачи."""
+    with transaction() as conn:
+        return task_events.record_event(conn, task_type, task_id, kind, day, xp, gold, hp)
+
+def get_task_events(task_type, task_id):
+    return task_events.get_events(get_db_connection(), task_type, task_id)
+
+def replay_task_events():
+    """Пересобирает streak/counter/last_* всех задач и сводки статистики из журнала событий."""
+    with transaction() as conn:
+        for task_type in task_events.PROJECTIONS:
+            task_events.replay(conn, task_type)
+        task_events.rebuild_rollups(conn)
+
+# --- Поиск ---
+def search_tasks(text, task_type=None, limit=None):
+    """Полнотекстовый поиск по названиям и заметкам: [(task_type, id), ...] от лучшего совпадения."""
+    return search.search(get_db_connection(), text, task_type, limit)
 
 # --- Функции для Наград ---
 def get_rewards(owned_only=False):
-    conn = get_db_connection()
     query = 'SELECT * FROM rewards'
     if owned_only:
         query += ' WHERE owned = 1'
-    rewards = conn.execute(query).fetchall()
-    conn.close()
-    return [dict(r) for r in rewards]
+    return query_rows('rewards', query)
 
 def update_reward(reward_id, updates):
-     conn = get_db_connection()
-     set_clause = ", ".join([f"{key} = ?" for key in updates])
-     values = list(updates.values())
-     values.append(reward_id)
-     conn.execute(f'UPDATE rewards SET {set_clause} WHERE id = ?', tuple(values))
-     conn.commit()
-     conn.close()
+    sql = update_statement('rewards', tuple(updates)) # ValueError для неизвестной колонки
+    with transaction() as conn:
+        conn.execute(sql, (*updates.values(), reward_id))
 
 
 # --- Функции для ежедневного сброса и проверки ---
-def daily_reset():
-    """Сбрасывает статус 'completed_today' для дейликов и начисляет штрафы."""
-    conn = get_db_connection()
-    today = datetime.date.today()
-    yesterday = today - datetime.timedelta(days=1)
-    character_data = dict(conn.execute('SELECT health, max_health FROM character WHERE id = 1').fetchone())
-    health_lost = 0
-
-    # Проверяем вчерашние дейлики
-    dailies_to_check = conn.execute('SELECT id, completed_today, last_completed, penalty_hp, streak FROM dailies').fetchall()
-
-    for daily in dailies_to_check:
-        daily_dict = dict(daily)
-        last_comp_date = None
-        if daily_dict['last_completed']:
-            last_comp_date = datetime.datetime.strptime(daily_dict['last_completed'], '%Y-%m-%d').date()
-
-        # Если дейлик не был выполнен вчера (или никогда) и должен был быть
-        # Упрощение: пока считаем все дейлики ежедневными
-        # TODO: Добавить логику для frequency
-        if last_comp_date != today: # Если сегодня еще не выполнен
-             # Если вчера не был выполнен или был пропущен день
-            if not daily_dict['completed_today'] or (last_comp_date and last_comp_date < yesterday):
-                 # Штраф!
-                 health_lost += daily_dict['penalty_hp']
-                 # Сброс стрика
-                 conn.execute('UPDATE dailies SET streak = 0 WHERE id = ?', (daily_dict['id'],))
-                 print(f"Daily '{daily_dict['id']}' missed. Penalty: {daily_dict['penalty_hp']} HP. Streak reset.")
-            elif daily_dict['completed_today'] and last_comp_date == yesterday:
-                 # Был выполнен вчера, сегодня сбрасываем для нового выполнения
-                 pass # Стрик сохраняется
-
-            # Сбрасываем флаг выполнения на сегодня
-            conn.execute('UPDATE dailies SET completed_today = 0 WHERE id = ?', (daily_dict['id'],))
+def daily_reset(today=None):
+    """
+    Начисляет штрафы за пропущенные сроки дейликов (по их frequency) и снимает
+    'completed_today' с дейликов, которые пора выполнять снова.
 
+    today - дата сброса (по умолчанию сегодняшняя).
+    """
+    with transaction() as conn:
+        _daily_reset(conn, today)
+
+# Срок дейлика (next_due) наступил: он выполняется сегодня. Строки выбираются
+# по частичному индексу idx_dailies_next_due, остальные дейлики не читаются.
+# Удаленные (deleted_at) дейлики не сбрасываются и не штрафуют
+_DAILY_DUE = "deleted_at IS NULL AND next_due <= :today"
+# Срок прошел, а выполнения не было (выполнение переносит next_due вперед)
+_DAILY_MISSED = "deleted_at IS NULL AND next_due < :today"
+
+def _daily_reset(conn, today=None):
+    today = today or datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    params = {'today': today.isoformat(), 'yesterday': yesterday.isoformat()}
+    recurrence.schedule_missing(conn, today) # Строки, вставленные мимо add_task и импорта
+
+    # Суммарный штраф считаем одним агрегатом, а не циклом по строкам
+    missed_count, health_lost = conn.execute(
+        f'SELECT COUNT(*), COALESCE(SUM(penalty_hp), 0) FROM dailies WHERE {_DAILY_MISSED}', params
+    ).fetchone()
+
+    if missed_count:
+        # Пропуск пишется в журнал (за пропущенный срок), стрик сбрасывается как его проекция;
+        # следующий срок - первый по расписанию начиная с сегодня
+        task_events.record_misses(conn, _DAILY_MISSED, params)
+        conn.execute(f'UPDATE dailies SET streak = 0, completed_today = 0, '
+                     f'next_due = {recurrence.SQL_FUNCTION}(frequency, :yesterday) '
+                     f'WHERE {_DAILY_MISSED}', params)
+        log.info("%d dailies missed. Streaks reset.", missed_count)
+
+    # Снимаем отметку выполнения с дейликов, которые пора выполнять снова
+    conn.execute(f'UPDATE dailies SET completed_today = 0 WHERE {_DAILY_DUE} AND completed_today != 0', params)
 
     if health_lost > 0:
-        new_health = max(0, character_data['health'] - health_lost)
+        health = conn.execute('SELECT health FROM character WHERE id = 1').fetchone()[0]
+        new_health = max(0, health - health_lost)
         conn.execute('UPDATE character SET health = ? WHERE id = 1', (new_health,))
-        print(f"Total health lost from missed dailies: {health_lost}. New health: {new_health}")
-
-    conn.commit()
-    conn.close()
+        log.info("Total health lost from missed dailies: %d. New health: %d", health_lost, new_health)
+
+def get_last_run_date():
+    """Дата последнего запуска текущей БД ('YYYY-MM-DD' или None)."""
+    row = get_db_connection().execute("SELECT value FROM app_state WHERE key = 'last_run_date'").fetchone()
+    if row:
+        return row[0]
+    # БД, созданная до миграции 005: дата лежала в файле рядом с rpg_life.db
+    if os.path.abspath(DB_NAME) == os.path.abspath(DEFAULT_DB_NAME) and os.path.exists(LEGACY_LAST_RUN_FILE):
+        with open(LEGACY_LAST_RUN_FILE, 'r') as f:
+            return f.read().strip()
+    return None
 
 def check_last_run_date():
-    """Проверяет, запускалось ли приложение сегодня. Если нет, выполняет daily_reset."""
-    filepath = '.last_run_date'
+    """
+    Проверяет, запускался ли текущий профиль сегодня. Если нет, выполняет daily_reset.
+
+    Дата последнего запуска хранится в самой БД (таблица app_state) и
+    обновляется в одной транзакции со сбросом. Возвращает True, если сброс был.
+    """
     today_str = str(datetime.date.today())
-    try:
-        with open(filepath, 'r') as f:
-            last_run_date_str = f.read().strip()
-    except FileNotFoundError:
-        last_run_date_str = ''
-
-    if last_run_date_str != today_str:
-        print("First run of the day or missed days. Running daily reset...")
-        daily_reset()
-        with open(filepath, 'w') as f:
-            f.write(today_str)
-        print("Daily reset complete.")
-    else:
-        print("Already ran today.")
+    if get_last_run_date() == today_str:
+        log.debug("Already ran today.")
+        return False
+    log.info("First run of the day or missed days. Running daily reset...")
+    with transaction() as conn:
+        _daily_reset(conn)
+        conn.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES ('last_run_date', ?)", (today_str,))
+    log.debug("Daily reset complete.")
+    return True
 
 if __name__ == '__main__':
     # Этот блок выполнится, только если запустить database.py напрямую
     # Используется для первоначальной инициализации БД
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(name)s: %(message)s')
     print("Initializing database...")
     init_db()
     print("--- Initial Character Data ---")
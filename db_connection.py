@@ -0,0 +1,82 @@
+# db_connection.py
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# PRAGMA применяются один раз при открытии соединения
+PRAGMAS = (
+    ('journal_mode', 'WAL'),        # Читатели не блокируют писателя
+    ('synchronous', 'NORMAL'),      # В режиме WAL это безопасно и гораздо быстрее FULL
+    ('mmap_size', 64 * 1024 * 1024),
+    ('cache_size', -16000),         # Отрицательное значение - в КБ (~16 МБ)
+    ('temp_store', 'MEMORY'),
+)
+
+
+class ConnectionManager:
+    """
+    Держит одно долгоживущее соединение с БД на поток.
+
+    on_connect(conn) вызывается для каждого нового соединения после PRAGMA -
+    например, чтобы зарегистрировать функции SQL.
+    """
+
+    def __init__(self, db_name, on_connect=None):
+        self.db_name = db_name
+        self.on_connect = on_connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        """Возвращает соединение текущего потока, открывая его при первом обращении."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: транзакциями управляем сами через transaction()
+            conn = sqlite3.connect(self.db_name, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row # Возвращает строки как словари
+            for name, value in PRAGMAS:
+                conn.execute(f'PRAGMA {name} = {value}')
+            if self.on_connect:
+                self.on_connect(conn)
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Контекстный менеджер транзакции.
+
+        Вложенные вызовы в одном потоке присоединяются к внешней транзакции:
+        COMMIT/ROLLBACK выполняет только самый внешний блок.
+        """
+        conn = self.connection()
+        depth = self._local.depth
+        if depth == 0:
+            # IMMEDIATE: блокировка записи берется сразу, а не при первом UPDATE,
+            # поэтому параллельный поток-писатель не вызывает SQLITE_BUSY посреди транзакции
+            conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if depth == 0 and conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        else:
+            self._local.depth = depth
+            if depth == 0:
+                conn.execute('COMMIT')
+
+    def close(self):
+        """Закрывает все открытые этим менеджером соединения (во всех потоках)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        # Соединения других потоков забудутся при их следующем обращении
+        self._local = threading.local()
@@ -0,0 +1,27 @@
+# game_core.py
+# Правила игры без зависимостей от Pygame: их можно импортировать без окна.
+import logging
+import progression
+
+log = logging.getLogger(__name__)
+
+def gain_xp_gold(character, xp_gain, gold_gain):
+    """Начисляет опыт и золото, проверяет левел-ап (все уровни сразу, см. progression)."""
+    log.debug("Gained %s XP, %s Gold.", xp_gain, gold_gain)
+    levels = progression.apply_grant(character, xp=xp_gain, gold=gold_gain)
+    if levels:
+        log.info("LEVEL UP! Reached Level %s!", character['level'])
+        # Можно добавить звук или визуальный эффект
+
+def lose_xp_gold(character, xp_loss, gold_loss):
+    """Снимает опыт и золото (снятая отметка выполнения), при нехватке опыта - с потерей уровней."""
+    log.debug("Lost %s XP, %s Gold.", xp_loss, gold_loss)
+    levels = progression.revoke_grant(character, xp=xp_loss, gold=gold_loss)
+    if levels:
+        log.info("Level down: back to Level %s.", character['level'])
+
+def lose_health(character, hp_loss):
+    """Отнимает здоровье."""
+    character['health'] = max(0, character['health'] - hp_loss)
+    log.debug("Lost %s Health. Current: %s", hp_loss, character['health'])
+    # Что происходит при 0 HP? Может быть, дебафф или временная блокировка наград? Пока просто 0.
@@ -0,0 +1,46 @@
+# hit_index.py
+import pygame
+
+HIT_CELL_SIZE = 32 # Сопоставимо с размером кнопок (24px)
+
+
+class HitGrid:
+    """
+    Равномерная сетка кликабельных зон для поиска по точке за O(1).
+
+    Каждая зона заносится во все ячейки, которые она задевает; запрос
+    проверяет только зоны своей ячейки. При перекрытии побеждает зона,
+    добавленная первой (как при прежнем линейном переборе).
+    """
+
+    def __init__(self, bounds, cell_size=HIT_CELL_SIZE):
+        self.bounds = pygame.Rect(bounds)
+        self.cell_size = cell_size
+        self._cells = {} # (col, row) -> [(rect, payload), ...]
+
+    def _cell_range(self, rect):
+        rect = rect.clip(self.bounds)
+        if not rect.width or not rect.height:
+            return
+        size = self.cell_size
+        for col in range((rect.left - self.bounds.left) // size, (rect.right - 1 - self.bounds.left) // size + 1):
+            for row in range((rect.top - self.bounds.top) // size, (rect.bottom - 1 - self.bounds.top) // size + 1):
+                yield col, row
+
+    def insert(self, rect, payload):
+        rect = pygame.Rect(rect)
+        for cell in self._cell_range(rect):
+            self._cells.setdefault(cell, []).append((rect, payload))
+
+    def query(self, pos):
+        """Зона под точкой (payload) или None."""
+        if not self.bounds.collidepoint(pos):
+            return None
+        cell = ((pos[0] - self.bounds.left) // self.cell_size, (pos[1] - self.bounds.top) // self.cell_size)
+        for rect, payload in self._cells.get(cell, ()):
+            if rect.collidepoint(pos):
+                return payload
+        return None
+
+    def clear(self):
+        self._cells.clear()
@@ -0,0 +1,256 @@
+# importer.py
+# Потоковый импорт задач из CSV / JSON / JSON Lines (в том числе экспорта Habitica).
+# Строки проходят конвейер генераторов: чтение -> нормализация -> проверка,
+# и пишутся пачками через executemany, по одной транзакции на пачку.
+# В памяти одновременно держится не больше одной пачки.
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+import database
+import recurrence
+import search
+import task_events
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100 # Остальные отклоненные строки только считаются
+
+# Колонки, которые импорт заполняет в каждой таблице, и значения по умолчанию
+IMPORT_COLUMNS = {
+    'habits': (('value_xp', 5), ('value_gold', 1), ('counter', 0)),
+    'dailies': (('frequency', 'daily'), ('value_xp', 10), ('value_gold', 5), ('penalty_hp', 10),
+                ('streak', 0), ('last_completed', None), ('next_due', None)),
+    'todos': (('notes', None), ('due_date', None), ('creation_date', None), ('completed', 0),
+              ('value_xp', 20), ('value_gold', 10), ('difficulty', 1)),
+}
+INTEGER_COLUMNS = {'value_xp', 'value_gold', 'counter', 'penalty_hp', 'streak', 'completed', 'difficulty'}
+DATE_COLUMNS = {'last_completed', 'due_date', 'creation_date', 'next_due'}
+
+# Разные названия одного поля (ключи приводятся к нижнему регистру)
+FIELD_ALIASES = {
+    'task name': 'name', 'text': 'name', 'title': 'name',
+    'task type': 'type', 'task_type': 'type',
+    'note': 'notes', 'description': 'notes',
+    'date': 'due_date', 'due': 'due_date',
+    'date created': 'creation_date', 'createdat': 'creation_date',
+    'counterup': 'counter',
+    'xp': 'value_xp', 'gold': 'value_gold',
+}
+TYPE_ALIASES = {
+    'habit': 'habits', 'habits': 'habits',
+    'daily': 'dailies', 'dailys': 'dailies', 'dailies': 'dailies',
+    'todo': 'todos', 'todos': 'todos', 'to-do': 'todos',
+}
+# Сложность в Habitica (priority) -> difficulty
+HABITICA_PRIORITY = {0.1: 1, 1.0: 2, 1.5: 3, 2.0: 4}
+WEEKDAYS = {'su': 'Sun', 'm': 'Mon', 't': 'Tue', 'w': 'Wed', 'th': 'Thu', 'f': 'Fri', 's': 'Sat'}
+
+RejectedRow = namedtuple('RejectedRow', 'row_number reason')
+ImportResult = namedtuple('ImportResult', 'imported rejected errors')
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+# --- Чтение ---
+def read_rows(path, task_type=None):
+    """Строки файла как словари; формат определяется по расширению."""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if extension == '.csv':
+            rows = csv.DictReader(f)
+        elif extension in ('.jsonl', '.ndjson'):
+            rows = (json.loads(line) for line in f if line.strip())
+        elif extension == '.json':
+            rows = _read_json(f)
+        else:
+            raise ValueError(f"Unsupported file format: {extension}")
+        for row in rows:
+            if task_type and not row.get('type'):
+                row['type'] = task_type
+            yield row
+
+def _read_json(f, block_size=64 * 1024):
+    """
+    Элементы JSON-массива по одному, без загрузки файла целиком.
+
+    Объект верхнего уровня (экспорт Habitica: {"tasks": {"habits": [...], ...}})
+    читается целиком - такие файлы небольшие.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(block_size).lstrip()
+    if buffer.startswith('{'):
+        data = json.loads(buffer + f.read())
+        tasks = data.get('tasks', data)
+        for key, items in tasks.items():
+            if isinstance(items, list):
+                for item in items:
+                    item.setdefault('type', key)
+                    yield item
+        return
+    if not buffer.startswith('['):
+        raise ValueError("JSON file must contain an array or an object")
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            more = f.read(block_size)
+            if not more:
+                raise
+            buffer += more
+            continue
+        yield item
+        buffer = buffer[end:]
+
+# --- Нормализация и проверка ---
+def normalize(row):
+    """Приводит ключи к именам колонок и переводит поля Habitica в наши."""
+    result = {}
+    for key, value in row.items():
+        if key is None: # Лишние ячейки строки CSV
+            continue
+        key = key.strip().lower()
+        result[FIELD_ALIASES.get(key, key)] = value.strip() if isinstance(value, str) else value
+    priority = result.pop('priority', None)
+    if priority not in (None, '') and 'difficulty' not in result:
+        result['difficulty'] = HABITICA_PRIORITY.get(float(priority), 1)
+    repeat = result.pop('repeat', None)
+    if result.get('frequency') == 'weekly' and isinstance(repeat, dict):
+        days = [name for key, name in WEEKDAYS.items() if repeat.get(key)]
+        result['frequency'] = 'weekly:' + ','.join(days) if days else 'daily'
+    return result
+
+def _date(value):
+    """'2024-03-01' или '2024-03-01T10:00:00Z' -> '2024-03-01'."""
+    try:
+        return datetime.date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        raise InvalidRow(f"bad date: {value!r}")
+
+def _integer(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return int(value.lower() == 'true')
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        raise InvalidRow(f"bad number: {value!r}")
+
+def to_params(row, today):
+    """(task_type, кортеж значений колонок) для executemany; InvalidRow, если строка негодна."""
+    task_type = TYPE_ALIASES.get(str(row.get('type', '')).lower())
+    if task_type is None:
+        raise InvalidRow(f"unknown task type: {row.get('type')!r}")
+    name = row.get('name')
+    if not name:
+        raise InvalidRow("name is empty")
+    values = {}
+    for column, default in IMPORT_COLUMNS[task_type]:
+        value = row.get(column)
+        if value in (None, ''):
+            value = today if column == 'creation_date' else default
+        elif column in INTEGER_COLUMNS:
+            value = _integer(value)
+        elif column in DATE_COLUMNS:
+            value = _date(value)
+        else:
+            value = str(value)
+        values[column] = value
+    if task_type == 'dailies':
+        recurrence.parse(values['frequency']) # ValueError: строка отклоняется
+        if values['next_due'] is None:
+            # Срок считается от последнего выполнения, как при миграции старой БД
+            values['next_due'] = recurrence.initial_due(values['frequency'], values['last_completed'],
+                                                        datetime.date.today()).isoformat()
+    return task_type, (str(name), *values.values())
+
+def validated(rows, rejected, today):
+    """Генератор (task_type, params); отклоненные строки складываются в rejected."""
+    for row_number, row in enumerate(rows, 1):
+        try:
+            yield to_params(normalize(row), today)
+        except (InvalidRow, ValueError, AttributeError) as e:
+            rejected['count'] += 1
+            if len(rejected['errors']) < MAX_REPORTED_ERRORS:
+                rejected['errors'].append(RejectedRow(row_number, str(e)))
+
+# --- Запись ---
+def _write_chunk(chunk):
+    """Пишет пачку {task_type: [params, ...]} в одной транзакции."""
+    # Поисковый индекс пополняется одним запросом на пачку, а не триггером на строку
+    with database.transaction() as conn, search.bulk_load(conn):
+        for task_type, params in chunk.items():
+            if not params:
+                continue
+            columns = ['name'] + [column for column, _ in IMPORT_COLUMNS[task_type]]
+            max_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {task_type}').fetchone()[0]
+            conn.executemany(
+                f'INSERT INTO {task_type} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})', params
+            )
+            if task_type in task_events.PROJECTIONS:
+                # Импортированные streak/counter должны пережить replay журнала
+                task_events.record_baselines(conn, task_type, max_id)
+
+def import_rows(rows, chunk_size=CHUNK_SIZE, on_progress=None):
+    """
+    Импортирует поток строк-словарей в таблицы habits/dailies/todos.
+
+    on_progress(imported, rejected) вызывается после каждой записанной пачки.
+    Возвращает ImportResult: imported - {task_type: число}, rejected - число
+    отклоненных строк, errors - первые MAX_REPORTED_ERRORS причин.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date().isoformat() # Как CURRENT_DATE в SQLite
+    rejected = {'count': 0, 'errors': []}
+    imported = {task_type: 0 for task_type in IMPORT_COLUMNS}
+    chunk = {task_type: [] for task_type in IMPORT_COLUMNS}
+    pending = 0
+
+    def flush():
+        _write_chunk(chunk)
+        for task_type, params in chunk.items():
+            imported[task_type] += len(params)
+            params.clear()
+        if on_progress:
+            on_progress(sum(imported.values()), rejected['count'])
+
+    for task_type, params in validated(rows, rejected, today):
+        chunk[task_type].append(params)
+        pending += 1
+        if pending >= chunk_size:
+            flush()
+            pending = 0
+    if pending:
+        flush()
+    return ImportResult(imported, rejected['count'], rejected['errors'])
+
+def import_file(path, task_type=None, chunk_size=CHUNK_SIZE, on_progress=None):
+    """Импортирует файл CSV/JSON/JSONL. task_type - тип для строк без колонки type."""
+    return import_rows(read_rows(path, task_type), chunk_size, on_progress)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import tasks from CSV, JSON or JSON Lines.")
+    parser.add_argument('path')
+    parser.add_argument('--type', dest='task_type', help="task type for rows without a 'type' column")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(name)s: %(message)s')
+    database.init_db()
+    result = import_file(args.path, args.task_type, args.chunk_size,
+                         on_progress=lambda done, bad: print(f"\rImported {done} rows, rejected {bad}", end='', file=sys.stderr))
+    print(file=sys.stderr)
+    for error in result.errors:
+        print(f"Row {error.row_number}: {error.reason}")
+    print(f"Imported: {result.imported}. Rejected: {result.rejected}.")
+    database.close_db()
@@ -0,0 +1,56 @@
+# list_view.py
+import pygame
+
+
+class ListView:
+    """
+    Состояние прокрутки виртуализированного списка.
+
+    Прокрутка построчная: хранится индекс первой видимой строки. Функция
+    отрисовки сообщает через layout() сколько строк в списке и сколько
+    помещается, а затем рисует и проверяет клики только для window().
+    """
+
+    def __init__(self):
+        self.first = 0
+        self.count = 0
+        self.visible_rows = 0
+
+    def layout(self, count, visible_rows):
+        self.count = count
+        self.visible_rows = max(0, visible_rows)
+        self.first = self._clamp(self.first)
+
+    def _clamp(self, first):
+        return max(0, min(first, self.count - self.visible_rows))
+
+    @property
+    def overflows(self):
+        return self.count > self.visible_rows
+
+    def window(self):
+        """Диапазон индексов видимых строк."""
+        return range(self.first, min(self.count, self.first + self.visible_rows))
+
+    def scroll(self, rows):
+        """Прокручивает на rows строк; возвращает True, если позиция изменилась."""
+        first = self._clamp(self.first + rows)
+        changed = first != self.first
+        self.first = first
+        return changed
+
+    def scroll_page(self, pages):
+        return self.scroll(pages * max(1, self.visible_rows))
+
+    def scroll_to(self, first):
+        return self.scroll(first - self.first)
+
+    def thumb_rect(self, track):
+        """Прямоугольник ползунка полосы прокрутки внутри track (или None)."""
+        if not self.overflows:
+            return None
+        track = pygame.Rect(track)
+        height = max(10, track.height * self.visible_rows // self.count)
+        max_first = self.count - self.visible_rows
+        top = track.top + (track.height - height) * self.first // max_first
+        return pygame.Rect(track.left, top, track.width, height)
@@ -1,14 +1,27 @@
 # main.py
+import datetime
+import logging
 import pygame
 import sys
 import os
-import datetime
-from database import (
-    init_db, get_db_connection, get_character_data, update_character_data,
-    get_tasks, add_task, update_task, delete_task,
-    get_rewards, update_reward, check_last_run_date
+from database import get_character_data, check_last_run_date, close_db
+from text_cache import TextCache
+from text_layout import wrap_lines
+from panels import Panel, PanelLayer
+from scheduler import FrameScheduler
+from list_view import ListView
+from task_pages import TaskPager, LiveSearch
+from sprite_cache import SpriteCache
+from write_queue import WriteQueue
+from profiler import FrameProfiler
+from profiles import DEFAULT_PROFILE, ProfileManager
+import recurrence
+from commands import (
+    CommandHistory, AddTask, DeleteTasks, UpdateTask, CompleteTask, UncompleteTask, BuyReward, EquipReward, compact
 )
 
+log = logging.getLogger(__name__)
+
 # --- Константы ---
 SCREEN_WIDTH = 1024
 SCREEN_HEIGHT = 768
@@ -33,53 +46,88 @@ INPUT_BOX_BORDER_COLOR = BLACK
 INPUT_TEXT_COLOR = BLACK
 INPUT_ACTIVE_BORDER_COLOR = BLUE
 
+SCROLLBAR_WIDTH = 6
+SCROLL_WHEEL_ROWS = 3 # Строк за один щелчок колеса мыши
+SEARCH_RESULTS_LIMIT = 1000 # Сколько лучших совпадений поиска показывать в колонках
+# Порядки колонок (клик по заголовку - следующий): (подпись, ключи get_tasks).
+# None - порядок по умолчанию (database.DEFAULT_SORT). Любой порядок читается
+# из БД страницами (TaskPager), под каждый есть индекс (миграции 002 и 008)
+SORT_MODES = {
+    'habits': (('Added', None), ('Count', ('-counter',))),
+    'dailies': (('Added', None), ('Streak', ('-streak',))),
+    'todos': (('Added', None), ('Due', ('due_date',)), ('Hardest', ('-difficulty',)), ('XP', ('-value_xp',))),
+}
+
+FPS = 30 # Частота кадров, пока открыт попап
+WRITE_ERROR_EVENT = pygame.USEREVENT + 1 # Поток-писатель сообщает о неудачной записи в БД
+WRITE_COMMITTED_EVENT = pygame.USEREVENT + 2 # Поток-писатель выполнил пачку записей
+# Остальные события не будят цикл в простое; MOUSEMOTION нужен для подсветки под курсором
+ALLOWED_EVENTS = [pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.MOUSEMOTION, pygame.MOUSEWHEEL, pygame.VIDEOEXPOSE,
+                  WRITE_ERROR_EVENT, WRITE_COMMITTED_EVENT]
+
+
+# Профилировщик фаз кадра: F3 - оверлей с перцентилями, F4 - выгрузка трассы
+PROFILER = FrameProfiler()
+PROFILE_FILE = 'frame_profile.json'
+TRACE_FILE = 'frame_trace.json' # Формат Chrome trace (chrome://tracing, Perfetto)
+LOG_LEVEL_ENV = 'HIEROPHANT_LOG' # Например, HIEROPHANT_LOG=debug python main.py
+
+# Кэш отрисованного текста: большинство надписей не меняется от кадра к кадру
+TEXT_CACHE_CAPACITY = 1024
+TEXT_CACHE = TextCache(TEXT_CACHE_CAPACITY)
+
+def render_text(font, text, aa, color, bkg=None):
+    """font.render(...) через общий LRU-кэш."""
+    return TEXT_CACHE.render(font, text, aa, color, bkg)
+
+# --- Спрайты ---
+# Декодируются лениво по ключу (файл, размер); см. SpriteCache
+ICON_SIZE = (24, 24)
+AVATAR_SIZE = (64, 64)
+REWARD_ICON_SIZE = (32, 32)
+UI_SPRITES = [
+    ('checkmark.png', ICON_SIZE),
+    ('x_button.png', ICON_SIZE),
+    ('character.png', AVATAR_SIZE),
+    ('feather.png', REWARD_ICON_SIZE), # Иконка кнопки редактирования
+]
+SPRITES = SpriteCache(ASSETS_FOLDER, fallback_color=RED)
+
+def build_background(tile):
+    """Создает тайловый фон, если спрайт загрузился."""
+    background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    if tile.get_width() > 1: # Проверка что не заглушка
+        bw, bh = tile.get_size()
+        for y in range(0, SCREEN_HEIGHT, bh):
+            for x in range(0, SCREEN_WIDTH, bw):
+                background.blit(tile, (x, y))
+    else:
+        background.fill(DEFAULT_BG_COLOR) # Используем сплошной цвет, если фона нет
+    return background
 
 # --- Инициализация Pygame ---
-pygame.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("RPG Life Tracker")
-clock = pygame.time.Clock()
-FONT_SMALL = pygame.font.SysFont(None, 24)
-FONT_MEDIUM = pygame.font.SysFont(None, 36)
-FONT_LARGE = pygame.font.SysFont(None, 48)
-
-# --- Загрузка спрайтов ---
-def load_sprite(name, size=None):
-    """Загружает спрайт из папки assets."""
-    path = os.path.join(ASSETS_FOLDER, name)
-    try:
-        image = pygame.image.load(path).convert_alpha()
-        if size:
-            image = pygame.transform.scale(image, size)
-        return image
-    except pygame.error as e:
-        print(f"Cannot load image: {name} - {e}")
-        # Возвращаем заглушку
-        fallback = pygame.Surface(size if size else (32, 32))
-        fallback.fill(RED)
-        return fallback
-
-SPRITES = {
-    'checkmark': load_sprite('checkmark.png', (24, 24)),
-    'x_button': load_sprite('x_button.png', (24, 24)),
-    'character': load_sprite('character.png', (64, 64)),
-    'background_tile': load_sprite('background.png'), # Пиксельный фон
-    # Добавим спрайты наград
-    'axe': load_sprite('axe.png', (32, 32)),
-    'dragon': load_sprite('dragon.png', (32, 32)),
-    'feather': load_sprite('feather.png', (32, 32)),
-    'creature': load_sprite('creature.png', (32, 32)),
-    'map_study': load_sprite('map_study.png', (32, 32)),
-}
-# Создаем тайловый фон, если спрайт загрузился
-BG_SURFACE = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-if SPRITES['background_tile'].get_width() > 1: # Проверка что не заглушка
-    bw, bh = SPRITES['background_tile'].get_size()
-    for y in range(0, SCREEN_HEIGHT, bh):
-        for x in range(0, SCREEN_WIDTH, bw):
-            BG_SURFACE.blit(SPRITES['background_tile'], (x, y))
-else:
-    BG_SURFACE.fill(DEFAULT_BG_COLOR) # Используем сплошной цвет, если фона нет
+# Окно, шрифты и спрайты создаются в init_display(), а не при импорте модуля:
+# импорт main.py (например, из тестов) не открывает окно и не читает assets/.
+screen = None
+FONT_SMALL = FONT_MEDIUM = FONT_LARGE = None
+BG_SURFACE = None
+
+def init_display():
+    """Инициализирует Pygame, окно, шрифты и спрайты. Повторные вызовы ничего не делают."""
+    global screen, FONT_SMALL, FONT_MEDIUM, FONT_LARGE, BG_SURFACE
+    if screen is not None and pygame.display.get_init():
+        return screen
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("RPG Life Tracker")
+    FONT_SMALL = pygame.font.SysFont(None, 24)
+    FONT_MEDIUM = pygame.font.SysFont(None, 36)
+    FONT_LARGE = pygame.font.SysFont(None, 48)
+
+    # Иконки интерфейса декодируются в фоне, пока строится фон и открывается БД
+    SPRITES.prefetch(UI_SPRITES)
+    BG_SURFACE = build_background(SPRITES.get('background.png')) # Пиксельный фон
+    return screen
 
 # --- Вспомогательные функции ---
 def draw_text(surface, text, font, color, rect, aa=True, bkg=None):
@@ -90,28 +138,20 @@ def draw_text(surface, text, font, color, rect, aa=True, bkg=None):
     # Получаем высоту шрифта
     fontHeight = font.size("Tg")[1]
 
-    while text:
-        i = 1
-        # Определяем, сколько текста помещается в строку
+    # Переносы считаются один раз на (text, font, width) и берутся из кэша
+    drawn = 0
+    for line in wrap_lines(text, font, rect.width):
         if y + fontHeight > rect.bottom:
             break
-        while font.size(text[:i])[0] < rect.width and i < len(text):
-            i += 1
-        # Если текст не поместился, ищем последний пробел
-        if i < len(text):
-            i = text.rfind(" ", 0, i) + 1
-        if i == 0: # Если слово слишком длинное
-            i = 1 # Рисуем по одной букве, чтобы избежать бесконечного цикла
 
         # Отрисовываем строку
-        image = font.render(text[:i], aa, color, bkg)
+        image = render_text(font, line, aa, color, bkg)
         surface.blit(image, (rect.left, y))
         y += fontHeight + lineSpacing
+        drawn += len(line)
 
-        # Убираем отрисованную часть текста
-        text = text[i:]
-
-    return text
+    # Возвращаем не поместившуюся часть текста
+    return text[drawn:]
 
 def draw_progress_bar(surface, x, y, w, h, current, maximum, color, label=""):
     """Рисует полосу прогресса."""
@@ -121,10 +161,18 @@ def draw_progress_bar(surface, x, y, w, h, current, maximum, color, label=""):
     pygame.draw.rect(surface, color, (x, y, int(w * fill_ratio), h))
     pygame.draw.rect(surface, BLACK, (x, y, w, h), 1) # Обводка
     bar_text = f"{label}{int(current)} / {int(maximum)}"
-    text_surf = FONT_SMALL.render(bar_text, True, WHITE)
+    text_surf = render_text(FONT_SMALL, bar_text, True, WHITE)
     text_rect = text_surf.get_rect(center=(x + w / 2, y + h / 2))
     surface.blit(text_surf, text_rect)
 
+def draw_scrollbar(surface, view, track_rect):
+    """Рисует полосу прокрутки списка, если он не помещается целиком."""
+    thumb_rect = view.thumb_rect(track_rect)
+    if thumb_rect is None:
+        return
+    pygame.draw.rect(surface, DARK_GRAY, track_rect, border_radius=3)
+    pygame.draw.rect(surface, WHITE, thumb_rect, border_radius=3)
+
 def draw_input_popup(surface, mode, input_data, active_field):
     """Рисует всплывающее окно для ввода данных задачи."""
     popup_width = 400
@@ -134,14 +182,14 @@ def draw_input_popup(surface, mode, input_data, active_field):
     if mode == 'Habit': 
         fields_to_draw = [('name', 'Name:')]  # Removed type field
     elif mode == 'Daily': 
-        fields_to_draw = [('name', 'Name:')]
+        fields_to_draw = [('name', 'Name:'), ('frequency', 'Repeat:')] # 'weekly:Mon,Wed', 'monthly:1'; пусто - каждый день
     elif mode == 'To-Do': 
         fields_to_draw = [('name', 'Name:'), ('notes', 'Notes (opt):')]
     else: 
         return {}, None
 
     if not fields_to_draw and mode not in ['Habit', 'Daily', 'To-Do']: # Добавил проверку, если mode правильный, но список полей пуст
-         print(f"  ERROR in draw_input_popup: Unknown mode '{mode}' or empty fields_to_draw.")
+         log.error("draw_input_popup: unknown mode %r or empty fields_to_draw", mode)
          return {}, None
 
     num_fields = len(fields_to_draw)
@@ -159,25 +207,22 @@ def draw_input_popup(surface, mode, input_data, active_field):
     popup_rect = pygame.Rect(popup_x, popup_y, popup_width, required_height)
 
 
-     # !!! ДОБАВИТЬ ПРОВЕРКИ ЗДЕСЬ !!!
-    print(f"  Inside draw_input_popup: mode={mode}, num_fields={num_fields}")
-    print(f"  Calculated required_height: {required_height}")
-    print(f"  Calculated popup_rect: {popup_rect}")
+    # Отладка: аргументы форматируются, только если включен уровень DEBUG
+    log.debug("draw_input_popup: mode=%s, num_fields=%d, required_height=%d, popup_rect=%s",
+              mode, num_fields, required_height, popup_rect)
     if not pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT).contains(popup_rect):
-        print(f"  WARNING: popup_rect {popup_rect} is outside screen bounds!")
+        log.warning("popup_rect %s is outside screen bounds", popup_rect)
     elif popup_rect.width <= 0 or popup_rect.height <= 0:
-        print(f"  WARNING: popup_rect {popup_rect} has zero or negative size!")
-    # !!! КОНЕЦ ДОБАВЛЕННЫХ ПРОВЕРОК !!!
+        log.warning("popup_rect %s has zero or negative size", popup_rect)
 
 
     # 1. Рисуем фон и рамку правильного размера
     pygame.draw.rect(surface, INPUT_BOX_COLOR, popup_rect, border_radius=10)
     pygame.draw.rect(surface, INPUT_BOX_BORDER_COLOR, popup_rect, 2, border_radius=10)
-    # print(f"Drawing popup background with final rect: {popup_rect}") # Отладка
 
     # 2. Рисуем заголовок
     title = f"Add New {mode.capitalize()}"
-    title_surf = FONT_MEDIUM.render(title, True, BLACK)
+    title_surf = render_text(FONT_MEDIUM, title, True, BLACK)
     surface.blit(title_surf, (popup_rect.x + 15, popup_rect.y + 15))
 
     # 3. Рисуем поля ввода
@@ -188,7 +233,7 @@ def draw_input_popup(surface, mode, input_data, active_field):
 
     for field_key, label_text in fields_to_draw:
         # Метка
-        label_surf = FONT_SMALL.render(label_text, True, BLACK)
+        label_surf = render_text(FONT_SMALL, label_text, True, BLACK)
         surface.blit(label_surf, (popup_rect.x + 15, current_field_y + 5))
 
         # Поле ввода
@@ -200,7 +245,7 @@ def draw_input_popup(surface, mode, input_data, active_field):
 
         # Текст внутри поля + Курсор
         text_to_render = input_data.get(field_key, '')
-        text_surf = FONT_SMALL.render(text_to_render, True, INPUT_TEXT_COLOR)
+        text_surf = render_text(FONT_SMALL, text_to_render, True, INPUT_TEXT_COLOR)
         text_rect_in_box = text_surf.get_rect(topleft=(input_rect.x + 5, input_rect.y + 5))
         # Ограничиваем ширину текста для отрисовки
         visible_width = min(text_rect_in_box.width, input_rect.width - 10)
@@ -226,59 +271,45 @@ def draw_input_popup(surface, mode, input_data, active_field):
     pygame.draw.rect(surface, GREEN, save_rect, border_radius=5)
     pygame.draw.rect(surface, RED, cancel_rect, border_radius=5)
 
-    save_text = FONT_SMALL.render("Save", True, WHITE)
-    cancel_text = FONT_SMALL.render("Cancel", True, WHITE)
+    save_text = render_text(FONT_SMALL, "Save", True, WHITE)
+    cancel_text = render_text(FONT_SMALL, "Cancel", True, WHITE)
     surface.blit(save_text, save_text.get_rect(center=save_rect.center))
     surface.blit(cancel_text, cancel_text.get_rect(center=cancel_rect.center))
 
     # Добавляем кнопки в кликабельные зоны
     click_areas['save'] = save_rect
     click_areas['cancel'] = cancel_rect
-    # print(f"  Drew Save button at {save_rect}") # Отладка
-    # print(f"  Drew Cancel button at {cancel_rect}") # Отладка
 
     # Возвращаем собранные области и финальный прямоугольник
     return click_areas, popup_rect
 
-# --- Основные игровые функции ---
-def gain_xp_gold(character, xp_gain, gold_gain):
-    """Начисляет опыт и золото, проверяет левел-ап."""
-    character['xp'] += xp_gain
-    character['gold'] += gold_gain
-    print(f"Gained {xp_gain} XP, {gold_gain} Gold.")
-
-    while character['xp'] >= character['xp_to_next_level']:
-        character['xp'] -= character['xp_to_next_level']
-        character['level'] += 1
-        # Увеличиваем здоровье и порог опыта
-        character['max_health'] += 20
-        character['health'] = character['max_health'] # Полное восстановление при левел-апе
-        character['xp_to_next_level'] = int(character['xp_to_next_level'] * 1.5) # Усложняем следующий уровень
-        print(f"LEVEL UP! Reached Level {character['level']}!")
-        # Можно добавить звук или визуальный эффект
-
-def lose_health(character, hp_loss):
-    """Отнимает здоровье."""
-    character['health'] = max(0, character['health'] - hp_loss)
-    print(f"Lost {hp_loss} Health. Current: {character['health']}")
-    # Что происходит при 0 HP? Может быть, дебафф или временная блокировка наград? Пока просто 0.
-
 # МОДИФИЦИРУЕМ draw_task_list, чтобы добавить кнопку "+"
-def draw_task_list(surface, title, tasks, task_type, x, y, w, h):
-    """Рисует список задач и кнопку добавления."""
+def draw_task_list(surface, title, tasks, task_type, x, y, w, h, view=None, sort_label=None):
+    """
+    Рисует видимое окно списка задач (см. ListView) и кнопку добавления.
+
+    tasks - список или TaskPager (читаются только строки окна). Клик по
+    заголовку переключает порядок; sort_label - подпись текущего порядка.
+    """
     base_rect = pygame.Rect(x, y, w, h)
     pygame.draw.rect(surface, GRAY, base_rect, border_radius=5)
     pygame.draw.rect(surface, BLACK, base_rect, 1, border_radius=5)
 
-    title_surf = FONT_MEDIUM.render(title, True, BLACK)
+    title_surf = render_text(FONT_MEDIUM, title, True, BLACK)
     title_rect = title_surf.get_rect(topleft=(x + 10, y + 5))
     surface.blit(title_surf, title_rect)
+    sort_rect = title_rect
+    if sort_label:
+        label_surf = render_text(FONT_SMALL, f"by {sort_label}", True, DARK_GRAY)
+        label_rect = label_surf.get_rect(midleft=(title_rect.right + 8, title_rect.centery))
+        surface.blit(label_surf, label_rect)
+        sort_rect = title_rect.union(label_rect)
 
     # Кнопка добавления (+)
     add_button_size = 24
     add_button_rect = pygame.Rect(x + w - add_button_size - 10, y + 5 + (title_rect.height - add_button_size)//2, add_button_size, add_button_size)
     pygame.draw.rect(surface, GREEN, add_button_rect, border_radius=5)
-    add_text = FONT_LARGE.render("+", True, WHITE)
+    add_text = render_text(FONT_LARGE, "+", True, WHITE)
     surface.blit(add_text, add_text.get_rect(center=add_button_rect.center))
 
     item_y = y + 40
@@ -287,11 +318,22 @@ def draw_task_list(surface, title, tasks, task_type, x, y, w, h):
     click_areas = [] # Список для хранения [(rect, type, task_id, action), ...]
     # Добавляем кнопку "+" в кликабельные зоны
     click_areas.append((add_button_rect, task_type, None, 'add_new')) # task_id=None для кнопки добавления
-
-    for task in tasks:
-        if item_y + item_height > y + h - 10: break # Не выходим за границы
-
-        task_rect = pygame.Rect(x + 5, item_y, w - 10, item_height)
+    click_areas.append((sort_rect, task_type, None, 'cycle_sort'))
+
+    today = datetime.date.today().isoformat()
+
+    # Виртуализация: рисуем и проверяем клики только для видимых строк
+    if view is None:
+        view = ListView()
+    view.layout(len(tasks), (h - 50 + 5) // (item_height + 5)) # Строки между заголовком и нижним отступом
+    row_width = w - 10
+    if view.overflows:
+        row_width -= SCROLLBAR_WIDTH + 2
+        draw_scrollbar(surface, view, pygame.Rect(x + w - 5 - SCROLLBAR_WIDTH, item_y, SCROLLBAR_WIDTH, h - 50))
+
+    for index in view.window():
+        task = tasks[index]
+        task_rect = pygame.Rect(x + 5, item_y, row_width, item_height)
         pygame.draw.rect(surface, WHITE, task_rect, border_radius=3)
         pygame.draw.rect(surface, DARK_GRAY, task_rect, 1, border_radius=3)
 
@@ -302,37 +344,39 @@ def draw_task_list(surface, title, tasks, task_type, x, y, w, h):
             # Edit button with feather icon
             edit_rect = pygame.Rect(task_rect.right - button_size*2 - 10, task_rect.centery - button_size // 2, button_size, button_size)
             pygame.draw.rect(surface, BLUE, edit_rect, border_radius=3)
-            surface.blit(SPRITES['feather'], edit_rect.topleft)
+            surface.blit(SPRITES.get('feather.png', REWARD_ICON_SIZE), edit_rect.topleft)
             click_areas.append((edit_rect, task_type, task['id'], 'edit'))
 
         elif task_type == 'dailies':
             check_rect = pygame.Rect(task_rect.right - button_size*2 - 10, task_rect.centery - button_size // 2, button_size, button_size)
             if task['completed_today']:
                 pygame.draw.rect(surface, GREEN, check_rect, border_radius=3)
-                surface.blit(SPRITES['checkmark'], check_rect.topleft)
+                surface.blit(SPRITES.get('checkmark.png', ICON_SIZE), check_rect.topleft)
             else:
                 pygame.draw.rect(surface, RED, check_rect, border_radius=3)
-                surface.blit(SPRITES['x_button'], check_rect.topleft)
+                surface.blit(SPRITES.get('x_button.png', ICON_SIZE), check_rect.topleft)
                 click_areas.append((check_rect, task_type, task['id'], 'toggle_complete'))
             
             streak_text = f"Streak: {task.get('streak', 0)}"
-            streak_surf = FONT_SMALL.render(streak_text, True, BLUE)
+            if (task.get('next_due') or today) > today: # Не по расписанию сегодня: когда следующий срок
+                streak_text += f"  ·  due {datetime.date.fromisoformat(task['next_due']):%a %d %b}"
+            streak_surf = render_text(FONT_SMALL, streak_text, True, BLUE)
             surface.blit(streak_surf, (task_rect.left + 5, task_rect.bottom - 15))
 
         elif task_type == 'todos':
             check_rect = pygame.Rect(task_rect.right - button_size*2 - 10, task_rect.centery - button_size // 2, button_size, button_size)
             if task['completed']:
                 pygame.draw.rect(surface, GREEN, check_rect, border_radius=3)
-                surface.blit(SPRITES['checkmark'], check_rect.topleft)
+                surface.blit(SPRITES.get('checkmark.png', ICON_SIZE), check_rect.topleft)
             else:
                 pygame.draw.rect(surface, RED, check_rect, border_radius=3)
-                surface.blit(SPRITES['x_button'], check_rect.topleft)
+                surface.blit(SPRITES.get('x_button.png', ICON_SIZE), check_rect.topleft)
                 click_areas.append((check_rect, task_type, task['id'], 'toggle_complete'))
 
         # Add delete button for all task types
         delete_rect = pygame.Rect(task_rect.right - button_size - 5, task_rect.centery - button_size // 2, button_size, button_size)
         pygame.draw.rect(surface, DARK_GRAY, delete_rect, border_radius=3)
-        delete_text = FONT_MEDIUM.render("×", True, WHITE)
+        delete_text = render_text(FONT_MEDIUM, "×", True, WHITE)
         surface.blit(delete_text, delete_text.get_rect(center=delete_rect.center))
         click_areas.append((delete_rect, task_type, task['id'], 'delete'))
 
@@ -342,25 +386,29 @@ def draw_task_list(surface, title, tasks, task_type, x, y, w, h):
 
 
 # --- Функции отрисовки UI ---
-def draw_character_panel(surface, char_data):
-    """Рисует панель с информацией о персонаже."""
-    panel_rect = pygame.Rect(10, 10, 300, 120)
+def draw_character_panel(surface, char_data, x=10, y=10, profile_name=None):
+    """Рисует панель с информацией о персонаже (и именем профиля в правом верхнем углу)."""
+    panel_rect = pygame.Rect(x, y, 300, 120)
     pygame.draw.rect(surface, GRAY, panel_rect, border_radius=10)
     pygame.draw.rect(surface, BLACK, panel_rect, 2, border_radius=10)
 
     # Аватар
-    surface.blit(SPRITES['character'], (panel_rect.left + 10, panel_rect.top + 10))
+    surface.blit(SPRITES.get('character.png', AVATAR_SIZE), (panel_rect.left + 10, panel_rect.top + 10))
 
     # Статы
     lvl_text = f"Level: {char_data['level']}"
     gold_text = f"Gold: {char_data['gold']}"
 
-    lvl_surf = FONT_MEDIUM.render(lvl_text, True, BLACK)
-    gold_surf = FONT_MEDIUM.render(gold_text, True, GOLD_COLOR)
+    lvl_surf = render_text(FONT_MEDIUM, lvl_text, True, BLACK)
+    gold_surf = render_text(FONT_MEDIUM, gold_text, True, GOLD_COLOR)
 
     surface.blit(lvl_surf, (panel_rect.left + 80, panel_rect.top + 10))
     surface.blit(gold_surf, (panel_rect.left + 80, panel_rect.top + 40))
 
+    if profile_name:
+        profile_surf = render_text(FONT_SMALL, profile_name, True, DARK_GRAY)
+        surface.blit(profile_surf, profile_surf.get_rect(topright=(panel_rect.right - 10, panel_rect.top + 10)))
+
     # Бары
     bar_x = panel_rect.left + 10
     bar_width = panel_rect.width - 20
@@ -371,13 +419,30 @@ def draw_character_panel(surface, char_data):
 
 
 
-def draw_rewards_panel(surface, rewards, character_gold, x, y, w, h):
-    """Рисует панель с наградами."""
+def draw_search_box(surface, text, active, x, y, w, h):
+    """Поле поиска над колонками задач; клик по нему включает ввод."""
+    box_rect = pygame.Rect(x, y, w, h)
+    pygame.draw.rect(surface, WHITE if active else INPUT_BOX_COLOR, box_rect, border_radius=5)
+    pygame.draw.rect(surface, INPUT_ACTIVE_BORDER_COLOR if active else DARK_GRAY, box_rect, 2, border_radius=5)
+    if text:
+        text_surf = render_text(FONT_SMALL, text + ('|' if active else ''), True, INPUT_TEXT_COLOR)
+    else:
+        text_surf = render_text(FONT_SMALL, "Search tasks (Ctrl+F)", True, DARK_GRAY)
+    # Длинный запрос прокручивается: видна его правая часть
+    text_rect = text_surf.get_rect(midleft=(box_rect.left + 8, box_rect.centery))
+    surface.set_clip(box_rect.inflate(-8, -4))
+    surface.blit(text_surf, text_rect if text_rect.right <= box_rect.right - 8 else
+                 text_surf.get_rect(midright=(box_rect.right - 8, box_rect.centery)))
+    surface.set_clip(None)
+    return [(box_rect, 'search', 0, 'focus_search')]
+
+def draw_rewards_panel(surface, rewards, character_gold, x, y, w, h, view=None):
+    """Рисует видимое окно списка наград (см. ListView)."""
     base_rect = pygame.Rect(x, y, w, h)
     pygame.draw.rect(surface, GRAY, base_rect, border_radius=5)
     pygame.draw.rect(surface, BLACK, base_rect, 1, border_radius=5)
 
-    title_surf = FONT_MEDIUM.render("Rewards Shop / Inventory", True, BLACK)
+    title_surf = render_text(FONT_MEDIUM, "Rewards Shop / Inventory", True, BLACK)
     surface.blit(title_surf, (x + 10, y + 5))
 
     item_y = y + 40
@@ -385,24 +450,32 @@ def draw_rewards_panel(surface, rewards, character_gold, x, y, w, h):
     button_size = 60
     click_areas = []
 
-    for reward in rewards:
-        if item_y + item_height > y + h - 10: break
-
-        reward_rect = pygame.Rect(x + 5, item_y, w - 10, item_height)
+    if view is None:
+        view = ListView()
+    view.layout(len(rewards), (h - 50 + 5) // (item_height + 5))
+    row_width = w - 10
+    if view.overflows:
+        row_width -= SCROLLBAR_WIDTH + 2
+        draw_scrollbar(surface, view, pygame.Rect(x + w - 5 - SCROLLBAR_WIDTH, item_y, SCROLLBAR_WIDTH, h - 50))
+
+    for index in view.window():
+        reward = rewards[index]
+        reward_rect = pygame.Rect(x + 5, item_y, row_width, item_height)
         item_color = WHITE if not reward['owned'] else (220, 255, 220) # Светло-зеленый для купленных
         pygame.draw.rect(surface, item_color, reward_rect, border_radius=3)
         pygame.draw.rect(surface, DARK_GRAY, reward_rect, 1, border_radius=3)
 
         # Спрайт награды
         sprite_name = reward.get('sprite_name')
-        if sprite_name and sprite_name in SPRITES:
-            surface.blit(SPRITES[sprite_name.split('.')[0]], (reward_rect.left + 5, reward_rect.top + (item_height - 32)//2))
+        if sprite_name:
+            icon = SPRITES.get(sprite_name, REWARD_ICON_SIZE)
+            surface.blit(icon, (reward_rect.left + 5, reward_rect.top + (item_height - icon.get_height())//2))
             text_x_offset = 45
         else:
             text_x_offset = 5
 
         # Название и тип
-        name_surf = FONT_SMALL.render(f"{reward['name']} ({reward['type']})", True, BLACK)
+        name_surf = render_text(FONT_SMALL, f"{reward['name']} ({reward['type']})", True, BLACK)
         surface.blit(name_surf, (reward_rect.left + text_x_offset, reward_rect.top + 5))
 
         # Кнопка / Статус
@@ -422,7 +495,7 @@ def draw_rewards_panel(surface, rewards, character_gold, x, y, w, h):
             else: # Custom reward - просто owned
                 pygame.draw.rect(surface, DARK_GRAY, action_rect, border_radius=3)
 
-            status_surf = FONT_SMALL.render(status_text, True, WHITE if status_text=="Equip" else BLACK)
+            status_surf = render_text(FONT_SMALL, status_text, True, WHITE if status_text=="Equip" else BLACK)
             surface.blit(status_surf, status_surf.get_rect(center=action_rect.center))
 
         else:
@@ -431,7 +504,7 @@ def draw_rewards_panel(surface, rewards, character_gold, x, y, w, h):
             can_afford = character_gold >= reward['cost']
             button_color = GOLD_COLOR if can_afford else DARK_GRAY
             pygame.draw.rect(surface, button_color, action_rect, border_radius=3)
-            cost_surf = FONT_SMALL.render(cost_text, True, BLACK)
+            cost_surf = render_text(FONT_SMALL, cost_text, True, BLACK)
             surface.blit(cost_surf, cost_surf.get_rect(center=action_rect.center))
             if can_afford:
                 click_areas.append((action_rect, 'reward', reward['id'], 'buy'))
@@ -453,7 +526,7 @@ def draw_edit_popup(surface, task_data, active_field):
     pygame.draw.rect(surface, BLACK, popup_rect, 1, border_radius=5)
 
     # Title
-    title_surf = FONT_MEDIUM.render("Edit Habit", True, BLACK)
+    title_surf = render_text(FONT_MEDIUM, "Edit Habit", True, BLACK)
     title_rect = title_surf.get_rect(centerx=popup_rect.centerx, top=popup_rect.top + 20)
     surface.blit(title_surf, title_rect)
 
@@ -463,7 +536,7 @@ def draw_edit_popup(surface, task_data, active_field):
     fields = {}
 
     # Name field
-    name_label = FONT_SMALL.render("Name:", True, BLACK)
+    name_label = render_text(FONT_SMALL, "Name:", True, BLACK)
     name_rect = pygame.Rect(popup_x + 30, popup_y + 60, field_width, field_height)
     pygame.draw.rect(surface, LIGHT_BLUE if active_field == 'name' else WHITE, name_rect, border_radius=3)
     pygame.draw.rect(surface, BLACK, name_rect, 1, border_radius=3)
@@ -472,7 +545,7 @@ def draw_edit_popup(surface, task_data, active_field):
     current_text = task_data.get('name', '')
     if active_field == 'name':
         current_text = task_data.get('current_edit', current_text)
-    name_text = FONT_SMALL.render(current_text, True, BLACK)
+    name_text = render_text(FONT_SMALL, current_text, True, BLACK)
     surface.blit(name_label, (name_rect.left, name_rect.top - 20))
     surface.blit(name_text, (name_rect.left + 5, name_rect.centery - name_text.get_height()//2))
     fields['name'] = name_rect
@@ -484,33 +557,117 @@ def draw_edit_popup(surface, task_data, active_field):
 
     save_rect = pygame.Rect(popup_rect.centerx - button_width - 10, button_y, button_width, button_height)
     pygame.draw.rect(surface, GREEN, save_rect, border_radius=3)
-    save_text = FONT_SMALL.render("Save", True, WHITE)
+    save_text = render_text(FONT_SMALL, "Save", True, WHITE)
     surface.blit(save_text, save_text.get_rect(center=save_rect.center))
     fields['save'] = save_rect
 
     cancel_rect = pygame.Rect(popup_rect.centerx + 10, button_y, button_width, button_height)
     pygame.draw.rect(surface, RED, cancel_rect, border_radius=3)
-    cancel_text = FONT_SMALL.render("Cancel", True, WHITE)
+    cancel_text = render_text(FONT_SMALL, "Cancel", True, WHITE)
     surface.blit(cancel_text, cancel_text.get_rect(center=cancel_rect.center))
     fields['cancel'] = cancel_rect
 
     return fields, popup_rect
 
+def draw_profiler_overlay(surface, profiler, x=None, y=10):
+    """Рисует таблицу перцентилей фаз кадра (F3) и возвращает ее прямоугольник."""
+    rows = [("phase, ms", "p50", "p95", "p99")]
+    for name, stats in profiler.summary().items():
+        rows.append((name, f"{stats['p50_ms']:.2f}", f"{stats['p95_ms']:.2f}", f"{stats['p99_ms']:.2f}"))
+    line_height = FONT_SMALL.get_linesize()
+    column_right = (0, 180, 240, 300) # Правые края числовых колонок (шрифт не моноширинный)
+    rect = pygame.Rect(0, y, 310, line_height * len(rows) + 10)
+    rect.right = SCREEN_WIDTH - 10 if x is None else x + rect.width
+    overlay = pygame.Surface(rect.size, pygame.SRCALPHA)
+    overlay.fill((0, 0, 0, 190))
+    for i, row in enumerate(rows):
+        top = 5 + i * line_height
+        # Цифры меняются каждый кадр - рендерим в обход TEXT_CACHE, чтобы не вытеснять постоянные надписи
+        overlay.blit(FONT_SMALL.render(row[0], True, WHITE), (5, top))
+        for text, right in zip(row[1:], column_right[1:]):
+            cell = FONT_SMALL.render(text, True, WHITE)
+            overlay.blit(cell, (right - cell.get_width(), top))
+    surface.blit(overlay, rect)
+    return rect
+
 # --- Основной игровой цикл ---
-def game_loop():
+def game_loop(profile_name=DEFAULT_PROFILE):
     """Главный цикл игры."""
-    init_db()
-    check_last_run_date()
-
-    character_data = get_character_data()
+    init_display()
+
+    # Записи в БД уходят в фоновый поток; UI сразу видит изменения в памяти
+    writer = WriteQueue(on_error=lambda: pygame.event.post(pygame.event.Event(WRITE_ERROR_EVENT)),
+                        on_commit=lambda: pygame.event.post(pygame.event.Event(WRITE_COMMITTED_EVENT))).start()
+    # У каждого профиля своя БД; F2 переключает профили, недавние остаются открытыми
+    profiles = ProfileManager(writer=writer)
+    profile = profiles.switch(profile_name)
+    store, character_data = profile.store, profile.character
     if not character_data:
-        print("Error: Could not load character data!")
+        log.warning("Could not load character data!")
         sys.exit()
-
-    habits = get_tasks('habits')
-    dailies = get_tasks('dailies')
-    todos = get_tasks('todos')
-    rewards = get_rewards()
+    # Все изменения - обратимые команды: Ctrl+Z отменяет, Ctrl+Y повторяет
+    history = CommandHistory(store, character_data, writer)
+    writer.submit(compact, description="compact tombstones") # Стирает старые удаленные задачи в фоне
+    # Иконки наград берутся из rewards.sprite_name: новые награды не требуют правок кода
+    SPRITES.prefetch_rewards(store.rewards(), REWARD_ICON_SIZE)
+
+    # --- Панели (retained mode): перерисовываются только когда их пометили грязными ---
+    col_width = (SCREEN_WIDTH - 40) // 3
+    col_height = SCREEN_HEIGHT - 160 - 100
+    list_y = 140
+    rewards_y = list_y + col_height + 10
+    rewards_height = SCREEN_HEIGHT - rewards_y - 10
+
+    # Состояние прокрутки каждого списка
+    views = {name: ListView() for name in ('habits', 'dailies', 'todos', 'rewards')}
+
+    # Поиск: при каждом нажатии клавиши колонки сужаются до найденных задач
+    # (запрос повторяется и при изменении задач, см. LiveSearch)
+    live_search = LiveSearch(SEARCH_RESULTS_LIMIT)
+    search_active = False
+
+    # Порядок колонок: индекс в SORT_MODES; строки колонки читаются из БД страницами
+    sort_modes = dict.fromkeys(SORT_MODES, 0)
+    pagers = {}
+
+    def visible_tasks(task_type):
+        """Задачи колонки: найденные поиском (по релевантности) или страницы в выбранном порядке."""
+        found = live_search.tasks(store, task_type)
+        if found is not None:
+            return found
+        sort = SORT_MODES[task_type][sort_modes[task_type]][1]
+        pager = pagers.get(task_type)
+        if pager is None or pager.store is not store or pager.sort != sort: # Другой профиль или порядок
+            pager = pagers[task_type] = TaskPager(store, task_type, sort)
+        return pager
+
+    def sort_label(task_type):
+        return SORT_MODES[task_type][sort_modes[task_type]][0]
+
+    panels = PanelLayer(BG_SURFACE, hover_color=WHITE, profiler=PROFILER)
+    panels.add(Panel('character', (10, 10, 300, 120),
+                     lambda surf, r: draw_character_panel(surf, character_data, r.x, r.y, profile.name)))
+    panels.add(Panel('habits', (10, list_y, col_width, col_height),
+                     lambda surf, r: draw_task_list(surf, "Habits", visible_tasks('habits'), 'habits', r.x, r.y, r.w, r.h, views['habits'],
+                                                    sort_label('habits'))))
+    panels.add(Panel('dailies', (15 + col_width, list_y, col_width, col_height),
+                     lambda surf, r: draw_task_list(surf, "Dailies", visible_tasks('dailies'), 'dailies', r.x, r.y, r.w, r.h, views['dailies'],
+                                                    sort_label('dailies'))))
+    panels.add(Panel('todos', (20 + col_width*2, list_y, col_width, col_height),
+                     lambda surf, r: draw_task_list(surf, "To-Dos", visible_tasks('todos'), 'todos', r.x, r.y, r.w, r.h, views['todos'],
+                                                    sort_label('todos'))))
+    panels.add(Panel('rewards', (10, rewards_y, SCREEN_WIDTH - 20, rewards_height),
+                     lambda surf, r: draw_rewards_panel(surf, store.rewards(), character_data['gold'], r.x, r.y, r.w, r.h, views['rewards'])))
+    panels.add(Panel('search', (320, 96, 380, 34),
+                     lambda surf, r: draw_search_box(surf, live_search.text, search_active, r.x, r.y, r.w, r.h)))
+    popup_on_screen = None # Прямоугольник попапа, который сейчас нарисован на экране
+    show_profiler = False
+    overlay_on_screen = None # Прямоугольник оверлея профилировщика на экране
+
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(ALLOWED_EVENTS)
+    scheduler = FrameScheduler(FPS)
+    events = []
 
     running = True
     input_mode = None
@@ -521,19 +678,121 @@ def game_loop():
     edit_data = {}
     active_edit_field = None
 
-    last_frame_main_ui_areas = []
     last_frame_popup_areas = {}
     last_frame_popup_rect = None
 
     skip_first_popup_click = False  # Новый флаг
 
     while running:
+        frame_start = PROFILER.now()
+        if scheduler.day_changed():
+            # Полночь: ежедневный сброс без перезапуска приложения
+            writer.flush() # Вчерашние отметки должны попасть в БД до сброса
+            check_last_run_date()
+            character_data.update(get_character_data()) # Тот же dict, что закэширован в профиле
+            store.load()
+            history.clear() # Сброс поменял стрики и здоровье: старые снимки больше не верны
+            writer.submit(compact, description="compact tombstones")
+            panels.invalidate()
+
         mouse_pos = pygame.mouse.get_pos()
 
-        for event in pygame.event.get():
+        events_start = PROFILER.now()
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
 
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                show_profiler = not show_profiler
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2 and not input_mode and not edit_mode:
+                # Следующий профиль: теплый берется из памяти, без повторного чтения БД
+                profile = profiles.switch(profiles.next_name())
+                store, character_data = profile.store, profile.character
+                history = CommandHistory(store, character_data, writer)
+                live_search.set_text('') # Найденные id относятся к БД прошлого профиля
+                for view in views.values():
+                    view.scroll_to(0)
+                SPRITES.prefetch_rewards(store.rewards(), REWARD_ICON_SIZE)
+                panels.invalidate()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                PROFILER.dump_json(PROFILE_FILE)
+                PROFILER.dump_chrome_trace(TRACE_FILE)
+                log.info("Frame profile written to %s and %s", PROFILE_FILE, TRACE_FILE)
+            elif (event.type == pygame.KEYDOWN and event.mod & pygame.KMOD_CTRL and event.key == pygame.K_f
+                  and not input_mode and not edit_mode):
+                search_active = True
+                panels.invalidate('search')
+            elif (event.type == pygame.KEYDOWN and event.mod & pygame.KMOD_CTRL and event.key in (pygame.K_z, pygame.K_y)
+                  and not input_mode and not edit_mode):
+                # Ctrl+Z - отмена, Ctrl+Y или Ctrl+Shift+Z - повтор
+                redo = event.key == pygame.K_y or bool(event.mod & pygame.KMOD_SHIFT)
+                command = history.redo() if redo else history.undo()
+                if command:
+                    log.debug("%s: %s", 'Redo' if redo else 'Undo', command.description)
+                    panels.invalidate()
+
+            if event.type == WRITE_ERROR_EVENT:
+                # Оптимистичные изменения в памяти разошлись с БД - перечитываем
+                for error in writer.pop_errors():
+                    log.warning("Changes were not saved: %s (%s)", error.description, error.error)
+                store.load()
+                character_data.update(get_character_data())
+                history.clear()
+                panels.invalidate()
+
+            if event.type == WRITE_COMMITTED_EVENT:
+                # Изменения дошли до БД: колонки и поиск перечитывают страницы без flush()
+                settled = store.settle()
+                if settled:
+                    panels.invalidate(*settled)
+
+            if event.type == pygame.VIDEOEXPOSE:
+                # Содержимое окна могло потеряться - выводим кадр целиком
+                panels.invalidate_screen()
+
+            # --- Ввод в поле поиска: результаты обновляются на каждое нажатие ---
+            if event.type == pygame.KEYDOWN and search_active and not event.mod & pygame.KMOD_CTRL:
+                new_text = live_search.text
+                if event.key == pygame.K_BACKSPACE:
+                    new_text = live_search.text[:-1]
+                elif event.key == pygame.K_ESCAPE:
+                    new_text = ''
+                    search_active = False
+                elif event.key in (pygame.K_RETURN, pygame.K_TAB):
+                    search_active = False
+                elif event.unicode.isprintable():
+                    new_text = live_search.text + event.unicode
+                if new_text != live_search.text:
+                    live_search.set_text(new_text)
+                    for name in ('habits', 'dailies', 'todos'):
+                        views[name].scroll_to(0)
+                    panels.invalidate('habits', 'dailies', 'todos')
+                panels.invalidate('search')
+                continue
+
+            # --- Прокрутка списка под курсором (колесо мыши и клавиши) ---
+            if not input_mode and not edit_mode and event.type in (pygame.MOUSEWHEEL, pygame.KEYDOWN):
+                hovered = panels.panel_at(mouse_pos)
+                view = views.get(hovered.name) if hovered else None
+                if view:
+                    scrolled = False
+                    if event.type == pygame.MOUSEWHEEL:
+                        scrolled = view.scroll(-event.y * SCROLL_WHEEL_ROWS)
+                    elif event.key == pygame.K_UP:
+                        scrolled = view.scroll(-1)
+                    elif event.key == pygame.K_DOWN:
+                        scrolled = view.scroll(1)
+                    elif event.key == pygame.K_PAGEUP:
+                        scrolled = view.scroll_page(-1)
+                    elif event.key == pygame.K_PAGEDOWN:
+                        scrolled = view.scroll_page(1)
+                    elif event.key == pygame.K_HOME:
+                        scrolled = view.scroll_to(0)
+                    elif event.key == pygame.K_END:
+                        scrolled = view.scroll_to(view.count)
+                    if scrolled:
+                        panels.invalidate(hovered.name)
+
             if event.type == pygame.KEYDOWN and input_mode and active_input_field:
                 current_text = input_data.get(active_input_field, '')
 
@@ -572,33 +831,35 @@ def game_loop():
                             if name in ['save', 'cancel'] and rect.collidepoint(mouse_pos):
                                 if name == 'save':
                                     task_name = input_data.get('name', '').strip()
-                                    if task_name:
+                                    frequency = input_data.get('frequency', '').strip() or recurrence.DEFAULT_FREQUENCY
+                                    frequency_ok = True
+                                    try:
+                                        recurrence.parse(frequency)
+                                    except ValueError as e:
+                                        log.warning("%s. Use e.g. daily, weekly:Mon,Wed or monthly:1", e)
+                                        frequency_ok = False # Попап остается открытым для исправления
+                                    if task_name and frequency_ok:
                                         new_task_data = {'name': task_name}
                                         task_type_db = None
                                         if input_mode == 'Habit':
                                             task_type_db = 'habits'
                                         elif input_mode == 'Daily':
                                             task_type_db = 'dailies'
+                                            new_task_data['frequency'] = frequency
                                         elif input_mode == 'To-Do':
                                             task_type_db = 'todos'
                                         new_task_data['notes'] = input_data.get('notes', '').strip()
 
                                         if task_type_db:
-                                            new_id = add_task(task_type_db, new_task_data)
-                                            if new_id:
-                                                if input_mode == 'Habit': 
-                                                    habits = get_tasks('habits')
-                                                elif input_mode == 'Daily': 
-                                                    dailies = get_tasks('dailies')
-                                                elif input_mode == 'To-Do': 
-                                                    todos = get_tasks('todos')
+                                            history.execute(AddTask(task_type_db, new_task_data))
+                                            panels.invalidate(task_type_db)
                                         input_mode = None
                                         input_data = {}
                                         active_input_field = None
                                         last_frame_popup_rect = None
                                         last_frame_popup_areas = {}
-                                    else:
-                                        print("Task name cannot be empty.")
+                                    elif not task_name:
+                                        log.warning("Task name cannot be empty.")
                                 elif name == 'cancel':
                                     input_mode = None
                                     input_data = {}
@@ -628,10 +889,10 @@ def game_loop():
                                     edit_data['current_edit'] = edit_data.get('name', '')
                             elif field_name == 'save':
                                 if edit_data.get('current_edit'):  # Save the edited name
-                                    update_task('habits', edit_data['id'], {
+                                    history.execute(UpdateTask('habits', edit_data['id'], {
                                         'name': edit_data['current_edit']
-                                    })
-                                    habits = get_tasks('habits')
+                                    }))
+                                    panels.invalidate('habits')
                                     edit_mode = None
                                     edit_data = {}
                                     active_edit_field = None
@@ -642,65 +903,66 @@ def game_loop():
                             break
 
                 elif not input_mode:
-                    for area_rect, area_type, item_id, action in last_frame_main_ui_areas:
-                        if area_rect.collidepoint(mouse_pos):
-                            if action == 'add_new':
-                                type_map = {'habits': 'Habit', 'dailies': 'Daily', 'todos': 'To-Do'}
-                                input_mode = type_map.get(area_type, None)
-                                input_data = {}
-                                active_input_field = 'name'
-                                last_frame_popup_areas = {}
-                                last_frame_popup_rect = None
-                                skip_first_popup_click = True
-                            elif action == 'delete':
-                                # Handle deletion for all task types
-                                delete_task(area_type, item_id)
-                                # Refresh the appropriate task list
-                                if area_type == 'habits':
-                                    habits = get_tasks('habits')
-                                elif area_type == 'dailies':
-                                    dailies = get_tasks('dailies')
-                                elif area_type == 'todos':
-                                    todos = get_tasks('todos')
-                            elif action == 'toggle_complete':
-                                if area_type == 'dailies':
-                                    # Get current task data
-                                    task = next((t for t in dailies if t['id'] == item_id), None)
-                                    if task:
-                                        # Toggle completion status
-                                        new_status = not task['completed_today']
-                                        # Update streak if completing
-                                        if new_status:
-                                            streak = task.get('streak', 0) + 1
-                                            update_task('dailies', item_id, {
-                                                'completed_today': new_status,
-                                                'streak': streak,
-                                                'last_completed': datetime.date.today().isoformat()
-                                            })
-                                        else:
-                                            # If unchecking, just update completed_today
-                                            update_task('dailies', item_id, {'completed_today': new_status})
-                                        # Refresh dailies list
-                                        dailies = get_tasks('dailies')
-                                
-                                elif area_type == 'todos':
-                                    # Toggle completion status for todo
-                                    task = next((t for t in todos if t['id'] == item_id), None)
-                                    if task:
-                                        new_status = not task['completed']
-                                        update_task('todos', item_id, {'completed': new_status})
-                                        # Refresh todos list
-                                        todos = get_tasks('todos')
-                            elif action == 'edit' and area_type == 'habits':
-                                # Get task data and enter edit mode
-                                task = next((t for t in habits if t['id'] == item_id), None)
+                    # Зона под курсором ищется по сетке панели, а не перебором всех зон
+                    hit = panels.hit_test(mouse_pos)
+                    # Клик мимо поля поиска снимает с него фокус (текст и фильтр остаются)
+                    focus_search = bool(hit) and hit[3] == 'focus_search'
+                    if focus_search != search_active:
+                        search_active = focus_search
+                        panels.invalidate('search')
+                    if hit:
+                        area_rect, area_type, item_id, action = hit
+                        if action == 'add_new':
+                            type_map = {'habits': 'Habit', 'dailies': 'Daily', 'todos': 'To-Do'}
+                            input_mode = type_map.get(area_type, None)
+                            input_data = {}
+                            active_input_field = 'name'
+                            last_frame_popup_areas = {}
+                            last_frame_popup_rect = None
+                            skip_first_popup_click = True
+                        elif action == 'cycle_sort':
+                            sort_modes[area_type] = (sort_modes[area_type] + 1) % len(SORT_MODES[area_type])
+                            views[area_type].scroll_to(0)
+                            panels.invalidate(area_type)
+                        elif action == 'delete':
+                            # Удаление мягкое и отменяется через Ctrl+Z
+                            history.execute(DeleteTasks(area_type, [item_id]))
+                            panels.invalidate(area_type)
+                        elif action == 'toggle_complete':
+                            if area_type == 'dailies':
+                                # Get current task data
+                                task = store.get('dailies', item_id)
                                 if task:
-                                    edit_mode = True
-                                    edit_data = task.copy()
-                                    active_edit_field = 'name'
-                                    edit_data['current_edit'] = edit_data.get('name', '')
-                            # Остальная логика UI...
-                            break
+                                    # Toggle completion status
+                                    new_status = not task['completed_today']
+                                    # Выполнение пишется в журнал; streak и last_completed - его проекции.
+                                    # Снятие отметки отменяет это выполнение вместе с наградой
+                                    history.execute(CompleteTask('dailies', item_id) if new_status
+                                                    else UncompleteTask('dailies', item_id))
+                                    panels.invalidate('dailies', 'character', 'rewards') # Золото влияет на кнопки покупки
+                            
+                            elif area_type == 'todos':
+                                # Toggle completion status for todo
+                                task = store.get('todos', item_id)
+                                if task:
+                                    history.execute(UncompleteTask('todos', item_id) if task['completed']
+                                                    else CompleteTask('todos', item_id))
+                                    panels.invalidate('todos', 'character', 'rewards') # Золото влияет на кнопки покупки
+                        elif action == 'buy':
+                            if history.execute(BuyReward(item_id)):
+                                panels.invalidate('character', 'rewards')
+                        elif action == 'equip':
+                            if history.execute(EquipReward(item_id)):
+                                panels.invalidate('rewards')
+                        elif action == 'edit' and area_type == 'habits':
+                            # Get task data and enter edit mode
+                            task = store.get('habits', item_id)
+                            if task:
+                                edit_mode = True
+                                edit_data = task.copy()
+                                active_edit_field = 'name'
+                                edit_data['current_edit'] = edit_data.get('name', '')
+                        # Остальная логика UI...
 
             if event.type == pygame.KEYDOWN and edit_mode and active_edit_field:
                 if event.key == pygame.K_BACKSPACE:
@@ -708,10 +970,10 @@ def game_loop():
                 elif event.key == pygame.K_RETURN:
                     # Save on Enter key
                     if edit_data.get('current_edit'):
-                        update_task('habits', edit_data['id'], {
+                        history.execute(UpdateTask('habits', edit_data['id'], {
                             'name': edit_data['current_edit']
-                        })
-                        habits = get_tasks('habits')
+                        }))
+                        panels.invalidate('habits')
                         edit_mode = None
                         edit_data = {}
                         active_edit_field = None
@@ -723,65 +985,88 @@ def game_loop():
                 elif event.unicode.isprintable():
                     edit_data['current_edit'] = edit_data.get('current_edit', '') + event.unicode
 
+        PROFILER.record_since('events', events_start)
+
         # --- Логика обновления (если нужно, например, анимации) ---
         # ... пока пусто ...
 
         # --- Отрисовка ---
-        screen.blit(BG_SURFACE, (0, 0))
-        draw_character_panel(screen, character_data)
-
-        col_width = (SCREEN_WIDTH - 40) // 3
-        col_height = SCREEN_HEIGHT - 160 - 100
-        list_y = 140
-        current_habits_clicks = draw_task_list(screen, "Habits", habits, 'habits', 10, list_y, col_width, col_height)
-        current_dailies_clicks = draw_task_list(screen, "Dailies", dailies, 'dailies', 15 + col_width, list_y, col_width, col_height)
-        current_todos_clicks = draw_task_list(screen, "To-Dos", todos, 'todos', 20 + col_width*2, list_y, col_width, col_height)
-
-        rewards_y = list_y + col_height + 10
-        rewards_height = SCREEN_HEIGHT - rewards_y - 10
-        current_rewards_clicks = draw_rewards_panel(screen, rewards, character_data['gold'], 10, rewards_y, SCREEN_WIDTH - 20, rewards_height)
-
-        current_main_ui_areas = current_habits_clicks + current_dailies_clicks + current_todos_clicks + current_rewards_clicks
+        # Панели выводятся из кэша; перерисовываются только грязные
+        with PROFILER.phase('panels'):
+            dirty_rects = panels.update(screen)
+        # Подсветка зоны под курсором (поиск по сетке, без перебора)
+        with PROFILER.phase('hover'):
+            dirty_rects.extend(panels.set_hover(screen, None if input_mode or edit_mode else mouse_pos))
+
+        # Попап перерисовывается поверх восстановленной из кэша области под ним
+        if popup_on_screen:
+            dirty_rects.append(panels.restore(screen, popup_on_screen))
+            popup_on_screen = None
 
         current_popup_areas = {}
         current_popup_rect = None
-        print(f"[DRAW PHASE] Checking if popup should draw. input_mode = {input_mode}")
+        popup_start = PROFILER.now()
         if input_mode:
             # Функция отрисовки использует ТЕКУЩЕЕ состояние input_data и active_input_field
             current_popup_areas, current_popup_rect = draw_input_popup(screen, input_mode, input_data, active_input_field)
-            # Убери или закомментируй старый print внутри if, чтобы не дублировать
-            # print(f"  Drew popup. Areas: {list(current_popup_areas.keys())}, Rect: {current_popup_rect}")
             if current_popup_rect: # Дополнительная проверка, что rect вернулся
-                 print(f"  Drew popup. Final Rect: {current_popup_rect}")
+                log.debug("Drew popup %s at %s", input_mode, current_popup_rect)
             else:
-                 print("  WARNING: draw_input_popup returned None for rect!")
+                log.warning("draw_input_popup returned None for rect")
 
         if edit_mode:
             current_popup_areas, current_popup_rect = draw_edit_popup(screen, edit_data, active_edit_field)
             last_frame_popup_areas = current_popup_areas
             last_frame_popup_rect = current_popup_rect
 
+        if current_popup_rect:
+            popup_on_screen = current_popup_rect
+            dirty_rects.append(current_popup_rect)
+            PROFILER.record_since('popup', popup_start)
+
+        # Оверлей профилировщика (F3) рисуется поверх всего и обновляется каждый кадр
+        if overlay_on_screen:
+            dirty_rects.append(panels.restore(screen, overlay_on_screen))
+            overlay_on_screen = None
+        if show_profiler:
+            overlay_on_screen = draw_profiler_overlay(screen, PROFILER)
+            dirty_rects.append(overlay_on_screen)
+
         # ОБНОВЛЯЕМ ПЕРЕМЕННЫЕ ДЛЯ СЛЕДУЮЩЕГО КАДРА
-        last_frame_main_ui_areas = current_main_ui_areas
         last_frame_popup_areas = current_popup_areas
         last_frame_popup_rect = current_popup_rect
-        # print(f"End of frame. Last popup areas: {list(last_frame_popup_areas.keys())}") # Отладка
 
         # ===================================
         # === 4. ОБНОВЛЕНИЕ ЭКРАНА        ===
         # ===================================
-        pygame.display.flip()
-        clock.tick(30)
-
+        # Выводим на экран только изменившиеся прямоугольники
+        if dirty_rects:
+            with PROFILER.phase('flip'):
+                pygame.display.update(dirty_rects)
+        PROFILER.record_since('frame', frame_start)
+
+        # Пока открыт попап (мигает курсор) - фиксированный FPS, иначе ждем событий
+        if running:
+            events = scheduler.wait_events(animating=bool(input_mode or edit_mode))
+
+    writer.close() # Дописываем очередь перед выходом
+    close_db()
     pygame.quit()
     sys.exit()
 
 
 if __name__ == '__main__':
+    # Уровень логов: WARNING по умолчанию, HIEROPHANT_LOG=debug включает отладку
+    logging.basicConfig(level=os.environ.get(LOG_LEVEL_ENV, 'WARNING').upper(),
+                        format='%(levelname)s %(name)s: %(message)s')
     # Создаем папку assets, если ее нет
     if not os.path.exists(ASSETS_FOLDER):
         os.makedirs(ASSETS_FOLDER)
-        print(f"Created '{ASSETS_FOLDER}' directory. Please place your sprites there.")
+        log.warning("Created '%s' directory. Please place your sprites there.", ASSETS_FOLDER)
         # TODO: Можно добавить скачивание/копирование спрайтов по умолчанию, если их нет
 
-    game_loop()
\ No newline at end of file
+    # python main.py --profile alice - открыть (или создать) профиль alice
+    profile_name = DEFAULT_PROFILE
+    if '--profile' in sys.argv[1:-1]:
+        profile_name = sys.argv[sys.argv.index('--profile') + 1]
+    game_loop(profile_name)
\ No newline at end of file
@@ -0,0 +1,308 @@
+# migrations.py
+# Версия схемы хранится в PRAGMA user_version. Миграция N переводит схему
+# из версии N-1 в N; каждая миграция идемпотентна (можно безопасно
+# применить к БД, созданной старым init_db без версии). Выпущенная миграция
+# не меняется и не вызывает код приложения: ее SQL записан здесь как есть,
+# иначе старые БД получили бы другую схему, чем мигрированные раньше.
+
+DEFAULT_REWARDS = (
+    ('Боевой Топор', 'equipment', 50, 'axe.png'),
+    ('Маленький Дракон', 'pet', 100, 'dragon.png'),
+    ('Легкое Перо', 'custom', 10, 'feather.png'), # 'custom' - для пользовательских наград
+    ('Магический Фамильяр', 'pet', 75, 'creature.png'),
+)
+
+def _001_initial_schema(cursor):
+    """Создает таблицы и начальные данные."""
+    # --- Таблица персонажа ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS character (
+            id INTEGER PRIMARY KEY CHECK (id = 1), -- Только один персонаж
+            level INTEGER DEFAULT 1,
+            xp INTEGER DEFAULT 0,
+            xp_to_next_level INTEGER DEFAULT 100,
+            health INTEGER DEFAULT 100,
+            max_health INTEGER DEFAULT 100,
+            gold INTEGER DEFAULT 0
+        )
+    ''')
+    # Вставляем персонажа, если его нет
+    cursor.execute('''
+        INSERT OR IGNORE INTO character (id) VALUES (1)
+    ''')
+
+    # --- Таблица привычек (Habits) ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS habits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            value_xp INTEGER DEFAULT 5,
+            value_gold INTEGER DEFAULT 1,
+            counter INTEGER DEFAULT 0,
+            last_triggered DATE  -- Renamed from last_triggered_pos since we only have positive now
+        )
+    ''')
+
+    # --- Таблица ежедневок (Dailies) ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dailies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            frequency TEXT DEFAULT 'daily', -- 'daily', 'weekly:Mon', 'monthly:1' и т.д. (пока упростим до 'daily')
+            completed_today BOOLEAN DEFAULT 0,
+            last_completed DATE,
+            streak INTEGER DEFAULT 0,
+            value_xp INTEGER DEFAULT 10,
+            value_gold INTEGER DEFAULT 5,
+            penalty_hp INTEGER DEFAULT 10 -- Штраф за невыполнение
+        )
+    ''')
+
+    # --- Таблица разовых задач (To-Dos) ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS todos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            notes TEXT,
+            due_date DATE,
+            creation_date DATE DEFAULT CURRENT_DATE,
+            completed BOOLEAN DEFAULT 0,
+            value_xp INTEGER DEFAULT 20,
+            value_gold INTEGER DEFAULT 10,
+            difficulty INTEGER DEFAULT 1 -- Можно использовать для расчета ценности
+        )
+    ''')
+
+    # --- Таблица наград/инвентаря (просто) ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT CHECK(type IN ('equipment', 'pet', 'custom')) NOT NULL,
+            description TEXT,
+            cost INTEGER DEFAULT 0, -- Цена в золоте для покупки
+            sprite_name TEXT, -- Имя файла спрайта в assets/
+            owned BOOLEAN DEFAULT 0, -- Владеет ли игрок
+            equipped BOOLEAN DEFAULT 0 -- Экипировано ли (если применимо)
+        )
+    ''')
+    # Добавим примеры наград из спрайтов (без дублей, если таблица уже была заполнена)
+    for reward in DEFAULT_REWARDS:
+        cursor.execute('''
+            INSERT INTO rewards (name, type, cost, sprite_name)
+            SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM rewards WHERE name = ?)
+        ''', reward + (reward[0],))
+
+def _002_indexes(cursor):
+    """Индексы под запросы get_tasks и daily_reset."""
+    # get_tasks('todos'): WHERE completed = 0 ORDER BY creation_date
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_todos_completed_created ON todos (completed, creation_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_dailies_last_completed ON dailies (last_completed)')
+
+def _003_task_events(cursor):
+    """Журнал событий задач (см. task_events.py)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, -- Порядок записи = порядок проигрывания
+            task_type TEXT NOT NULL, -- 'habits', 'dailies', 'todos', 'rewards'
+            task_id INTEGER NOT NULL,
+            kind TEXT CHECK(kind IN ('complete', 'trigger', 'miss', 'purchase', 'baseline')) NOT NULL,
+            day DATE, -- День, к которому относится событие (локальная дата)
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            value INTEGER, -- Для 'baseline': streak/counter на момент создания журнала
+            xp INTEGER DEFAULT 0,
+            gold INTEGER DEFAULT 0,
+            hp INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_events_task ON task_events (task_type, task_id, id)')
+    # Уже накопленные стрики и счетчики переносим в журнал, чтобы replay их не обнулил
+    if not cursor.execute("SELECT 1 FROM task_events WHERE kind = 'baseline' LIMIT 1").fetchone():
+        cursor.execute('''
+            INSERT INTO task_events (task_type, task_id, kind, day, value)
+            SELECT 'dailies', id, 'baseline', last_completed, streak FROM dailies
+            WHERE streak != 0 OR last_completed IS NOT NULL
+        ''')
+        cursor.execute('''
+            INSERT INTO task_events (task_type, task_id, kind, day, value)
+            SELECT 'habits', id, 'baseline', last_triggered, counter FROM habits
+            WHERE counter != 0 OR last_triggered IS NOT NULL
+        ''')
+
+def _004_stats_rollups(cursor):
+    """Дневные и недельные сводки для stats.py, заполняются из журнала событий."""
+    rollups = (('stats_daily', 'day', 'day'),
+               ('stats_weekly', 'week', "date(day, 'weekday 0', '-6 days')")) # Неделя = дата ее понедельника
+    for table, bucket, _ in rollups:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {bucket} DATE NOT NULL,
+                task_type TEXT NOT NULL, -- '*' - сумма по всем задачам
+                task_id INTEGER NOT NULL,
+                xp INTEGER DEFAULT 0,
+                gold INTEGER DEFAULT 0,
+                gold_spent INTEGER DEFAULT 0,
+                hp_lost INTEGER DEFAULT 0,
+                completions INTEGER DEFAULT 0,
+                misses INTEGER DEFAULT 0,
+                PRIMARY KEY ({bucket}, task_type, task_id)
+            ) WITHOUT ROWID
+        ''')
+        # Запросы по одной задаче за диапазон дат
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_task ON {table} (task_type, task_id, {bucket})')
+    # Колонки reverted еще нет (миграция 006), поэтому берем все события;
+    # '*' с task_id = 0 - сумма по всем задачам
+    for table, bucket, bucket_sql in rollups:
+        cursor.execute(f'DELETE FROM {table}')
+        for key_sql in ('task_type, task_id', "'*', 0"):
+            cursor.execute(f'''
+                INSERT INTO {table} ({bucket}, task_type, task_id, xp, gold, gold_spent, hp_lost, completions, misses)
+                SELECT {bucket_sql}, {key_sql}, SUM(xp),
+                       SUM(CASE WHEN kind != 'purchase' THEN gold ELSE 0 END),
+                       SUM(CASE WHEN kind = 'purchase' THEN gold ELSE 0 END),
+                       SUM(hp), SUM(kind IN ('complete', 'trigger')), SUM(kind = 'miss')
+                FROM task_events
+                WHERE kind != 'baseline' AND day IS NOT NULL
+                GROUP BY 1, 2, 3
+            ''')
+
+def _005_app_state(cursor):
+    """Состояние приложения внутри БД профиля (например, дата последнего запуска)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+def _add_column(cursor, table, column, declaration):
+    """ALTER TABLE ADD COLUMN, если колонки еще нет (SQLite не знает ADD COLUMN IF NOT EXISTS)."""
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+def _006_command_journal(cursor):
+    """Мягкое удаление задач и журнал обратимых команд (см. commands.py)."""
+    for table in ('habits', 'dailies', 'todos'):
+        _add_column(cursor, table, 'deleted_at', 'TIMESTAMP') # NULL - задача не удалена
+        # Надгробий немного: частичный индекс нужен только compact()
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_deleted ON {table} (deleted_at) WHERE deleted_at IS NOT NULL')
+    _add_column(cursor, 'task_events', 'reverted', 'INTEGER NOT NULL DEFAULT 0') # Событие отменено командой
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS command_journal (
+            id INTEGER PRIMARY KEY,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            undone INTEGER NOT NULL DEFAULT 0 -- 1, пока команда отменена (доступна для повтора)
+        )
+    ''')
+    # Значение каждой ячейки, которую изменила команда, до и после нее
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS command_cells (
+            command_id INTEGER NOT NULL, -- command_journal.id
+            target TEXT NOT NULL, -- Таблица: 'todos', 'rewards', 'character', 'task_events', ...
+            row_id INTEGER NOT NULL,
+            column_name TEXT NOT NULL,
+            before,
+            after
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_command_cells_command ON command_cells (command_id, target, column_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_command_cells_row ON command_cells (target, row_id)')
+
+def _007_task_search(cursor):
+    """Полнотекстовый индекс названий и заметок задач (см. search.py)."""
+    # prefix: префиксные индексы для поиска по мере набора ('ru' -> 'run')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS task_search USING fts5(
+            name, notes, prefix = '2 3', tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('DELETE FROM task_search')
+    # rowid = id * 4 + код типа; заметки есть только у to-do. Пока в app_state
+    # есть 'search_bulk_load', триггер вставки молчит (search.bulk_load)
+    for task_type, code, notes in (('habits', 1, None), ('dailies', 2, None), ('todos', 3, 'notes')):
+        new_values = f"new.id * 4 + {code}, new.name, {'new.notes' if notes else 'NULL'}"
+        delete = f'DELETE FROM task_search WHERE rowid = old.id * 4 + {code};'
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {task_type}_search_insert AFTER INSERT ON {task_type}
+            WHEN new.deleted_at IS NULL AND NOT EXISTS (SELECT 1 FROM app_state WHERE key = 'search_bulk_load')
+            BEGIN
+                INSERT INTO task_search (rowid, name, notes) VALUES ({new_values});
+            END
+        ''')
+        # Переименование, мягкое удаление и восстановление: запись задачи пересоздается
+        watched = 'name, notes, deleted_at' if notes else 'name, deleted_at'
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {task_type}_search_update AFTER UPDATE OF {watched} ON {task_type}
+            BEGIN
+                {delete}
+                INSERT INTO task_search (rowid, name, notes) SELECT {new_values} WHERE new.deleted_at IS NULL;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {task_type}_search_delete AFTER DELETE ON {task_type}
+            BEGIN
+                {delete}
+            END
+        ''')
+        cursor.execute(f'''
+            INSERT INTO task_search (rowid, name, notes)
+            SELECT id * 4 + {code}, name, {notes or 'NULL'} FROM {task_type} WHERE deleted_at IS NULL
+        ''')
+
+def _008_sort_indexes(cursor):
+    """Индексы под сортировки колонок UI (get_tasks с sort); выражения - как в database.SORT_COLUMNS."""
+    # completed первой колонкой: иначе планировщик берет idx_todos_completed_created
+    # (равенство по completed) и сортирует страницу во временном B-дереве
+    for name, key in (('due', "COALESCE(due_date, '9999-12-31')"), ('difficulty', 'difficulty'), ('value', 'value_xp')):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_todos_{name} ON todos (completed, {key}, id) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_dailies_streak ON dailies (streak, id) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_habits_counter ON habits (counter, id) WHERE deleted_at IS NULL')
+
+def _009_next_due(cursor):
+    """Срок следующего выполнения дейлика по его frequency (см. recurrence.py)."""
+    _add_column(cursor, 'dailies', 'next_due', 'DATE')
+    # daily_reset читает только дейлики с наступившим сроком
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_dailies_next_due ON dailies (next_due) WHERE deleted_at IS NULL')
+    # До этой версии каждый дейлик сбрасывался как ежедневный: срок - день после
+    # последнего выполнения, а без выполнений - сегодня. Строкам с другим правилом
+    # срок по их frequency назначает database.init_db (recurrence.schedule_missing)
+    cursor.execute('''
+        UPDATE dailies SET next_due = COALESCE(date(last_completed, '+1 day'), date('now', 'localtime'))
+        WHERE next_due IS NULL AND COALESCE(frequency, 'daily') = 'daily'
+    ''')
+
+# Порядок важен: номер версии = позиция в списке + 1
+MIGRATIONS = [
+    _001_initial_schema,
+    _002_indexes,
+    _003_task_events,
+    _004_stats_rollups,
+    _005_app_state,
+    _006_command_journal,
+    _007_task_search,
+    _008_sort_indexes,
+    _009_next_due,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(manager):
+    """
+    Применяет недостающие миграции, каждую в своей транзакции.
+
+    Возвращает список примененных версий (пустой, если схема актуальна).
+    """
+    version = get_schema_version(manager.connection())
+    applied = []
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        with manager.transaction() as conn:
+            MIGRATIONS[number - 1](conn.cursor())
+            # user_version меняется в той же транзакции, что и сама миграция
+            conn.execute(f'PRAGMA user_version = {number}')
+        applied.append(number)
+    return applied
@@ -0,0 +1,144 @@
+# panels.py
+import pygame
+from hit_index import HitGrid
+
+
+class Panel:
+    """
+    Панель интерфейса, закэшированная в собственном Surface.
+
+    draw(surface, rect) рисует панель в локальных координатах (rect
+    начинается в (0, 0)) и возвращает кликабельные зоны
+    [(rect, type, id, action), ...]; Panel переводит их в экранные.
+    """
+
+    def __init__(self, name, rect, draw):
+        self.name = name
+        self.rect = pygame.Rect(rect)
+        self.surface = pygame.Surface(self.rect.size)
+        self.click_areas = []
+        self.hits = HitGrid(self.rect)
+        self.dirty = True
+        self._draw = draw
+
+    def invalidate(self):
+        self.dirty = True
+
+    def render(self, background):
+        """Перерисовывает панель в ее Surface поверх фона под ней."""
+        self.surface.blit(background, (0, 0), self.rect)
+        areas = self._draw(self.surface, self.surface.get_rect()) or []
+        self.click_areas = [(area_rect.move(self.rect.topleft),) + tuple(rest) for area_rect, *rest in areas]
+        # Индекс зон строится вместе с кэшем панели, а не на каждом кадре
+        self.hits.clear()
+        for area in self.click_areas:
+            self.hits.insert(area[0], area)
+        self.dirty = False
+
+    def hit_test(self, pos):
+        return self.hits.query(pos)
+
+
+class PanelLayer:
+    """Набор панелей, которые выводятся на экран только когда изменились."""
+
+    def __init__(self, background, hover_color=(255, 255, 255), profiler=None):
+        self.background = background
+        self.hover_color = hover_color
+        self.profiler = profiler # FrameProfiler: отрисовка каждой панели замеряется как 'draw:<name>'
+        self.panels = {} # name -> Panel, в порядке отрисовки
+        self._full_redraw = True
+        self._hover_rect = None # Подсвеченная зона под курсором
+
+    def add(self, panel):
+        self.panels[panel.name] = panel
+        self._full_redraw = True
+        return panel
+
+    def invalidate(self, *names):
+        """Помечает панели грязными (без аргументов - все)."""
+        for name in names or self.panels:
+            panel = self.panels.get(name)
+            if panel:
+                panel.invalidate()
+
+    def invalidate_screen(self):
+        """Следующий update перерисует весь экран (например, после expose окна)."""
+        self._full_redraw = True
+
+    def update(self, screen):
+        """Выводит на экран изменившиеся панели и возвращает обновленные прямоугольники."""
+        if self._full_redraw:
+            screen.blit(self.background, (0, 0))
+        dirty_rects = []
+        for panel in self.panels.values():
+            if panel.dirty:
+                if self.profiler:
+                    with self.profiler.phase('draw:' + panel.name):
+                        panel.render(self.background)
+                else:
+                    panel.render(self.background)
+            elif not self._full_redraw:
+                continue
+            screen.blit(panel.surface, panel.rect)
+            dirty_rects.append(panel.rect)
+        if self._hover_rect and self._hover_rect.collidelist(dirty_rects) != -1:
+            self._draw_hover(screen)
+        if self._full_redraw:
+            self._full_redraw = False
+            return [screen.get_rect()]
+        return dirty_rects
+
+    def restore(self, screen, rect):
+        """Восстанавливает область экрана из кэша (например, под закрытым попапом)."""
+        rect = pygame.Rect(rect)
+        screen.blit(self.background, rect, rect)
+        for panel in self.panels.values():
+            overlap = panel.rect.clip(rect)
+            if overlap.width and overlap.height:
+                screen.blit(panel.surface, overlap, overlap.move(-panel.rect.x, -panel.rect.y))
+        if self._hover_rect and self._hover_rect.colliderect(rect):
+            self._draw_hover(screen)
+        return rect
+
+    def hit_test(self, pos):
+        """Кликабельная зона (rect, type, id, action) под точкой или None."""
+        panel = self.panel_at(pos)
+        return panel.hit_test(pos) if panel else None
+
+    def set_hover(self, screen, pos):
+        """
+        Подсвечивает зону под курсором (pos=None - снять подсветку).
+
+        Возвращает измененные прямоугольники; панели при этом не перерисовываются.
+        """
+        area = self.hit_test(pos) if pos else None
+        hover_rect = area[0] if area else None
+        if hover_rect == self._hover_rect:
+            return []
+        dirty_rects = []
+        old_rect, self._hover_rect = self._hover_rect, None
+        if old_rect:
+            dirty_rects.append(self.restore(screen, old_rect))
+        self._hover_rect = hover_rect
+        if hover_rect:
+            self._draw_hover(screen)
+            dirty_rects.append(hover_rect)
+        return dirty_rects
+
+    def _draw_hover(self, screen):
+        pygame.draw.rect(screen, self.hover_color, self._hover_rect, 2, border_radius=3)
+
+    def panel_at(self, pos):
+        """Панель под точкой экрана (или None)."""
+        for panel in reversed(list(self.panels.values())):
+            if panel.rect.collidepoint(pos):
+                return panel
+        return None
+
+    def click_areas(self):
+        """Кликабельные зоны всех панелей в экранных координатах."""
+        areas = []
+        for panel in self.panels.values():
+            areas.extend(panel.click_areas)
+        return areas
@@ -0,0 +1,95 @@
+# profiler.py
+# Замеры фаз кадра (события, отрисовка каждой панели, попап, вывод на экран)
+# через perf_counter_ns. Для каждой фазы хранится кольцевой буфер последних
+# длительностей, из которого считаются перцентили для оверлея (F3).
+# Последние интервалы можно выгрузить в JSON или в формате Chrome trace
+# (открывается в chrome://tracing или Perfetto).
+import json
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+
+HISTORY_SIZE = 240       # Кадров на фазу (~8 с при 30 FPS)
+TRACE_SIZE = 20000       # Интервалов для выгрузки трассы
+PERCENTILES = (50, 95, 99)
+
+
+class FrameProfiler:
+    """Собирает длительности именованных фаз; выключенный почти ничего не стоит."""
+
+    def __init__(self, history=HISTORY_SIZE, trace_size=TRACE_SIZE, enabled=True):
+        self.enabled = enabled
+        self.history = history
+        self._samples = {} # phase -> deque длительностей, нс (кольцевой буфер)
+        self._trace = deque(maxlen=trace_size) # (phase, start_ns, duration_ns)
+        self._origin = time.perf_counter_ns()
+
+    @contextmanager
+    def phase(self, name):
+        """with profiler.phase('events'): ... - замеряет блок."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter_ns() - start)
+
+    def now(self):
+        """Отметка времени для record_since (0, если профилировщик выключен)."""
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def record_since(self, name, start_ns):
+        """Записывает фазу, начавшуюся в start_ns (для блоков, которые неудобно оборачивать в with)."""
+        if self.enabled and start_ns:
+            self.record(name, start_ns, time.perf_counter_ns() - start_ns)
+
+    def record(self, name, start_ns, duration_ns):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self.history)
+        samples.append(duration_ns)
+        self._trace.append((name, start_ns, duration_ns))
+
+    def percentiles(self, name, percentiles=PERCENTILES):
+        """{p: мс} по последним замерам фазы (пустой словарь, если замеров нет)."""
+        samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return {}
+        # Метод ближайшего ранга: p-й перцентиль - наименьшее значение, не меньшее p% замеров
+        return {p: samples[max(0, math.ceil(len(samples) * p / 100) - 1)] / 1e6 for p in percentiles}
+
+    def summary(self):
+        """Сводка по фазам в порядке их первого появления."""
+        result = {}
+        for name, samples in self._samples.items():
+            stats = {f'p{p}_ms': round(value, 4) for p, value in self.percentiles(name).items()}
+            stats['max_ms'] = round(max(samples) / 1e6, 4)
+            stats['count'] = len(samples)
+            result[name] = stats
+        return result
+
+    def clear(self):
+        self._samples.clear()
+        self._trace.clear()
+
+    # --- Выгрузка ---
+    def dump_json(self, path):
+        """Сводка и сырые интервалы (мс от создания профилировщика)."""
+        data = {
+            'summary': self.summary(),
+            'trace': [{'phase': name, 'start_ms': (start - self._origin) / 1e6, 'duration_ms': duration / 1e6}
+                      for name, start, duration in self._trace],
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+
+    def dump_chrome_trace(self, path):
+        """Трасса в формате Chrome Trace Event (события 'X', время в мкс)."""
+        events = [{'name': name, 'ph': 'X', 'ts': (start - self._origin) / 1000, 'dur': duration / 1000,
+                   'pid': 1, 'tid': 1}
+                  for name, start, duration in self._trace]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
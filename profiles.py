@@ -0,0 +1,100 @@
+# profiles.py
+# Несколько профилей (персонажей) на одной установке: у каждого своя БД SQLite
+# со своим персонажем, задачами и датой последнего запуска. Профиль 'default'
+# - это прежний rpg_life.db, так что существующие данные остаются на месте.
+import os
+import re
+from collections import OrderedDict, namedtuple
+import database
+from task_store import TaskStore
+
+DEFAULT_PROFILE = 'default'
+PROFILES_DIR = 'profiles'
+WARM_PROFILES = 3 # Сколько недавних профилей держат открытые соединения и TaskStore
+PROFILE_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+# Загруженный профиль: store - TaskStore, character - dict строки character
+Profile = namedtuple('Profile', 'name db_name store character')
+
+
+def profile_db_name(name, directory=PROFILES_DIR):
+    if name == DEFAULT_PROFILE:
+        return database.DEFAULT_DB_NAME
+    return os.path.join(directory, f'{name}.db')
+
+
+class ProfileManager:
+    """
+    Переключает текущий профиль (database.DB_NAME) без повторного открытия БД.
+
+    Последние WARM_PROFILES профилей остаются «теплыми»: их соединения
+    (менеджеры в database) и TaskStore не закрываются, поэтому возврат к
+    недавнему профилю стоит одной проверки даты последнего запуска.
+    """
+
+    def __init__(self, directory=PROFILES_DIR, warm=WARM_PROFILES, writer=None):
+        self.directory = directory
+        self.warm = warm
+        self.writer = writer # Общий WriteQueue: сбрасывается перед сменой БД
+        self._loaded = OrderedDict() # name -> Profile, от давно использованных к недавним
+        self.current = None
+
+    def names(self):
+        """Имена существующих профилей ('default' всегда первый)."""
+        names = []
+        if os.path.isdir(self.directory):
+            names = sorted(os.path.splitext(f)[0] for f in os.listdir(self.directory) if f.endswith('.db'))
+        return [DEFAULT_PROFILE] + [name for name in names if name != DEFAULT_PROFILE]
+
+    def switch(self, name):
+        """Делает профиль name текущим (создавая его БД при необходимости) и возвращает Profile."""
+        if not PROFILE_NAME_RE.match(name):
+            raise ValueError(f"Invalid profile name: {name!r}")
+        if self.current and self.current.name == name:
+            return self.current
+        if self.writer:
+            self.writer.flush() # Записи в очереди относятся к прежней БД
+        profile = self._loaded.pop(name, None)
+        if profile is None:
+            profile = self._open(name)
+        else:
+            database.DB_NAME = profile.db_name
+            if database.check_last_run_date(): # Профиль «проспал» полночь, пока был в фоне
+                profile.store.load()
+                profile.character.update(database.get_character_data())
+        self._loaded[name] = profile
+        self.current = profile
+        self._evict()
+        return profile
+
+    def next_name(self):
+        """Следующий профиль по кругу (для переключения клавишей)."""
+        names = self.names()
+        if self.current is None or self.current.name not in names:
+            return names[0]
+        return names[(names.index(self.current.name) + 1) % len(names)]
+
+    def is_warm(self, name):
+        return name in self._loaded
+
+    def close(self):
+        for profile in self._loaded.values():
+            database.close_db(profile.db_name)
+        self._loaded.clear()
+        self.current = None
+
+    def _open(self, name):
+        db_name = profile_db_name(name, self.directory)
+        if os.path.dirname(db_name):
+            os.makedirs(os.path.dirname(db_name), exist_ok=True)
+        database.DB_NAME = db_name
+        database.init_db()
+        database.check_last_run_date()
+        store = TaskStore(self.writer).load()
+        return Profile(name, db_name, store, database.get_character_data())
+
+    def _evict(self):
+        """Закрывает самые давние профили сверх лимита теплых."""
+        while len(self._loaded) > self.warm:
+            _, profile = self._loaded.popitem(last=False)
+            database.close_db(profile.db_name)
@@ -0,0 +1,138 @@
+# progression.py
+# Прогрессия персонажа: сколько уровней дает прибавка опыта, без пошагового
+# цикла. Пороги уровней растут в 1.5 раза (с отбрасыванием дробной части),
+# поэтому для каждого стартового порога один раз строится таблица
+# накопленных порогов, а число уровней находится бинарным поиском.
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+import database
+import task_events
+
+THRESHOLD_GROWTH = 1.5   # xp_to_next_level умножается на это при каждом уровне
+FIRST_THRESHOLD = 100    # xp_to_next_level на 1-м уровне (значение по умолчанию в схеме character)
+HEALTH_PER_LEVEL = 20    # Прибавка к max_health за уровень
+MAX_TABLE_XP = 2 ** 63   # Таблица строится, пока сумма порогов не превысит это значение
+
+# Награда (или штраф) за одно событие задачи для apply_rewards
+Grant = namedtuple('Grant', 'task_type task_id kind xp gold hp day', defaults=('complete', 0, 0, 0, None))
+
+
+def next_threshold(threshold):
+    return int(threshold * THRESHOLD_GROWTH)
+
+@lru_cache(maxsize=64)
+def threshold_table(first_threshold):
+    """
+    (пороги, накопленные суммы) начиная с first_threshold.
+
+    Таблица заканчивается, когда сумма превышает MAX_TABLE_XP или порог
+    перестает расти (маленькие пороги: int(1 * 1.5) == 1) - дальше все
+    уровни стоят одинаково и считаются делением.
+    """
+    thresholds, cumulative = [], []
+    threshold, total = first_threshold, 0
+    while total <= MAX_TABLE_XP:
+        thresholds.append(threshold)
+        total += threshold
+        cumulative.append(total)
+        following = next_threshold(threshold)
+        if following <= threshold:
+            break
+        threshold = following
+    return tuple(thresholds), tuple(cumulative)
+
+def levels_for_xp(xp, threshold):
+    """
+    Сколько уровней дает xp при текущем пороге threshold.
+
+    Возвращает (уровней, остаток опыта, новый порог) - то же, что цикл
+    «пока xp >= порог: xp -= порог; порог *= 1.5», но за O(log уровней).
+    """
+    if threshold <= 0:
+        raise ValueError(f"xp_to_next_level must be positive, got {threshold}")
+    thresholds, cumulative = threshold_table(threshold)
+    levels = bisect_right(cumulative, xp)
+    if levels:
+        xp -= cumulative[levels - 1]
+    if levels < len(thresholds):
+        return levels, xp, thresholds[levels]
+    # Порог больше не растет: оставшиеся уровни стоят по last каждый
+    last = thresholds[-1]
+    extra, xp = divmod(xp, last)
+    return levels + extra, xp, last
+
+def add_xp(character, xp_gain):
+    """
+    Начисляет опыт персонажу (dict) и применяет все левел-апы сразу.
+
+    Возвращает число полученных уровней.
+    """
+    levels, xp, threshold = levels_for_xp(character['xp'] + xp_gain, character['xp_to_next_level'])
+    character['xp'] = xp
+    character['xp_to_next_level'] = threshold
+    if levels:
+        character['level'] += levels
+        character['max_health'] += HEALTH_PER_LEVEL * levels
+        character['health'] = character['max_health'] # Полное восстановление при левел-апе
+    return levels
+
+def remove_xp(character, xp_loss):
+    """
+    Снимает опыт (снятая отметка выполнения) и опускает уровни, если опыта
+    текущего уровня не хватает. Возвращает число потерянных уровней.
+
+    Прежние пороги берутся из таблицы от FIRST_THRESHOLD. Если порог
+    персонажа с ней не сходится (правленая БД), уровень не меняется, а опыт
+    не уходит ниже нуля. Здоровье, восстановленное левел-апом, не возвращается.
+    """
+    if xp_loss <= character['xp']:
+        character['xp'] -= xp_loss
+        return 0
+    thresholds, cumulative = threshold_table(FIRST_THRESHOLD)
+    level = character['level']
+    if not 1 <= level <= len(thresholds) or thresholds[level - 1] != character['xp_to_next_level']:
+        character['xp'] = 0
+        return 0
+    total = (cumulative[level - 2] if level > 1 else 0) + character['xp'] - xp_loss
+    levels, xp, threshold = levels_for_xp(max(total, 0), FIRST_THRESHOLD)
+    lost = level - 1 - levels
+    character['level'] -= lost
+    character['xp'] = xp
+    character['xp_to_next_level'] = threshold
+    character['max_health'] -= HEALTH_PER_LEVEL * lost
+    character['health'] = min(character['health'], character['max_health'])
+    return lost
+
+def apply_grant(character, xp=0, gold=0, hp=0):
+    """Одна награда/штраф в памяти: опыт с левел-апами, золото, потеря здоровья. Возвращает число уровней."""
+    levels = add_xp(character, xp)
+    character['gold'] += gold
+    if hp:
+        character['health'] = max(0, character['health'] - hp)
+    return levels
+
+def revoke_grant(character, xp=0, gold=0):
+    """Обратное apply_grant для опыта и золота (золото может уйти в минус - оно уже потрачено)."""
+    levels = remove_xp(character, xp)
+    character['gold'] -= gold
+    return levels
+
+def apply_rewards(grants):
+    """
+    Применяет пачку наград (Grant) одной транзакцией.
+
+    Все события пишутся в журнал (task_events) и сводки одним проходом,
+    персонаж обновляется одним UPDATE. Награды применяются по порядку,
+    поэтому штраф после левел-апа снимает здоровье уже с полного запаса.
+    Возвращает итоговую строку персонажа.
+    """
+    grants = [grant if isinstance(grant, Grant) else Grant(**grant) if isinstance(grant, dict) else Grant(*grant)
+              for grant in grants]
+    with database.transaction() as conn:
+        character = database.get_character_data()
+        for grant in grants:
+            apply_grant(character, grant.xp, grant.gold, grant.hp)
+        task_events.record_events(conn, grants)
+        database.update_character_data(character)
+    return character
@@ -0,0 +1,91 @@
+# recurrence.py
+# Правила повторения дейликов (dailies.frequency) и расчет next_due - ближайшего
+# дня, когда дейлик нужно выполнить. Правила: 'daily', 'weekly:Mon,Wed' (дни
+# недели), 'monthly:1,15' (числа месяца; 31 в коротком месяце - последний день).
+# Выполнение переносит next_due на следующий срок, а daily_reset читает только
+# строки с наступившим сроком (индекс по next_due, миграция 009).
+import calendar
+import datetime
+from collections import namedtuple
+from functools import lru_cache
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun') # Индекс = date.weekday()
+DEFAULT_FREQUENCY = 'daily'
+SQL_FUNCTION = 'recurrence_next' # Имя next_due_sql в SQL (регистрирует database.register_functions)
+
+Rule = namedtuple('Rule', 'kind days') # days: дни недели (0 - Mon) или числа месяца
+
+_DAILY = Rule('daily', ())
+# Дейлики без срока; deleted_at IS NULL - условие частичного индекса idx_dailies_next_due
+UNSCHEDULED = 'next_due IS NULL AND deleted_at IS NULL'
+
+
+@lru_cache(maxsize=256)
+def parse(frequency):
+    """'weekly:Mon,Wed' -> Rule('weekly', (0, 2)). ValueError для неизвестного правила."""
+    kind, _, days = (frequency or DEFAULT_FREQUENCY).strip().partition(':')
+    kind = kind.lower()
+    if kind == 'daily' and not days:
+        return _DAILY
+    names = [name.strip() for name in days.split(',') if name.strip()]
+    if kind == 'weekly' and names:
+        lookup = {day.lower(): index for index, day in enumerate(WEEKDAYS)}
+        try:
+            return Rule('weekly', tuple(sorted({lookup[name[:3].lower()] for name in names})))
+        except KeyError:
+            pass
+    elif kind == 'monthly' and names and all(name.isdigit() and 1 <= int(name) <= 31 for name in names):
+        return Rule('monthly', tuple(sorted({int(name) for name in names})))
+    raise ValueError(f"Unknown frequency: {frequency!r}")
+
+def rule(frequency):
+    """Правило для планирования: неизвестное считается ежедневным (так дейлики работали раньше)."""
+    try:
+        return parse(frequency)
+    except ValueError:
+        return _DAILY
+
+def next_due(frequency, after):
+    """Первый срок строго после даты after."""
+    kind, days = rule(frequency)
+    if kind == 'weekly':
+        weekday = after.weekday()
+        step = min((day - weekday - 1) % 7 + 1 for day in days)
+        return after + datetime.timedelta(days=step)
+    if kind == 'monthly':
+        year, month = after.year, after.month
+        while True:
+            last = calendar.monthrange(year, month)[1]
+            for day in days:
+                due = datetime.date(year, month, min(day, last))
+                if due > after:
+                    return due
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return after + datetime.timedelta(days=1)
+
+def first_due(frequency, start):
+    """Первый срок в день start или позже (новый дейлик, снятая отметка выполнения)."""
+    return next_due(frequency, start - datetime.timedelta(days=1))
+
+def initial_due(frequency, last_completed, today):
+    """
+    next_due для строки, у которой его еще нет (старая БД, вставка мимо add_task):
+    следующий срок после последнего выполнения, а без выполнений - первый с today.
+    """
+    if last_completed:
+        return next_due(frequency, datetime.date.fromisoformat(str(last_completed)[:10]))
+    return first_due(frequency, today)
+
+def next_due_sql(frequency, after):
+    """next_due для SQL: даты - ISO-строки (None -> None)."""
+    if after is None:
+        return None
+    return next_due(frequency, datetime.date.fromisoformat(after[:10])).isoformat()
+
+def schedule_missing(conn, today):
+    """Заполняет next_due дейликов, у которых его нет; возвращает число строк."""
+    rows = conn.execute(f'SELECT id, frequency, last_completed FROM dailies WHERE {UNSCHEDULED}').fetchall()
+    conn.executemany('UPDATE dailies SET next_due = ? WHERE id = ?',
+                     [(initial_due(frequency, last_completed, today).isoformat(), daily_id)
+                      for daily_id, frequency, last_completed in rows])
+    return len(rows)
@@ -0,0 +1,45 @@
+# scheduler.py
+import datetime
+import pygame
+
+
+class FrameScheduler:
+    """
+    Решает, как главный цикл ждет следующий кадр.
+
+    Пока идет анимация (открыт попап с мигающим курсором) - фиксированный FPS.
+    В остальное время поток спит в pygame.event.wait до следующего события
+    или до полуночи, чтобы вовремя выполнить ежедневный сброс.
+    """
+
+    def __init__(self, fps=30, today=datetime.date.today, now=datetime.datetime.now):
+        self.fps = fps
+        self.clock = pygame.time.Clock()
+        self._today = today
+        self._now = now
+        self._day = today()
+
+    def ms_until_rollover(self):
+        """Миллисекунды до ближайшей полуночи (не меньше 1)."""
+        now = self._now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        return max(1, int((midnight - now).total_seconds() * 1000) + 1)
+
+    def wait_events(self, animating):
+        """Возвращает события для следующей итерации цикла."""
+        if animating:
+            self.clock.tick(self.fps)
+            return pygame.event.get()
+        # Простой: блокируемся до события или до смены дня
+        event = pygame.event.wait(self.ms_until_rollover())
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get()) # Забираем все, что накопилось
+        return events
+
+    def day_changed(self):
+        """True один раз после наступления нового дня."""
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            return True
+        return False
@@ -0,0 +1,97 @@
+# search.py
+# Полнотекстовый поиск по названиям и заметкам задач (FTS5). Индекс
+# task_search заполняется триггерами на habits, dailies и todos (см.
+# миграцию 007), поэтому любая запись в таблицы - из UI, импорта или
+# отмены команды - сразу видна поиску. Удаленные (deleted_at) задачи из
+# индекса убираются. Запросы из приложения - через database.search_tasks.
+import re
+from contextlib import contextmanager
+
+SEARCH_TABLE = 'task_search'
+# Одна FTS-таблица на три типа задач: rowid = id * 4 + код типа, поэтому
+# триггер находит запись задачи по rowid, без просмотра индекса
+TYPE_CODES = {'habits': 1, 'dailies': 2, 'todos': 3}
+CODE_TYPES = {code: task_type for task_type, code in TYPE_CODES.items()}
+NAME_WEIGHT = 10.0  # Совпадение в названии весит больше, чем в заметках
+NOTES_WEIGHT = 1.0
+# Больше совпадений ранжировать дорого (bm25 считается для каждого): такие
+# общие запросы (первые буквы) возвращаются в порядке id
+RANK_LIMIT = 2000
+# Ключ app_state: пока он есть в транзакции, триггер вставки не индексирует строки (см. bulk_load)
+BULK_LOAD_KEY = 'search_bulk_load'
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _notes_sql(task_type, row):
+    return f'{row}.notes' if task_type == 'todos' else 'NULL' # Заметки есть только у to-do
+
+def index_rows(conn, task_type, after_id=0):
+    """Добавляет в индекс задачи task_type с id > after_id одним INSERT ... SELECT."""
+    conn.execute(f'''
+        INSERT INTO {SEARCH_TABLE} (rowid, name, notes)
+        SELECT id * 4 + {TYPE_CODES[task_type]}, name, {_notes_sql(task_type, task_type)} FROM {task_type}
+        WHERE id > ? AND deleted_at IS NULL
+    ''', (after_id,))
+
+@contextmanager
+def bulk_load(conn):
+    """
+    with bulk_load(conn): ... - массовая вставка задач (внутри транзакции).
+
+    FTS5 сбрасывает накопленные данные на каждой точке сохранения, а триггер
+    открывает ее на каждую строку, поэтому построчная индексация импорта в
+    разы медленнее. Внутри блока триггер вставки молчит, а новые строки
+    индексируются одним запросом в конце. Флаг живет только в транзакции:
+    другие соединения его не видят.
+    """
+    max_ids = {task_type: conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {task_type}').fetchone()[0]
+               for task_type in TYPE_CODES}
+    conn.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES (?, '1')", (BULK_LOAD_KEY,))
+    yield conn
+    conn.execute('DELETE FROM app_state WHERE key = ?', (BULK_LOAD_KEY,))
+    for task_type, max_id in max_ids.items():
+        index_rows(conn, task_type, max_id)
+
+def match_query(text):
+    """
+    Строка поиска -> выражение FTS5: каждое слово как префикс, все слова обязательны.
+
+    Синтаксис FTS5 (кавычки, OR, NEAR) из ввода не интерпретируется.
+    Возвращает None, если в строке нет слов.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def search(conn, text, task_type=None, limit=None):
+    """
+    Задачи, подходящие под строку поиска, от лучшего совпадения к худшему.
+
+    Возвращает [(task_type, task_id), ...]; task_type ограничивает поиск одним
+    типом. Если совпадений больше RANK_LIMIT, они идут в порядке id.
+    """
+    query = match_query(text)
+    if query is None:
+        return []
+    where = f'{SEARCH_TABLE} MATCH ?'
+    params = [query]
+    if task_type is not None:
+        where += ' AND rowid % 4 = ?'
+        params.append(TYPE_CODES[task_type])
+    # Сначала дешевая проверка, сколько совпадений (без ранжирования)
+    matched = conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM {SEARCH_TABLE} WHERE {where} LIMIT ?)',
+                           params + [RANK_LIMIT + 1]).fetchone()[0]
+    order = f'bm25({SEARCH_TABLE}, {NAME_WEIGHT}, {NOTES_WEIGHT})' if matched <= RANK_LIMIT else 'rowid'
+    sql = f'SELECT rowid FROM {SEARCH_TABLE} WHERE {where} ORDER BY {order}'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return [(CODE_TYPES[rowid % 4], rowid // 4) for rowid, in conn.execute(sql, params)]
+
+def by_type(results):
+    """[(task_type, id), ...] -> {task_type: [id, ...]} с сохранением порядка релевантности."""
+    grouped = {task_type: [] for task_type in TYPE_CODES}
+    for task_type, task_id in results:
+        grouped[task_type].append(task_id)
+    return grouped
@@ -0,0 +1,76 @@
+# sprite_cache.py
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+
+log = logging.getLogger(__name__)
+
+
+class SpriteCache:
+    """
+    Спрайты из папки assets по ключу (имя файла, размер).
+
+    Файл декодируется при первом обращении. prefetch() заранее декодирует
+    и масштабирует спрайты в фоновом потоке; convert_alpha (требует окна)
+    выполняется уже в потоке отрисовки внутри get().
+    """
+
+    def __init__(self, folder, fallback_color=(255, 0, 0)):
+        self.folder = folder
+        self.fallback_color = fallback_color
+        self._sprites = {} # (name, size) -> готовый Surface
+        self._pending = {} # (name, size) -> Future с декодированным Surface
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _decode(self, name, size):
+        """Загружает и масштабирует файл; безопасно вызывать из фонового потока."""
+        path = os.path.join(self.folder, name)
+        try:
+            image = pygame.image.load(path)
+        except (pygame.error, FileNotFoundError) as e:
+            log.warning("Cannot load image: %s - %s", name, e)
+            # Возвращаем заглушку
+            fallback = pygame.Surface(size if size else (32, 32))
+            fallback.fill(self.fallback_color)
+            return fallback
+        if size:
+            image = pygame.transform.scale(image, size)
+        return image
+
+    def get(self, name, size=None):
+        """Спрайт name размера size (None - исходный размер)."""
+        key = (name, size)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            return sprite
+        with self._lock:
+            future = self._pending.pop(key, None)
+        image = future.result() if future else self._decode(name, size)
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+        self._sprites[key] = image
+        return image
+
+    def prefetch(self, keys):
+        """Ставит спрайты [(name, size), ...] в очередь фонового декодирования."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sprite-decode')
+            for key in keys:
+                if key not in self._sprites and key not in self._pending:
+                    self._pending[key] = self._executor.submit(self._decode, *key)
+
+    def prefetch_rewards(self, rewards, size):
+        """Предзагружает иконки всех наград по колонке rewards.sprite_name."""
+        self.prefetch((reward['sprite_name'], size) for reward in rewards if reward.get('sprite_name'))
+
+    def __contains__(self, key):
+        return key in self._sprites
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,98 @@
+# stats.py
+# Статистика для дашбордов: читается только из сводок stats_daily/stats_weekly,
+# без сканирования журнала task_events. Даты - date или строка 'YYYY-MM-DD',
+# диапазоны включают обе границы.
+import datetime
+import database
+from task_events import ROLLUP_METRICS, TOTAL_TASK_TYPE
+
+def _as_date(value):
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(value)
+
+def _week_start(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+def _key(task_type, task_id):
+    """Строка сводки: конкретная задача или сумма по всем задачам."""
+    if task_type is None:
+        return TOTAL_TASK_TYPE, 0
+    if task_id is None:
+        raise ValueError("task_id is required when task_type is given")
+    return task_type, task_id
+
+def _check_metric(metric):
+    if metric not in ROLLUP_METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+def series(metric, start, end, bucket='day', task_type=None, task_id=None):
+    """
+    Значения metric по дням (bucket='day') или неделям ('week') за [start, end].
+
+    Возвращает [(дата корзины, значение), ...] без пропусков: пустые корзины = 0.
+    Неделя обозначается датой ее понедельника.
+    """
+    _check_metric(metric)
+    start, end = _as_date(start), _as_date(end)
+    if bucket == 'day':
+        table, step = 'stats_daily', datetime.timedelta(days=1)
+    elif bucket == 'week':
+        table, step = 'stats_weekly', datetime.timedelta(weeks=1)
+        start, end = _week_start(start), _week_start(end)
+    else:
+        raise ValueError(f"Unknown bucket: {bucket}")
+    rows = dict(database.get_db_connection().execute(
+        f'SELECT {bucket}, {metric} FROM {table} WHERE task_type = ? AND task_id = ? AND {bucket} BETWEEN ? AND ?',
+        _key(task_type, task_id) + (start.isoformat(), end.isoformat())
+    ).fetchall())
+    result = []
+    while start <= end:
+        result.append((start, rows.get(start.isoformat(), 0)))
+        start += step
+    return result
+
+def total(metric, start, end, task_type=None, task_id=None):
+    """
+    Сумма metric за [start, end].
+
+    Целые недели берутся из stats_weekly, неполные края - из stats_daily,
+    так что месяц стоит не больше ~15 прочитанных корзин.
+    """
+    _check_metric(metric)
+    start, end = _as_date(start), _as_date(end)
+    if start > end:
+        return 0
+    first_week = _week_start(start + datetime.timedelta(days=6)) # Первый понедельник >= start
+    end_week = _week_start(end + datetime.timedelta(days=1))     # Понедельник после последней полной недели
+    key = _key(task_type, task_id)
+    conn = database.get_db_connection()
+
+    def daily_sum(first, last):
+        if first > last:
+            return 0
+        return conn.execute(
+            f'SELECT COALESCE(SUM({metric}), 0) FROM stats_daily WHERE task_type = ? AND task_id = ? AND day BETWEEN ? AND ?',
+            key + (first.isoformat(), last.isoformat())
+        ).fetchone()[0]
+
+    if first_week >= end_week: # Ни одной полной недели внутри диапазона
+        return daily_sum(start, end)
+    weeks = conn.execute(
+        f'SELECT COALESCE(SUM({metric}), 0) FROM stats_weekly WHERE task_type = ? AND task_id = ? AND week >= ? AND week < ?',
+        key + (first_week.isoformat(), end_week.isoformat())
+    ).fetchone()[0]
+    one_day = datetime.timedelta(days=1)
+    return daily_sum(start, first_week - one_day) + weeks + daily_sum(end_week, end)
+
+# --- Готовые запросы для дашборда ---
+def xp_per_week(start, end):
+    return series('xp', start, end, bucket='week')
+
+def gold_earned(start, end):
+    return total('gold', start, end)
+
+def completion_rate(task_type, task_id, start, end):
+    """Доля дней в [start, end], в которые задача была выполнена (0.0 - 1.0)."""
+    days = (_as_date(end) - _as_date(start)).days + 1
+    if days <= 0:
+        return 0.0
+    return min(1.0, total('completions', start, end, task_type, task_id) / days)
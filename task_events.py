@@ -0,0 +1,235 @@
+# task_events.py
+# Журнал событий задач (только дописывается). streak, counter и last_completed /
+# last_triggered - проекции журнала: они обновляются по одному событию при
+# записи и могут быть целиком пересчитаны повторным проигрыванием (replay).
+# Дневные/недельные сводки stats_daily и stats_weekly (см. stats.py) - тоже
+# проекции журнала: новые события добавляются в них в той же транзакции.
+# Событие, отмененное командой (см. commands.py), помечается reverted = 1 и
+# не участвует ни в проекциях, ни в сводках.
+import datetime
+import itertools
+import recurrence
+
+EVENT_KINDS = ('complete', 'trigger', 'miss', 'purchase', 'baseline')
+
+# Проекции по типу задачи: колонка -> значение до первого события
+PROJECTIONS = {
+    'dailies': {'streak': 0, 'last_completed': None},
+    'habits': {'counter': 0, 'last_triggered': None},
+}
+
+# Инкрементальное обновление строки одним UPDATE на событие. Выполнение дейлика
+# переносит next_due на следующий срок после дня выполнения (функция SQL, см. database.register_functions)
+_APPLY_SQL = {
+    ('dailies', 'complete'): f'UPDATE dailies SET streak = streak + 1, last_completed = :day, completed_today = 1, '
+                             f'next_due = {recurrence.SQL_FUNCTION}(frequency, :day) WHERE id = :task_id',
+    ('dailies', 'miss'): 'UPDATE dailies SET streak = 0 WHERE id = :task_id',
+    ('habits', 'trigger'): 'UPDATE habits SET counter = counter + 1, last_triggered = :day WHERE id = :task_id',
+    ('todos', 'complete'): 'UPDATE todos SET completed = 1 WHERE id = :task_id',
+    ('rewards', 'purchase'): 'UPDATE rewards SET owned = 1 WHERE id = :task_id',
+}
+
+# Обратное _APPLY_SQL для снятой отметки: last_completed - день последнего
+# оставшегося выполнения, срок - снова ближайший с :today (как recurrence.first_due)
+_REVERT_SQL = {
+    ('dailies', 'complete'): f'''UPDATE dailies SET streak = MAX(streak - 1, 0), completed_today = 0,
+                                 last_completed = (SELECT day FROM task_events
+                                                   WHERE task_type = 'dailies' AND task_id = :task_id
+                                                     AND kind IN ('complete', 'baseline') AND NOT reverted
+                                                   ORDER BY id DESC LIMIT 1),
+                                 next_due = {recurrence.SQL_FUNCTION}(frequency, date(:today, '-1 day'))
+                             WHERE id = :task_id''',
+    ('todos', 'complete'): 'UPDATE todos SET completed = 0 WHERE id = :task_id',
+}
+
+def apply_event(row, kind, day, value=None):
+    """
+    Применяет событие к строке задачи в памяти (dict) - то же, что _APPLY_SQL в БД.
+
+    Используется при replay и для оптимистичного обновления TaskStore.
+    """
+    if kind == 'baseline':
+        # Состояние, накопленное до появления журнала (см. миграцию 003)
+        if 'streak' in row:
+            row['streak'], row['last_completed'] = value, day
+        else:
+            row['counter'], row['last_triggered'] = value, day
+    elif kind == 'complete' and 'streak' in row:
+        row['streak'] += 1
+        row['last_completed'] = day
+        row['completed_today'] = 1
+        if 'next_due' in row: # В состоянии replay его нет: next_due - не проекция журнала
+            row['next_due'] = recurrence.next_due(row['frequency'], datetime.date.fromisoformat(day)).isoformat()
+    elif kind == 'complete' and 'completed' in row:
+        row['completed'] = 1
+    elif kind == 'miss':
+        row['streak'] = 0
+    elif kind == 'trigger':
+        row['counter'] += 1
+        row['last_triggered'] = day
+    elif kind == 'purchase':
+        row['owned'] = 1
+    return row
+
+def record_event(conn, task_type, task_id, kind, day=None, xp=0, gold=0, hp=0):
+    """Дописывает событие и обновляет проекции строки (вызывать внутри транзакции)."""
+    params = {
+        'task_type': task_type, 'task_id': task_id, 'kind': kind,
+        'day': day or datetime.date.today().isoformat(), 'xp': xp, 'gold': gold, 'hp': hp,
+    }
+    cursor = conn.execute('''
+        INSERT INTO task_events (task_type, task_id, kind, day, xp, gold, hp)
+        VALUES (:task_type, :task_id, :kind, :day, :xp, :gold, :hp)
+    ''', params)
+    sql = _APPLY_SQL.get((task_type, kind))
+    if sql:
+        conn.execute(sql, params)
+    roll_up(conn, cursor.lastrowid)
+    return cursor.lastrowid
+
+def revert_event(conn, task_type, task_id, kind, today=None):
+    """
+    Отменяет последнее учтенное событие kind задачи: помечает его reverted,
+    вычитает из сводок и откатывает проекции строки (вызывать внутри транзакции).
+
+    Возвращает id события или None, если отменять нечего.
+    """
+    row = conn.execute('''
+        SELECT id FROM task_events WHERE task_type = ? AND task_id = ? AND kind = ? AND NOT reverted
+        ORDER BY id DESC LIMIT 1
+    ''', (task_type, task_id, kind)).fetchone()
+    if row is None:
+        return None
+    event_id = row[0]
+    roll_up_where(conn, 'id = ?', (event_id,), sign=-1)
+    conn.execute('UPDATE task_events SET reverted = 1 WHERE id = ?', (event_id,))
+    sql = _REVERT_SQL.get((task_type, kind))
+    if sql:
+        conn.execute(sql, {'task_id': task_id, 'today': today or datetime.date.today().isoformat()})
+    return event_id
+
+def record_events(conn, events):
+    """
+    Пачка событий за один проход: один executemany на вставку, по executemany
+    на каждый вид проекции и одно обновление сводок.
+
+    events - объекты с полями task_type, task_id, kind, xp, gold, hp, day
+    (например, progression.Grant).
+    """
+    today = datetime.date.today().isoformat()
+    rows = [{'task_type': e.task_type, 'task_id': e.task_id, 'kind': e.kind, 'day': e.day or today,
+             'xp': e.xp, 'gold': e.gold, 'hp': e.hp} for e in events]
+    if not rows:
+        return
+    first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM task_events').fetchone()[0]
+    conn.executemany('''
+        INSERT INTO task_events (task_type, task_id, kind, day, xp, gold, hp)
+        VALUES (:task_type, :task_id, :kind, :day, :xp, :gold, :hp)
+    ''', rows)
+    # Подряд идущие события одного вида - один executemany; порядок между видами
+    # сохраняется (выполнение после пропуска снова начинает стрик с 1)
+    for sql, group in itertools.groupby(rows, key=lambda row: _APPLY_SQL.get((row['task_type'], row['kind']))):
+        if sql:
+            conn.executemany(sql, group)
+    roll_up(conn, first_id)
+
+def record_misses(conn, where, params):
+    """
+    Пишет событие 'miss' для всех дейликов, подходящих под условие where (одним
+    INSERT ... SELECT). День события - пропущенный срок (next_due).
+    """
+    first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM task_events').fetchone()[0]
+    conn.execute(f'''
+        INSERT INTO task_events (task_type, task_id, kind, day, hp)
+        SELECT 'dailies', id, 'miss', next_due, penalty_hp FROM dailies WHERE {where}
+    ''', params)
+    roll_up(conn, first_id)
+
+def record_baselines(conn, task_type, after_id=0):
+    """
+    Переносит в журнал streak/counter строк task_type с id > after_id,
+    накопленные вне журнала (старая БД, импорт), событием 'baseline'.
+    """
+    counter, last_day = PROJECTIONS[task_type]
+    conn.execute(f'''
+        INSERT INTO task_events (task_type, task_id, kind, day, value)
+        SELECT ?, id, 'baseline', {last_day}, {counter} FROM {task_type}
+        WHERE id > ? AND ({counter} != 0 OR {last_day} IS NOT NULL)
+    ''', (task_type, after_id))
+
+def get_events(conn, task_type, task_id):
+    """История задачи в порядке записи."""
+    rows = conn.execute(
+        'SELECT * FROM task_events WHERE task_type = ? AND task_id = ? ORDER BY id', (task_type, task_id)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def replay(conn, task_type):
+    """
+    Пересчитывает проекции task_type ('dailies' или 'habits') из журнала.
+
+    Нужен после изменения правил проекций: история не теряется, меняется
+    только способ свертки. Возвращает число обновленных строк.
+    """
+    defaults = PROJECTIONS[task_type]
+    states = {row[0]: dict(defaults) for row in conn.execute(f'SELECT id FROM {task_type}')}
+    events = conn.execute(
+        'SELECT task_id, kind, day, value FROM task_events WHERE task_type = ? AND NOT reverted ORDER BY id',
+        (task_type,)
+    )
+    for task_id, kind, day, value in events:
+        state = states.get(task_id)
+        if state is not None: # События удаленных задач остаются в журнале
+            apply_event(state, kind, day, value)
+    columns = list(defaults)
+    set_clause = ', '.join(f'{column} = ?' for column in columns)
+    conn.executemany(f'UPDATE {task_type} SET {set_clause} WHERE id = ?',
+                     [[state[column] for column in columns] + [task_id] for task_id, state in states.items()])
+    return len(states)
+
+# --- Сводки для статистики ---
+ROLLUP_TABLES = (('stats_daily', 'day', 'day'),
+                 ('stats_weekly', 'week', "date(day, 'weekday 0', '-6 days')")) # Неделя = дата ее понедельника
+ROLLUP_METRICS = ('xp', 'gold', 'gold_spent', 'hp_lost', 'completions', 'misses')
+TOTAL_TASK_TYPE = '*' # Строка сводки по всем задачам сразу (task_id = 0)
+
+# Значения метрик одного события; 'baseline' не попадает в сводки (событий не было)
+_METRIC_SQL = {
+    'xp': 'xp',
+    'gold': "CASE WHEN kind != 'purchase' THEN gold ELSE 0 END",
+    'gold_spent': "CASE WHEN kind = 'purchase' THEN gold ELSE 0 END",
+    'hp_lost': 'hp',
+    'completions': "kind IN ('complete', 'trigger')",
+    'misses': "kind = 'miss'",
+}
+
+def roll_up(conn, first_id):
+    """Добавляет события с id >= first_id в дневные и недельные сводки (по задаче и общие)."""
+    roll_up_where(conn, 'id >= ? AND NOT reverted', (first_id,))
+
+def roll_up_where(conn, where, params=(), sign=1):
+    """
+    Добавляет в сводки события, подходящие под условие where.
+
+    sign=-1 вычитает их (отмена команды). Условие не проверяет reverted само:
+    вызывающий решает, какие события учитывать.
+    """
+    sums = ', '.join(f'{sign} * SUM({_METRIC_SQL[metric]})' for metric in ROLLUP_METRICS)
+    columns = ', '.join(ROLLUP_METRICS)
+    increments = ', '.join(f'{metric} = {metric} + excluded.{metric}' for metric in ROLLUP_METRICS)
+    for table, bucket, bucket_sql in ROLLUP_TABLES:
+        for key_sql in ('task_type, task_id', f"'{TOTAL_TASK_TYPE}', 0"):
+            # WHERE в SELECT обязателен: иначе ON CONFLICT разбирается как часть JOIN
+            conn.execute(f'''
+                INSERT INTO {table} ({bucket}, task_type, task_id, {columns})
+                SELECT {bucket_sql}, {key_sql}, {sums} FROM task_events
+                WHERE ({where}) AND kind != 'baseline' AND day IS NOT NULL
+                GROUP BY 1, 2, 3
+                ON CONFLICT ({bucket}, task_type, task_id) DO UPDATE SET {increments}
+            ''', params)
+
+def rebuild_rollups(conn):
+    """Пересчитывает сводки из журнала с нуля."""
+    for table, _, _ in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    roll_up(conn, 0)
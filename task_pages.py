@@ -0,0 +1,149 @@
+# task_pages.py
+# Список задач в заданном порядке (или в порядке по умолчанию) с фильтрами,
+# который читается из БД страницами через get_tasks(limit=..., after=...).
+# Колонка UI рисует только видимое окно (ListView.window), поэтому
+# запрашиваются лишь его страницы, а не вся таблица: сортировку и фильтры
+# выполняет SQLite по индексам.
+# LiveSearch - результаты полнотекстового поиска для тех же колонок.
+from collections import OrderedDict
+
+import database
+from search import by_type
+from task_store import TASK_TYPES
+
+PAGE_SIZE = 50
+CACHED_PAGES = 8 # Страниц в памяти одновременно (LRU)
+
+
+class TaskPager:
+    """
+    Последовательность задач (len() и [i]) в порядке sort - для draw_task_list.
+
+    sort=None - порядок по умолчанию (database.DEFAULT_SORT). Страница p
+    читается по keyset-курсору (последней строке страницы p-1), если та уже
+    прочитана, иначе - через OFFSET (прыжок полосой прокрутки или клавишей
+    End). Строки отдаются через store.adopt: измененные в памяти задачи
+    видны сразу.
+
+    Очередь записи здесь не сбрасывается (это поток рисования): еще не
+    записанные изменения накладываются поверх страниц (store.pending) -
+    убранные задачи пропускаются в запросе, новые идут в конце списка.
+    Кэш страниц сбрасывается, когда меняется этот набор или писатель
+    выполнил изменения (store.settled) - тогда задачи встают на свои места.
+    """
+
+    def __init__(self, store, task_type, sort=None, filters=None, page_size=PAGE_SIZE):
+        self.store = store
+        self.task_type = task_type
+        self.sort = tuple(sort) if sort else None
+        self.filters = filters
+        self.page_size = page_size
+        self._version = None # (store.version, store.settled) на момент _sync
+        self._pending = (frozenset(), []) # Пропускаемые id и новые строки (см. store.pending)
+        self._count = None # Число задач в БД (без новых)
+        self._pages = OrderedDict() # Номер страницы -> строки
+        self._cursors = {} # Номер страницы -> ее последняя строка
+
+    def _sync(self):
+        version = (self.store.version(self.task_type), self.store.settled(self.task_type))
+        if version == self._version:
+            return
+        settled = self._version is None or version[1] != self._version[1]
+        self._version = version
+        hidden, added = self.store.pending(self.task_type)
+        added = [task for task in added if _matches(task, self.filters)]
+        if settled or hidden != self._pending[0]:
+            self._count = None
+            self._pages.clear()
+            self._cursors.clear()
+        self._pending = (hidden, added)
+
+    def _db_count(self):
+        self._sync()
+        if self._count is None:
+            self._count = database.count_tasks(self.task_type, filters=self.filters, exclude=self._pending[0])
+        return self._count
+
+    def __len__(self):
+        return self._db_count() + len(self._pending[1])
+
+    def __getitem__(self, index):
+        count = self._db_count()
+        if index < 0:
+            index += count + len(self._pending[1])
+        if index >= count: # Новые задачи, которых еще нет в БД
+            if index - count >= len(self._pending[1]):
+                raise IndexError(index)
+            return self._pending[1][index - count]
+        page, offset = divmod(index, self.page_size)
+        rows = self._page(page)
+        if not 0 <= offset < len(rows):
+            raise IndexError(index)
+        # Строка из store - та же, что видят команды и клики
+        return self.store.adopt(self.task_type, rows[offset])
+
+    def _page(self, page):
+        self._sync()
+        rows = self._pages.get(page)
+        if rows is not None:
+            self._pages.move_to_end(page)
+            return rows
+        after = self._cursors.get(page - 1)
+        offset = 0 if page == 0 or after is not None else page * self.page_size
+        rows = database.get_tasks(self.task_type, sort=self.sort, filters=self.filters,
+                                  limit=self.page_size, after=after, offset=offset, exclude=self._pending[0])
+        self._pages[page] = rows
+        if rows:
+            self._cursors[page] = rows[-1]
+        if len(self._pages) > CACHED_PAGES:
+            self._pages.popitem(last=False)
+        return rows
+
+
+def _matches(task, filters):
+    """Проходит ли строка filters (как database._task_where, но в памяти)."""
+    for column, value in (filters or {}).items():
+        if isinstance(value, (tuple, list)):
+            low, high = value
+            if task[column] is None or (low is not None and task[column] < low) or \
+                    (high is not None and task[column] > high):
+                return False
+        elif task[column] != value:
+            return False
+    return True
+
+
+class LiveSearch:
+    """
+    Строка поиска и найденные задачи по колонкам.
+
+    Запрос повторяется, когда меняется текст, store (другой профиль) или
+    писатель выполняет изменения задач (store.settled) - очередь записи
+    здесь не сбрасывается. Найденные задачи берутся из store, поэтому
+    правки и удаления видны сразу, а новые задачи - после записи в БД.
+    """
+
+    def __init__(self, limit=None):
+        self.text = ''
+        self.limit = limit
+        self._seen = None # (store, store.settled по типам) на момент последнего запроса
+        self._results = None
+
+    def set_text(self, text):
+        self.text = text
+        self._seen = None
+
+    @property
+    def active(self):
+        return bool(self.text.strip())
+
+    def tasks(self, store, task_type):
+        """Найденные задачи task_type по релевантности (или None, если поиск пуст)."""
+        if not self.active:
+            return None
+        seen = (store, tuple(store.settled(name) for name in TASK_TYPES))
+        if self._seen is None or self._seen[0] is not store or self._seen[1] != seen[1]:
+            self._results = by_type(database.search_tasks(self.text, limit=self.limit))
+            self._seen = seen
+        found = (store.get(task_type, task_id) for task_id in self._results[task_type])
+        return [task for task in found if task is not None]
@@ -0,0 +1,322 @@
+# task_store.py
+import datetime
+import logging
+from collections import OrderedDict
+import database
+import task_events
+
+log = logging.getLogger(__name__)
+
+TASK_TYPES = ('habits', 'dailies', 'todos')
+ROW_CACHE = 2000 # Сколько неизмененных строк каждого типа держать в памяти (LRU)
+
+
+class TaskStore:
+    """
+    Строки задач в памяти поверх SQLite и награды (их немного, они читаются целиком).
+
+    Задачи не копируются из таблиц целиком: списки читаются страницами
+    (task_pages.TaskPager), а store держит строки, которые видны на экране
+    или изменены, и отдает страницам свои объекты вместо прочитанных (adopt),
+    поэтому клик меняет ту же строку, что нарисована. Неизмененные строки
+    вытесняются (LRU) и при следующем обращении перечитываются из БД.
+
+    С writer (WriteQueue) мутации применяются к памяти сразу (оптимистично),
+    а запись в БД уходит в фоновый поток. Измененная строка помечается
+    номером записи писателя и не вытесняется, пока он ее не выполнит
+    (settle): до этого в БД ее изменения еще нет, и страницы накладывают
+    ее поверх прочитанного (pending). id новых задач выделяются заранее.
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self._rows = {task_type: OrderedDict() for task_type in TASK_TYPES} # id -> строка (None - убрана из списка)
+        self._dirty = {task_type: {} for task_type in TASK_TYPES} # id -> writer.submitted на момент изменения
+        self._added = {task_type: {} for task_type in TASK_TYPES} # id новых задач, еще не записанных в БД (по порядку)
+        self._stale = {task_type: set() for task_type in TASK_TYPES} # id строк, которые после записи перечитываются
+        self._versions = dict.fromkeys(TASK_TYPES, 0) # Счетчик изменений в памяти по типу
+        self._settled = dict.fromkeys(TASK_TYPES, 0) # Счетчик изменений в БД по типу (см. task_pages.py)
+        self._rewards = {}
+        self._rewards_list = None
+        self._next_ids = {}
+
+    def load(self):
+        """Сбрасывает строки в памяти и читает награды (при старте и для пересинхронизации)."""
+        if self.writer:
+            self.writer.flush() # Иначе перечитаем БД без еще не записанных изменений
+        self._next_ids = {task_type: database.next_task_id(task_type) for task_type in TASK_TYPES}
+        for task_type in TASK_TYPES:
+            self._rows[task_type].clear()
+            self._dirty[task_type].clear()
+            self._added[task_type].clear()
+            self._stale[task_type].clear()
+            self._changed(task_type)
+            self._settled[task_type] += 1
+        self._rewards = {reward['id']: reward for reward in database.get_rewards()}
+        self._rewards_list = None
+        return self
+
+    # --- Чтение ---
+    def version(self, task_type):
+        """Растет при каждом изменении задач task_type в памяти."""
+        return self._versions[task_type]
+
+    def settled(self, task_type):
+        """Растет, когда изменения задач task_type доходят до БД: по нему страницы перечитываются."""
+        return self._settled[task_type]
+
+    def get(self, task_type, task_id):
+        """
+        Задача по id (или None, если ее нет, она удалена или выполненная to-do).
+
+        Строки нет в памяти - значит, она не менялась после записи, и ее можно прочитать из БД.
+        """
+        rows = self._rows[task_type]
+        if task_id in rows:
+            rows.move_to_end(task_id)
+            return rows[task_id]
+        task = database.get_task(task_type, task_id)
+        if task is None or (task_type == 'todos' and task['completed']):
+            return None
+        return self._cache(task_type, task)
+
+    def pending(self, task_type):
+        """
+        Изменения задач task_type, которых, возможно, еще нет в БД:
+        (id, которые страницы должны пропустить в БД - убранные и новые; новые строки).
+        """
+        rows, added = self._rows[task_type], self._added[task_type]
+        hidden = frozenset(task_id for task_id in self._dirty[task_type]
+                           if rows.get(task_id) is None or task_id in added)
+        return hidden, [rows[task_id] for task_id in added if rows.get(task_id) is not None]
+
+    def adopt(self, task_type, task):
+        """Строка, прочитанная из БД (страница списка) -> строка store с тем же id."""
+        rows = self._rows[task_type]
+        if task['id'] in self._dirty[task_type] or rows.get(task['id']) is not None: # Объект остается прежним
+            rows.move_to_end(task['id'])
+            return rows[task['id']]
+        return self._cache(task_type, task)
+
+    def rewards(self):
+        if self._rewards_list is None:
+            self._rewards_list = list(self._rewards.values())
+        return self._rewards_list
+
+    def get_reward(self, reward_id):
+        return self._rewards.get(reward_id)
+
+    # --- Мутации ---
+    def add(self, task_type, data):
+        """Добавляет задачу и возвращает новую строку (или None)."""
+        if self.writer:
+            data = dict(data, id=self.allocate_id(task_type))
+            task = self.put(task_type, database.new_task_row(task_type, data)) # Память - до записи (см. _touch)
+            self.writer.submit(database.add_task, task_type, data, description=f"add {task_type}")
+            return task
+        new_id = database.add_task(task_type, data)
+        if not new_id:
+            return None
+        self._next_ids[task_type] = max(self._next_ids.get(task_type, 0), new_id + 1)
+        # Перечитываем одну строку, чтобы получить значения по умолчанию из схемы
+        task = database.get_task(task_type, new_id)
+        self.put(task_type, task)
+        return task
+
+    def update(self, task_type, task_id, updates):
+        """Обновляет задачу и возвращает измененную строку (или None при ошибке)."""
+        task = self.get(task_type, task_id)
+        if task is None:
+            return None
+        try:
+            updates = database.scheduled_updates(task_type, updates) # Новая frequency - новый next_due
+            if self.writer:
+                database.update_statement(task_type, tuple(updates)) # Отклоняем неизвестные колонки до записи в память
+        except ValueError as e:
+            log.warning("Error updating task: %s", e)
+            return None
+        if self.writer:
+            task = self.patch(task_type, task_id, updates)
+            self.writer.submit(database.update_task, task_type, task_id, updates,
+                               description=f"update {task_type} #{task_id}")
+            return task
+        if not database.update_task(task_type, task_id, updates):
+            return None
+        return self.patch(task_type, task_id, updates)
+
+    def record(self, task_type, task_id, kind, xp=0, gold=0, hp=0):
+        """
+        Записывает событие задачи в журнал и применяет его проекцию к строке в памяти.
+
+        xp/gold/hp - начисленная награда (штраф); они попадают в сводки статистики.
+        """
+        task = self._rewards.get(task_id) if task_type == 'rewards' else self.get(task_type, task_id)
+        if task is None:
+            return None
+        day = datetime.date.today().isoformat()
+        task = self.apply_event(task_type, task_id, kind, day)
+        self._write(database.record_task_event, task_type, task_id, kind, day, xp, gold, hp,
+                    description=f"{kind} {task_type} #{task_id}")
+        return task
+
+    def delete(self, task_type, task_id):
+        """Удаляет задачу и возвращает удаленную строку."""
+        task = self.drop(task_type, task_id) # Строку берем до записи: потом в БД ее уже не будет
+        self._write(database.delete_task, task_type, task_id, description=f"delete {task_type} #{task_id}")
+        return task
+
+    def update_reward(self, reward_id, updates):
+        reward = self.get_reward(reward_id)
+        if reward is None:
+            return None
+        self._write(database.update_reward, reward_id, updates, description=f"update reward #{reward_id}")
+        reward.update(updates)
+        return reward
+
+    # --- Изменения только в памяти (запись в БД делает вызывающий, см. commands.py) ---
+    def allocate_id(self, task_type):
+        """Выделяет id для новой задачи (как AUTOINCREMENT в БД)."""
+        new_id = self._next_ids[task_type]
+        self._next_ids[task_type] += 1
+        if self.writer:
+            self._added[task_type][new_id] = True # До settle строки в БД нет
+        return new_id
+
+    def put(self, task_type, task):
+        """Добавляет (или заменяет) строку задачи."""
+        self._rows[task_type][task['id']] = task
+        self._rows[task_type].move_to_end(task['id'])
+        self._touch(task_type, task['id'])
+        return task
+
+    def drop(self, task_type, task_id):
+        """Убирает задачу из списков и возвращает ее строку."""
+        task = self.get(task_type, task_id)
+        if task is None:
+            return None
+        self._remove(task_type, task_id)
+        self._touch(task_type, task_id)
+        return task
+
+    def patch(self, task_type, task_id, updates):
+        """Меняет поля задачи; выполненная to-do уходит из списка, как и в get_tasks('todos')."""
+        task = self.get(task_type, task_id)
+        if task is None:
+            return None
+        task.update(updates)
+        if task_type == 'todos' and task.get('completed'):
+            self._remove(task_type, task_id)
+        self._touch(task_type, task_id)
+        return task
+
+    def apply_event(self, task_type, task_id, kind, day):
+        """Применяет проекцию события к строке задачи или награды."""
+        task = self._rewards.get(task_id) if task_type == 'rewards' else self.get(task_type, task_id)
+        if task is None:
+            return None
+        task_events.apply_event(task, kind, day)
+        if task_type == 'rewards':
+            return task
+        if task_type == 'todos' and task.get('completed'):
+            self._remove(task_type, task_id)
+        self._touch(task_type, task_id)
+        return task
+
+    def expire(self, task_type, task_id):
+        """
+        Строка в памяти известна не полностью (часть проекций считает БД,
+        например last_completed после снятия отметки): после записи ее
+        изменений она перечитывается из БД.
+        """
+        if self.writer:
+            self._stale[task_type].add(task_id)
+        else:
+            self._rows[task_type].pop(task_id, None)
+
+    def refresh(self, table, ids):
+        """Перечитывает строки ids из БД (после отмены или повтора команды)."""
+        if self.writer:
+            self.writer.flush()
+        rows = database.get_rows(table, ids)
+        if table == 'rewards':
+            for row in rows:
+                self._rewards[row['id']] = row
+            self._rewards_list = None
+            return
+        for row in rows:
+            self._dirty[table].pop(row['id'], None) # После flush строка совпадает с БД
+            self._added[table].pop(row['id'], None)
+            self._stale[table].discard(row['id'])
+            if row['deleted_at'] is not None or (table == 'todos' and row['completed']):
+                self._rows[table].pop(row['id'], None)
+            else:
+                self._cache(table, row)
+        # Возвращенная строка встает на свое место: страницы перечитываются из БД
+        self._changed(table)
+        self._settled[table] += 1
+
+    def settle(self):
+        """
+        Отпускает строки, записи которых писатель уже выполнил: дальше их можно
+        вытеснять и перечитывать из БД. Возвращает типы задач, где такие были.
+        """
+        if self.writer is None:
+            return []
+        committed = self.writer.committed
+        settled = []
+        for task_type, dirty in self._dirty.items():
+            done = [task_id for task_id, submitted in dirty.items() if submitted < committed]
+            if not done:
+                continue
+            rows = self._rows[task_type]
+            for task_id in done:
+                del dirty[task_id]
+                self._added[task_type].pop(task_id, None)
+                if task_id in self._stale[task_type] or rows.get(task_id, False) is None:
+                    self._stale[task_type].discard(task_id)
+                    rows.pop(task_id, None)
+            self._settled[task_type] += 1
+            settled.append(task_type)
+        return settled
+
+    def _touch(self, task_type, task_id):
+        """
+        Отмечает изменение строки в памяти. С писателем строка грязная, пока не
+        выполнена запись, поставленная после этого изменения (поэтому память
+        меняется до submit); без него БД уже изменена.
+        """
+        if self.writer:
+            self._dirty[task_type][task_id] = self.writer.submitted
+        else:
+            self._settled[task_type] += 1
+        self._changed(task_type)
+
+    def _remove(self, task_type, task_id):
+        """Убирает строку из списков; пока запись в очереди, None скрывает ее и в БД."""
+        if self.writer:
+            self._rows[task_type][task_id] = None
+        else:
+            self._rows[task_type].pop(task_id, None)
+
+    def _cache(self, task_type, task):
+        """Кладет неизмененную строку в память, вытесняя самую давнюю неизмененную."""
+        rows = self._rows[task_type]
+        rows[task['id']] = task
+        rows.move_to_end(task['id'])
+        if len(rows) > ROW_CACHE:
+            dirty = self._dirty[task_type]
+            oldest = next((task_id for task_id in rows if task_id not in dirty), None)
+            if oldest is not None:
+                del rows[oldest]
+        return task
+
+    def _changed(self, task_type):
+        """Отмечает изменение задач task_type в памяти."""
+        self._versions[task_type] += 1
+
+    def _write(self, fn, *args, description):
+        """Записывает в БД сразу или через очередь писателя."""
+        if self.writer:
+            self.writer.submit(fn, *args, description=description)
+        else:
+            fn(*args)
@@ -1,18 +1,36 @@
 import unittest
 import os
+from unittest import mock
+import json
+import random
+import shutil
 import sqlite3
-from datetime import datetime, date
+import subprocess
+import sys
+import threading
+from datetime import datetime, date, timedelta
 import pygame
 
 # Add this constant at the top of the file
 TEST_DB = "test_rpg_life.db"
 
-# Add this function to override the database connection for tests
+# Add this function to open a separate connection to the test database
 def get_test_db_connection():
     """Get database connection for tests."""
     return sqlite3.connect(TEST_DB)
 
-# Modify the database.py imports and override the connection
+def column(store, task_type):
+    """Tasks of one column in the default order, as the UI pages them."""
+    return list(TaskPager(store, task_type))
+
+def remove_test_db():
+    """Close shared connections and remove the test database with its WAL files."""
+    database.close_db()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(TEST_DB + suffix):
+            os.remove(TEST_DB + suffix)
+
+# Point database.py at the test database
 from database import (
     init_db, 
     get_tasks, 
@@ -21,14 +39,34 @@ from database import (
     delete_task,
     get_character_data
 )
+import bench
+import commands
 import database
-database.get_db_connection = get_test_db_connection  # Override the connection function
+import importer
+import migrations
+import progression
+import recurrence
+import search
+import stats
+from task_store import TaskStore
+from task_pages import TaskPager, LiveSearch
+from profiles import ProfileManager
+from write_queue import WriteQueue
+from text_cache import TextCache
+from text_layout import wrap_lines
+from panels import Panel, PanelLayer
+from profiler import FrameProfiler
+from scheduler import FrameScheduler
+from list_view import ListView
+from hit_index import HitGrid
+from game_core import gain_xp_gold, lose_health
+from sprite_cache import SpriteCache
+database.DB_NAME = TEST_DB  # Shared connections are opened per DB_NAME
 
 class TestDatabaseOperations(unittest.TestCase):
     def setUp(self):
         """Set up test database before each test."""
-        if os.path.exists(TEST_DB):
-            os.remove(TEST_DB)
+        remove_test_db()
         
         # Initialize test database
         self.conn = get_test_db_connection()
@@ -37,8 +75,7 @@ class TestDatabaseOperations(unittest.TestCase):
     def tearDown(self):
         """Clean up after each test."""
         self.conn.close()
-        if os.path.exists(TEST_DB):
-            os.remove(TEST_DB)
+        remove_test_db()
 
     def test_character_initialization(self):
         """Test character creation and default values."""
@@ -136,12 +173,861 @@ class TestDatabaseOperations(unittest.TestCase):
         incomplete_todo = next((t for t in incomplete_todos if t['id'] == todo_id), None)
         self.assertIsNone(incomplete_todo)  # Should not be in incomplete list
 
+class TestRowsAndStatements(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_rows_behave_like_dicts(self):
+        todo_id = add_task('todos', {'name': 'Once', 'notes': 'n'})
+        todo = database.get_task('todos', todo_id)
+        self.assertFalse(hasattr(todo, '__dict__'))
+        self.assertEqual(todo, dict(todo))
+        self.assertEqual((todo['name'], todo.get('notes'), todo.get('missing', 1)), ('Once', 'n', 1))
+        self.assertIn('completed', todo)
+        todo.update({'completed': 1}, difficulty=3)
+        self.assertEqual((todo['completed'], todo['difficulty']), (1, 3))
+        with self.assertRaises(KeyError):
+            todo['no_such_column'] = 1
+        copy = todo.copy()
+        copy['current_edit'] = 'x'  # Copies are plain dicts for UI state
+        self.assertIs(type(get_tasks('todos')[0]), type(todo))
+
+    def test_rows_use_less_memory_than_dicts(self):
+        with database.transaction() as conn:
+            conn.executemany('INSERT INTO todos (name) VALUES (?)', [(f'Todo {i}',) for i in range(1000)])
+        rows = get_tasks('todos')
+        as_dicts = [dict(row) for row in rows]
+        self.assertLess(sys.getsizeof(rows[0]) * 2, sys.getsizeof(as_dicts[0]))
+
+    def test_update_statement_whitelists_and_caches(self):
+        sql = database.update_statement('dailies', ('streak', 'last_completed'))
+        self.assertIs(database.update_statement('dailies', ('streak', 'last_completed')), sql)
+        self.assertEqual(sql, 'UPDATE dailies SET streak = ?, last_completed = ? WHERE id = ?')
+        habit_id = add_task('habits', {'name': 'Read'})
+        self.assertFalse(update_task('habits', habit_id, {'name = name; DROP TABLE habits; --': 1}))
+        self.assertFalse(update_task('habits; DROP TABLE habits', habit_id, {'name': 'x'}))
+        with self.assertRaises(ValueError):
+            database.update_reward(1, {'id': 5})
+        self.assertEqual(get_tasks('habits')[0]['name'], 'Read')
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_connection_is_reused_and_tuned(self):
+        """The same connection serves every call and has the PRAGMAs applied."""
+        conn = database.get_db_connection()
+        add_task('habits', {'name': 'Reuse'})
+        get_tasks('habits')
+        self.assertIs(database.get_db_connection(), conn)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conn.execute('PRAGMA temp_store').fetchone()[0], 2)  # MEMORY
+
+    def test_transaction_rolls_back_on_error(self):
+        """A failing transaction leaves no partial writes behind."""
+        with self.assertRaises(RuntimeError):
+            with database.transaction() as conn:
+                conn.execute("INSERT INTO habits (name) VALUES ('Ghost')")
+                with database.transaction() as inner:  # Nested blocks join the outer one
+                    inner.execute("INSERT INTO habits (name) VALUES ('Ghost 2')")
+                raise RuntimeError("boom")
+        self.assertEqual(get_tasks('habits'), [])
+
+    def test_connection_per_thread(self):
+        """Each thread gets its own connection."""
+        import threading
+        main_conn = database.get_db_connection()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(database.get_db_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], main_conn)
+
+    def test_sql_functions_come_from_on_connect(self):
+        """ConnectionManager registers no functions itself; database passes recurrence_next in."""
+        from db_connection import ConnectionManager
+        bare = ConnectionManager(TEST_DB)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                bare.connection().execute(f"SELECT {recurrence.SQL_FUNCTION}('daily', '2024-01-01')")
+        finally:
+            bare.close()
+        self.assertEqual(database.get_db_connection().execute(
+            f"SELECT {recurrence.SQL_FUNCTION}('daily', '2024-01-01')").fetchone()[0], '2024-01-02')
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_fresh_database_is_current(self):
+        init_db()
+        conn = database.get_db_connection()
+        self.assertEqual(migrations.get_schema_version(conn), migrations.SCHEMA_VERSION)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('idx_todos_completed_created', indexes)
+        self.assertIn('idx_dailies_last_completed', indexes)
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM todos WHERE completed = 0 ORDER BY creation_date").fetchall()
+        self.assertTrue(any('idx_todos_completed_created' in row[3] for row in plan))
+
+    def test_current_schema_skips_ddl(self):
+        """A second start runs no DDL and seeds nothing."""
+        init_db()
+        statements = []
+        database.get_db_connection().set_trace_callback(statements.append)
+        init_db()
+        database.get_db_connection().set_trace_callback(None)
+        self.assertFalse(any('CREATE' in sql or 'INSERT' in sql for sql in statements))
+        self.assertEqual(len(database.get_rewards()), len(migrations.DEFAULT_REWARDS))
+
+    def test_unversioned_database_is_upgraded(self):
+        """A database made by the old init_db (user_version 0) upgrades without duplicate rewards."""
+        with database.transaction() as conn:
+            migrations.MIGRATIONS[0](conn.cursor())
+        self.assertEqual(migrations.get_schema_version(database.get_db_connection()), 0)
+        init_db()
+        self.assertEqual(migrations.get_schema_version(database.get_db_connection()), migrations.SCHEMA_VERSION)
+        self.assertEqual(len(database.get_rewards()), len(migrations.DEFAULT_REWARDS))
+
+class TestTaskStore(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+        self.store = TaskStore().load()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_mutations_write_through(self):
+        """Memory and SQLite stay in sync after add, update and delete."""
+        habit = self.store.add('habits', {'name': 'Read'})
+        self.assertEqual(habit['counter'], 0)  # Schema defaults are filled in
+        self.assertIs(self.store.get('habits', habit['id']), habit)
+
+        updated = self.store.update('habits', habit['id'], {'name': 'Read more'})
+        self.assertEqual(updated['name'], 'Read more')
+        self.assertEqual(get_tasks('habits'), column(self.store, 'habits'))
+
+        self.store.delete('habits', habit['id'])
+        self.assertEqual(column(self.store, 'habits'), [])
+        self.assertEqual(get_tasks('habits'), [])
+
+    def test_completed_todo_leaves_list(self):
+        first = self.store.add('todos', {'name': 'First'})
+        second = self.store.add('todos', {'name': 'Second'})
+        self.store.update('todos', first['id'], {'completed': True})
+        self.assertIsNone(self.store.get('todos', first['id']))
+        self.assertEqual([t['id'] for t in column(self.store, 'todos')], [second['id']])
+        self.assertEqual([t['id'] for t in get_tasks('todos')], [second['id']])
+
+    def test_failed_update_leaves_memory_untouched(self):
+        daily = self.store.add('dailies', {'name': 'Run'})
+        self.assertIsNone(self.store.update('dailies', daily['id'], {'no_such_column': 1}))
+        self.assertNotIn('no_such_column', self.store.get('dailies', daily['id']))
+
+    def test_rewards_loaded(self):
+        reward = self.store.rewards()[0]
+        self.store.update_reward(reward['id'], {'owned': 1})
+        self.assertEqual(self.store.get_reward(reward['id'])['owned'], 1)
+        self.assertEqual(database.get_rewards(owned_only=True)[0]['id'], reward['id'])
+
+class TestTaskEvents(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_completion_is_logged_and_projected(self):
+        daily_id = add_task('dailies', {'name': 'Run'})
+        database.record_task_event('dailies', daily_id, 'complete', '2024-01-01')
+        database.record_task_event('dailies', daily_id, 'complete', '2024-01-02')
+        daily = database.get_task('dailies', daily_id)
+        self.assertEqual((daily['streak'], daily['last_completed']), (2, '2024-01-02'))
+        events = database.get_task_events('dailies', daily_id)
+        self.assertEqual([(e['kind'], e['day']) for e in events], [('complete', '2024-01-01'), ('complete', '2024-01-02')])
+
+    def test_daily_reset_logs_misses(self):
+        daily_id = add_task('dailies', {'name': 'Run', 'penalty_hp': 7})
+        database.record_task_event('dailies', daily_id, 'complete', '2000-01-01')
+        database.daily_reset()
+        miss = database.get_task_events('dailies', daily_id)[-1]
+        self.assertEqual((miss['kind'], miss['hp']), ('miss', 7))
+        self.assertEqual(database.get_task('dailies', daily_id)['streak'], 0)
+
+    def test_replay_matches_incremental_projections(self):
+        rng = random.Random(7)
+        dailies = [add_task('dailies', {'name': f'Daily {i}'}) for i in range(20)]
+        habits = [add_task('habits', {'name': f'Habit {i}'}) for i in range(20)]
+        for day in range(60):
+            iso = (date(2024, 1, 1) + timedelta(days=day)).isoformat()
+            for daily_id in dailies:
+                database.record_task_event('dailies', daily_id, rng.choice(['complete', 'complete', 'miss']), iso)
+            for habit_id in rng.sample(habits, 5):
+                database.record_task_event('habits', habit_id, 'trigger', iso)
+        incremental = get_tasks('dailies'), get_tasks('habits')
+        with database.transaction() as conn:
+            conn.execute('UPDATE dailies SET streak = 99, last_completed = NULL')
+            conn.execute('UPDATE habits SET counter = -1')
+        database.replay_task_events()
+        self.assertEqual((get_tasks('dailies'), get_tasks('habits')), incremental)
+
+    def test_migration_keeps_existing_streaks(self):
+        remove_test_db()
+        with database.transaction() as conn:  # Database from before the event log
+            for migration in migrations.MIGRATIONS[:2]:
+                migration(conn.cursor())
+            conn.execute("INSERT INTO dailies (name, streak, last_completed) VALUES ('Old', 12, '2024-03-01')")
+            conn.execute("INSERT INTO dailies (name, frequency) VALUES ('Weekly', 'weekly:Mon')")
+            conn.execute('PRAGMA user_version = 2')
+        init_db()
+        database.replay_task_events()
+        daily, weekly = get_tasks('dailies')
+        self.assertEqual((daily['streak'], daily['last_completed']), (12, '2024-03-01'))
+        self.assertEqual(daily['next_due'], '2024-03-02')  # Migration 009: the day after the last completion
+        self.assertEqual(weekly['next_due'], recurrence.first_due('weekly:Mon', date.today()).isoformat())
+        self.assertEqual(database.search_tasks('old'), [('dailies', daily['id'])])  # Migration 007 backfill
+
+    def test_migration_backfills_rollups_like_rebuild(self):
+        """Rollups filled by migration 004 equal the ones rebuilt from the event log today."""
+        remove_test_db()
+        with database.transaction() as conn:  # Database with events but no rollups
+            for migration in migrations.MIGRATIONS[:3]:
+                migration(conn.cursor())
+            conn.executemany('INSERT INTO task_events (task_type, task_id, kind, day, xp, gold, hp) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                                 ('dailies', 1, 'complete', '2024-03-01', 10, 5, 0),
+                                 ('dailies', 1, 'miss', '2024-03-04', 0, 0, 10),
+                                 ('habits', 2, 'trigger', '2024-03-04', 5, 1, 0),
+                                 ('rewards', 1, 'purchase', '2024-03-05', 0, 50, 0),
+                             ])
+            conn.execute('PRAGMA user_version = 3')
+        init_db()
+        conn = database.get_db_connection()
+        migrated = {table: conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3').fetchall()
+                    for table in ('stats_daily', 'stats_weekly')}
+        database.replay_task_events()
+        for table, rows in migrated.items():
+            self.assertEqual([tuple(row) for row in rows],
+                             [tuple(row) for row in conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3')])
+        self.assertEqual(len(migrated['stats_weekly']), 6)  # 1 + 3 task rows and a total for each of two weeks
+
+    def test_task_store_record(self):
+        store = TaskStore().load()
+        daily = store.add('dailies', {'name': 'Run'})
+        todo = store.add('todos', {'name': 'Once'})
+        store.record('dailies', daily['id'], 'complete')
+        store.record('todos', todo['id'], 'complete')
+        self.assertEqual(store.get('dailies', daily['id'])['streak'], 1)
+        self.assertEqual(column(store, 'todos'), [])
+        self.assertEqual(store.get('dailies', daily['id']), database.get_task('dailies', daily['id']))
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+        self.rng = random.Random(3)
+        self.daily_id = add_task('dailies', {'name': 'Run'})
+        self.todo_ids = [add_task('todos', {'name': f'Todo {i}'}) for i in range(40)]
+        self.start = date(2024, 1, 1)
+        for day in range(90):
+            iso = (self.start + timedelta(days=day)).isoformat()
+            if day % 3:
+                database.record_task_event('dailies', self.daily_id, 'complete', iso, xp=10, gold=5)
+            else:
+                database.record_task_event('dailies', self.daily_id, 'miss', iso, hp=10)
+            for todo_id in self.rng.sample(self.todo_ids, 2):
+                database.record_task_event('todos', todo_id, 'complete', iso, xp=self.rng.randint(1, 30), gold=7)
+
+    def tearDown(self):
+        remove_test_db()
+
+    def raw_sum(self, column, first, last, kind=None):
+        """Reference answer straight from the event log."""
+        query = f'SELECT COALESCE(SUM({column}), 0) FROM task_events WHERE day BETWEEN ? AND ?'
+        params = [first.isoformat(), last.isoformat()]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        return database.get_db_connection().execute(query, params).fetchone()[0]
+
+    def test_totals_match_event_log(self):
+        for _ in range(50):
+            first = self.start + timedelta(days=self.rng.randint(-5, 95))
+            last = first + timedelta(days=self.rng.randint(0, 40))
+            self.assertEqual(stats.gold_earned(first, last), self.raw_sum('gold', first, last))
+            self.assertEqual(stats.total('hp_lost', first, last), self.raw_sum('hp', first, last))
+
+    def test_xp_per_week(self):
+        weeks = stats.xp_per_week('2024-01-03', '2024-01-20')
+        self.assertEqual([week for week, _ in weeks], [date(2024, 1, 1), date(2024, 1, 8), date(2024, 1, 15)])
+        self.assertEqual(weeks[1][1], self.raw_sum('xp', date(2024, 1, 8), date(2024, 1, 14)))
+        self.assertEqual(stats.series('xp', '2023-12-30', '2023-12-31'), [(date(2023, 12, 30), 0), (date(2023, 12, 31), 0)])
+
+    def test_completion_rate(self):
+        end = self.start + timedelta(days=89)
+        self.assertAlmostEqual(stats.completion_rate('dailies', self.daily_id, self.start, end), 60 / 90)
+        self.assertEqual(stats.total('misses', self.start, end, 'dailies', self.daily_id), 30)
+
+    def test_daily_reset_misses_are_counted(self):
+        yesterday = date.today() - timedelta(days=1)
+        missed_id = add_task('dailies', {'name': 'Skipped', 'penalty_hp': 4, 'next_due': yesterday.isoformat()})
+        database.daily_reset()
+        self.assertEqual(stats.total('misses', yesterday, yesterday, 'dailies', missed_id), 1)
+        self.assertEqual(stats.total('hp_lost', yesterday, yesterday, 'dailies', missed_id), 4)
+
+    def test_rebuild_matches_incremental(self):
+        conn = database.get_db_connection()
+        before = [conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3').fetchall() for table in ('stats_daily', 'stats_weekly')]
+        database.replay_task_events()
+        after = [conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3').fetchall() for table in ('stats_daily', 'stats_weekly')]
+        self.assertEqual([list(map(tuple, rows)) for rows in before], [list(map(tuple, rows)) for rows in after])
+
+class TestImporter(unittest.TestCase):
+    IMPORT_FILES = ('test_import.csv', 'test_import.json')
+
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+        for path in self.IMPORT_FILES:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_csv_import_in_chunks(self):
+        with open('test_import.csv', 'w', newline='') as f:
+            f.write('Task Name,Type,Notes,Priority,Date\n')
+            for i in range(25):
+                f.write(f'Todo {i},todo,note {i},1.5,2024-05-01T10:00:00Z\n')
+            f.write(',todo,,,\n')            # No name
+            f.write('Bad date,todo,,,someday\n')
+            f.write('Gym,daily,,,\n')
+        progress = []
+        result = importer.import_file('test_import.csv', chunk_size=10,
+                                      on_progress=lambda done, bad: progress.append(done))
+        self.assertEqual(result.imported, {'habits': 0, 'dailies': 1, 'todos': 25})
+        self.assertEqual(result.rejected, 2)
+        self.assertEqual([error.row_number for error in result.errors], [26, 27])
+        self.assertEqual(progress, [10, 20, 26])
+        todo = get_tasks('todos')[0]
+        self.assertEqual((todo['name'], todo['notes'], todo['due_date'], todo['difficulty']),
+                         ('Todo 0', 'note 0', '2024-05-01', 3))
+
+    def test_json_array_is_streamed(self):
+        rows = [{'type': 'habit', 'text': f'Habit {i}', 'counterUp': i} for i in range(50)]
+        with open('test_import.json', 'w') as f:
+            json.dump(rows, f)
+        with open('test_import.json') as f:
+            self.assertEqual(list(importer._read_json(f, block_size=16)), rows)  # Items split across reads
+        result = importer.import_file('test_import.json')
+        self.assertEqual(result.imported['habits'], 50)
+        database.replay_task_events()  # Imported counters are in the event log
+        self.assertEqual([h['counter'] for h in get_tasks('habits')], list(range(50)))
+
+    def test_habitica_export(self):
+        export = {'tasks': {
+            'dailys': [{'text': 'Stretch', 'frequency': 'weekly', 'repeat': {'m': True, 'w': True, 'f': False},
+                        'streak': 4, 'priority': 2}],
+            'todos': [{'text': 'Taxes', 'notes': 'by April', 'completed': False, 'date': '2024-04-15T00:00:00.000Z'}],
+            'rewards': [{'text': 'Cake'}],
+        }}
+        with open('test_import.json', 'w') as f:
+            json.dump(export, f)
+        result = importer.import_file('test_import.json')
+        self.assertEqual(result.rejected, 1)  # Rewards are not tasks
+        daily = get_tasks('dailies')[0]
+        self.assertEqual((daily['frequency'], daily['streak']), ('weekly:Mon,Wed', 4))
+        self.assertIn(date.fromisoformat(daily['next_due']).strftime('%a'), ('Mon', 'Wed'))
+        self.assertEqual(get_tasks('todos')[0]['due_date'], '2024-04-15')
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_triggers_keep_index_in_sync(self):
+        habit_id = add_task('habits', {'name': 'Morning run'})
+        todo_id = add_task('todos', {'name': 'Taxes', 'notes': 'call the accountant'})
+        self.assertEqual(database.search_tasks('run'), [('habits', habit_id)])
+        self.assertEqual(database.search_tasks('accou'), [('todos', todo_id)])  # Prefix match in notes
+        update_task('habits', habit_id, {'name': 'Evening walk'})
+        self.assertEqual(database.search_tasks('run'), [])
+        self.assertEqual(database.search_tasks('walk'), [('habits', habit_id)])
+        delete_task('todos', todo_id)
+        self.assertEqual(database.search_tasks('taxes'), [])
+        with database.transaction() as conn:  # Undoing a delete restores the row
+            conn.execute('UPDATE todos SET deleted_at = NULL WHERE id = ?', (todo_id,))
+        self.assertEqual(database.search_tasks('taxes'), [('todos', todo_id)])
+
+    def test_ranking_and_filters(self):
+        in_notes = add_task('todos', {'name': 'Shopping', 'notes': 'buy milk'})
+        in_name = add_task('todos', {'name': 'Milk the cow'})
+        daily_id = add_task('dailies', {'name': 'Drink milk'})
+        self.assertEqual(database.search_tasks('milk', task_type='todos'), [('todos', in_name), ('todos', in_notes)])
+        self.assertEqual(search.by_type(database.search_tasks('milk'))['dailies'], [daily_id])
+        self.assertEqual(len(database.search_tasks('milk', limit=2)), 2)
+        self.assertEqual(database.search_tasks('drink milk'), [('dailies', daily_id)])  # Every word must match
+        self.assertEqual(database.search_tasks('"milk OR NEAR('), [])  # Operators in the input are not FTS syntax
+        self.assertEqual(database.search_tasks('  '), [])
+
+    def test_bulk_import_is_indexed(self):
+        path = TEST_DB + '.csv'
+        with open(path, 'w') as f:
+            f.write('type,name,notes\n' + ''.join(f'todo,Imported {i},bulk\n' for i in range(300)))
+        try:
+            importer.import_file(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(len(database.search_tasks('imported')), 300)
+        self.assertIsNone(database.get_db_connection().execute(
+            'SELECT 1 FROM app_state WHERE key = ?', (search.BULK_LOAD_KEY,)).fetchone())
+        add_task('todos', {'name': 'Imported later'})  # The insert trigger is active again
+        self.assertEqual(len(database.search_tasks('imported')), 301)
+
+class TestTaskQueries(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+        with database.transaction() as conn:
+            conn.executemany('INSERT INTO todos (name, due_date, difficulty, value_xp) VALUES (?, ?, ?, ?)',
+                             [(f'Todo {i}', None if i % 3 == 0 else f'2024-05-{i % 28 + 1:02d}', i % 4, i % 7 * 10)
+                              for i in range(120)])
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_sort_filter_and_keyset_pages(self):
+        by_due = get_tasks('todos', sort=('due_date',))
+        self.assertEqual(len(by_due), 120)
+        dated = [t['due_date'] for t in by_due if t['due_date']]
+        self.assertEqual(dated, sorted(dated))
+        self.assertIsNone(by_due[-1]['due_date'])  # Undated to-dos go last
+        for sort in (('due_date',), ('-difficulty',), ('-value_xp', 'due_date'), ('name', '-id')):
+            pages, after = [], None
+            while True:
+                page = get_tasks('todos', sort=sort, limit=17, after=after)
+                if not page:
+                    break
+                pages += page
+                after = page[-1]
+            self.assertEqual([t['id'] for t in pages], [t['id'] for t in get_tasks('todos', sort=sort)], sort)
+        filters = {'due_date': ('2024-05-10', '2024-05-20'), 'difficulty': (2, None), 'value_xp': 30}
+        found = get_tasks('todos', filters=filters)
+        self.assertTrue(found)
+        self.assertTrue(all('2024-05-10' <= t['due_date'] <= '2024-05-20' and t['difficulty'] >= 2
+                            and t['value_xp'] == 30 for t in found))
+        self.assertEqual(database.count_tasks('todos', filters=filters), len(found))
+        self.assertEqual(get_tasks('todos'), get_tasks('todos', sort=('creation_date',)))
+        with self.assertRaises(ValueError):
+            get_tasks('todos', sort=('notes; DROP TABLE todos',))
+        with self.assertRaises(ValueError):
+            get_tasks('todos', filters={'streak': 1})
+
+    def test_ui_sorts_use_indexes(self):
+        conn = database.get_db_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            for task_type, sort in (('todos', ('due_date',)), ('todos', ('-difficulty',)), ('todos', ('-value_xp',)),
+                                    ('dailies', ('-streak',)), ('habits', ('-counter',)), ('todos', None)):
+                first = get_tasks(task_type, sort=sort, limit=1)
+                get_tasks(task_type, sort=sort, limit=20, after=first[0] if first else
+                          {'id': 0, 'streak': 0, 'counter': 0})
+        finally:
+            conn.set_trace_callback(None)
+        pages = [sql for sql in statements if sql.startswith('SELECT * FROM') and 'LIMIT 20' in sql]
+        self.assertEqual(len(pages), 6)
+        for sql in pages:
+            plan = ' '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+            self.assertIn('USING INDEX', plan, sql)
+            self.assertNotIn('TEMP B-TREE', plan, sql)
+
+    def test_pager_reads_visible_pages_and_follows_store(self):
+        store = TaskStore().load()
+        pager = TaskPager(store, 'todos', ('-difficulty',), page_size=10)
+        self.assertEqual(len(pager), 120)
+        self.assertEqual([pager[i]['id'] for i in range(120)], [t['id'] for t in get_tasks('todos', sort=('-difficulty',))])
+        self.assertIs(pager[0], store.get('todos', pager[0]['id']))  # Rows are shared with the store
+        pager = TaskPager(store, 'todos', ('-difficulty',), page_size=10)
+        pager[95]  # A jump reads one page by offset, not the pages before it
+        self.assertEqual(list(pager._pages), [9])
+        new_task = store.add('todos', {'name': 'Hard one', 'difficulty': 9})
+        self.assertEqual(len(pager), 121)
+        self.assertEqual(pager[0]['id'], new_task['id'])
+
+    def test_store_keeps_only_visible_rows(self):
+        """Loading a store reads no task rows; the default order is paged like any other."""
+        conn = database.get_db_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            store = TaskStore().load()
+            pager = TaskPager(store, 'todos', page_size=10)
+            window = [pager[i] for i in range(10)]
+        finally:
+            conn.set_trace_callback(None)
+        reads = [sql for sql in statements if sql.startswith('SELECT * FROM todos')]
+        self.assertEqual(len(reads), 1)
+        self.assertIn('LIMIT 10', reads[0])
+        self.assertEqual(window, get_tasks('todos')[:10])
+        with mock.patch('task_store.ROW_CACHE', 15):
+            self.assertEqual(len([pager[i] for i in range(120)]), 120)
+            self.assertLessEqual(len(store._rows['todos']), 15)  # Rows scrolled past are evicted
+        self.assertEqual(store.get('todos', window[0]['id']), window[0])  # and read back on demand
+
+    def test_pager_overlays_queued_writes_without_flush(self):
+        """Pages never wait for the writer: queued adds and deletes are laid over them until committed."""
+        writer = WriteQueue().start()
+        blocker = threading.Event()
+        try:
+            store = TaskStore(writer).load()
+            pager = TaskPager(store, 'todos', ('-difficulty',), page_size=10)
+            first = pager[0]
+            writer.submit(blocker.wait)  # Hold the writer so nothing below reaches the database
+            with mock.patch.object(writer, 'flush', side_effect=AssertionError('flush on the render path')):
+                added = store.add('todos', {'name': 'Hard one', 'difficulty': 9})
+                store.delete('todos', first['id'])
+                self.assertEqual(len(pager), 120)
+                ids = [pager[i]['id'] for i in range(120)]
+                self.assertNotIn(first['id'], ids)
+                self.assertIs(pager[119], added)  # New rows go last until the write lands
+            blocker.set()
+            writer.flush()
+            self.assertEqual(store.settle(), ['todos'])
+            self.assertIs(pager[0], added)  # then take their sorted place
+            self.assertEqual(len(pager), 120)
+        finally:
+            blocker.set()
+            writer.close()
+
+    def test_live_search_sees_tasks_added_while_active(self):
+        writer = WriteQueue().start()
+        try:
+            store = TaskStore(writer).load()
+            history = commands.CommandHistory(store, get_character_data(), writer)
+            live = LiveSearch(limit=100)
+            self.assertIsNone(live.tasks(store, 'todos'))
+            live.set_text('milk')
+            self.assertEqual(live.tasks(store, 'todos'), [])
+            with mock.patch.object(writer, 'flush', side_effect=AssertionError('flush on the render path')):
+                added = history.execute(commands.AddTask('todos', {'name': 'Buy milk'})).task
+                self.assertEqual(live.tasks(store, 'todos'), [])  # Not in the index until the write lands
+            writer.flush()
+            store.settle()  # What the commit event does in the game loop
+            self.assertEqual(live.tasks(store, 'todos'), [added])
+            history.undo()
+            self.assertEqual(live.tasks(store, 'todos'), [])
+            history.redo()
+            self.assertEqual([t['name'] for t in live.tasks(store, 'todos')], ['Buy milk'])
+        finally:
+            writer.close()
+
+class TestBench(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        self.saved_data_dir = bench.DATA_DIR
+        bench.DATA_DIR = 'test_bench_data'
+
+    def tearDown(self):
+        shutil.rmtree(bench.DATA_DIR, ignore_errors=True)
+        bench.DATA_DIR = self.saved_data_dir
+        remove_test_db()
+
+    def test_run_small_benchmark(self):
+        report = bench.run_benchmarks(sizes=[100], repeat=2, log=lambda message: None)
+        self.assertEqual(database.DB_NAME, TEST_DB)  # Restored after the run
+        ops = {result['op'] for result in report['results']}
+        self.assertIn('daily_reset', ops)
+        self.assertIn('get_tasks[todos]', ops)
+        self.assertTrue(all(result['median_ms'] >= 0 for result in report['results']))
+        json.dumps(report)  # Machine-readable
+        # The seeded database is deterministic and reused
+        conn = sqlite3.connect(bench.seeded_db_path(100, bench.DEFAULT_SEED))
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM todos').fetchone()[0], 100)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM rewards').fetchone()[0], 100)
+        conn.close()
+
+    def test_compare_flags_regressions(self):
+        baseline = {'results': [{'size': 100, 'op': 'get_rewards', 'median_ms': 1.0},
+                                {'size': 100, 'op': 'init_db', 'median_ms': 0.01}]}
+        report = {'results': [{'size': 100, 'op': 'get_rewards', 'median_ms': 2.0},
+                              {'size': 100, 'op': 'init_db', 'median_ms': 0.03},  # Below the noise floor
+                              {'size': 100, 'op': 'new_op', 'median_ms': 5.0}]}
+        self.assertEqual(bench.compare(report, baseline), [(100, 'get_rewards', 1.0, 2.0)])
+        self.assertEqual(bench.compare(baseline, baseline), [])
+
+class TestProfiles(unittest.TestCase):
+    PROFILES_DIR = 'test_profiles'
+
+    def setUp(self):
+        remove_test_db()
+        self.manager = ProfileManager(self.PROFILES_DIR, warm=2)
+
+    def tearDown(self):
+        self.manager.close()
+        database.close_db()
+        database.DB_NAME = TEST_DB
+        shutil.rmtree(self.PROFILES_DIR, ignore_errors=True)
+
+    def test_profiles_have_separate_databases(self):
+        alice = self.manager.switch('alice')
+        alice.store.add('habits', {'name': 'Alice habit'})
+        bob = self.manager.switch('bob')
+        self.assertEqual(column(bob.store, 'habits'), [])
+        self.assertEqual(database.DB_NAME, os.path.join(self.PROFILES_DIR, 'bob.db'))
+        self.assertEqual(self.manager.names(), ['default', 'alice', 'bob'])
+        self.assertEqual(database.get_last_run_date(), date.today().isoformat())  # Stored per profile
+        self.manager.switch('alice')
+        self.assertEqual([h['name'] for h in get_tasks('habits')], ['Alice habit'])
+
+    def test_warm_switch_does_not_reload(self):
+        alice = self.manager.switch('alice')
+        self.manager.switch('bob')
+        statements = []
+        database.get_db_connection()  # bob's connection
+        database._managers[alice.db_name].connection().set_trace_callback(statements.append)
+        self.assertIs(self.manager.switch('alice'), alice)
+        self.assertEqual([sql for sql in statements if 'FROM habits' in sql], [])  # No task re-read
+        self.assertTrue(any('app_state' in sql for sql in statements))  # Only the last-run check
+
+    def test_cold_profiles_are_closed(self):
+        for name in ('alice', 'bob', 'carol'):
+            self.manager.switch(name)
+        self.assertFalse(self.manager.is_warm('alice'))
+        self.assertNotIn(os.path.join(self.PROFILES_DIR, 'alice.db'), database._managers)
+        self.assertEqual(self.manager.next_name(), 'default')
+        with self.assertRaises(ValueError):
+            self.manager.switch('../escape')
+
+    def test_missed_midnight_resets_warm_profile(self):
+        alice = self.manager.switch('alice')
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        daily = alice.store.add('dailies', {'name': 'Run', 'next_due': yesterday})
+        with database.transaction() as conn:
+            conn.execute("UPDATE app_state SET value = '2000-01-01' WHERE key = 'last_run_date'")
+        self.manager.switch('bob')
+        self.manager.switch('alice')
+        self.assertLess(alice.character['health'], 100)  # Penalty applied and reloaded
+        self.assertEqual(alice.store.get('dailies', daily['id'])['streak'], 0)
+
+class TestWriteQueue(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+        self.notified = []
+        self.writer = WriteQueue(on_error=lambda: self.notified.append(True)).start()
+
+    def tearDown(self):
+        self.writer.close()
+        remove_test_db()
+
+    def test_writes_are_batched_into_transactions(self):
+        blocker = threading.Event()
+        self.writer.submit(blocker.wait)  # Hold the writer so the next writes queue up
+        for i in range(50):
+            self.writer.submit(add_task, 'habits', {'name': f'Habit {i}'})
+        blocker.set()
+        self.writer.flush()
+        self.assertEqual(len(get_tasks('habits')), 50)
+        self.assertEqual(self.writer.pop_errors(), [])
+
+    def test_failed_write_is_reported_and_others_survive(self):
+        habit_id = add_task('habits', {'name': 'Keep'})
+        blocker = threading.Event()
+        self.writer.submit(blocker.wait)
+        self.writer.submit(update_task, 'habits', habit_id, {'no_such_column': 1}, description='bad update')
+        self.writer.submit(add_task, 'habits', {'name': 'Also kept'})
+        self.writer.submit(add_task, 'no_such_table', {'name': 'x'}, description='bad add')
+        self.writer.submit(add_task, 'habits', {}, description='missing name')  # Raises KeyError
+        blocker.set()
+        self.writer.flush()
+        self.assertEqual([t['name'] for t in get_tasks('habits')], ['Keep', 'Also kept'])
+        errors = self.writer.pop_errors()
+        self.assertEqual([e.description for e in errors], ['bad update', 'bad add', 'missing name'])
+        self.assertEqual(len(self.notified), 3)
+
+    def test_optimistic_task_store(self):
+        store = TaskStore(self.writer).load()
+        todo = store.add('todos', {'name': 'Later', 'notes': 'n'})
+        self.assertEqual(todo['completed'], 0)  # Defaults are known before the write lands
+        daily = store.add('dailies', {'name': 'Run'})
+        store.update('dailies', daily['id'], {'streak': 3})
+        self.writer.flush()
+        self.assertEqual(database.get_task('todos', todo['id']), todo)
+        self.assertEqual(database.get_task('dailies', daily['id'])['streak'], 3)
+        store.delete('todos', todo['id'])
+        store.load()  # Reload flushes pending writes first
+        self.assertEqual(column(store, 'todos'), [])
+
+def legacy_daily_reset(conn):
+    """Row-by-row daily reset as it was written before the set-based version."""
+    today = date.today()
+    yesterday = today - timedelta(days=1)
+    health = conn.execute('SELECT health FROM character WHERE id = 1').fetchone()[0]
+    health_lost = 0
+    rows = conn.execute('SELECT id, completed_today, last_completed, penalty_hp FROM dailies').fetchall()
+    for daily_id, completed_today, last_completed, penalty_hp in rows:
+        last_comp_date = None
+        if last_completed:
+            last_comp_date = datetime.strptime(last_completed, '%Y-%m-%d').date()
+        if last_comp_date != today:
+            if not completed_today or (last_comp_date and last_comp_date < yesterday):
+                health_lost += penalty_hp
+                conn.execute('UPDATE dailies SET streak = 0 WHERE id = ?', (daily_id,))
+            conn.execute('UPDATE dailies SET completed_today = 0 WHERE id = ?', (daily_id,))
+    if health_lost > 0:
+        conn.execute('UPDATE character SET health = ? WHERE id = 1', (max(0, health - health_lost),))
+    conn.commit()
+
+class TestDailyReset(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def snapshot(self, conn):
+        dailies = conn.execute('SELECT id, completed_today, last_completed, streak FROM dailies ORDER BY id').fetchall()
+        health = conn.execute('SELECT health FROM character WHERE id = 1').fetchone()[0]
+        return [tuple(row) for row in dailies], health
+
+    def test_matches_row_by_row_reset(self):
+        """For plain 'daily' rows the set-based reset matches the old loop."""
+        rng = random.Random(42)
+        today = date.today()
+        yesterday = today - timedelta(days=1)
+        rows = []
+        for i in range(500):
+            # Состояние после вчерашнего сброса: выполненный вчера или сегодня дейлик отмечен
+            # и его срок - следующий день; невыполненный просрочен
+            last = rng.choice([None, today, yesterday] + [today - timedelta(days=d) for d in (2, 10)])
+            done = last in (today, yesterday)
+            next_due = last + timedelta(days=1) if done else yesterday - timedelta(days=rng.choice([0, 0, 3]))
+            rows.append((f'Daily {i}', int(done), last and last.isoformat(), next_due.isoformat(),
+                         rng.randint(0, 20), rng.randint(0, 3)))
+        with database.transaction() as conn:
+            conn.executemany("INSERT INTO dailies (name, frequency, completed_today, last_completed, next_due, "
+                             "streak, penalty_hp) VALUES (?, 'daily', ?, ?, ?, ?, ?)", rows)
+            conn.execute('UPDATE character SET health = 10000 WHERE id = 1')
+
+        reference = sqlite3.connect(':memory:')
+        database.get_db_connection().backup(reference)
+        legacy_daily_reset(reference)
+
+        database.daily_reset()
+        self.assertEqual(self.snapshot(database.get_db_connection()), self.snapshot(reference))
+        reference.close()
+
+    def test_reset_follows_hand_written_schedule(self):
+        """Expected dates are worked out by hand for a reset on Friday 2024-03-01 (after a leap February)."""
+        rows = [
+            # name, frequency, completed_today, last_completed, next_due, penalty_hp, deleted_at
+            ('daily missed', 'daily', 0, '2024-02-27', '2024-02-28', 1, None),
+            ('daily done', 'daily', 1, '2024-02-29', '2024-03-01', 100, None),
+            ('weekly missed', 'weekly:Mon,Wed', 0, None, '2024-02-28', 2, None),
+            ('weekly done', 'weekly:Mon,Wed', 1, '2024-02-28', '2024-03-04', 100, None),
+            ('weekly new', 'weekly:Mon,Wed', 0, None, None, 100, None),
+            ('monthly missed', 'monthly:31', 0, '2024-01-31', '2024-02-29', 4, None),
+            ('monthly unscheduled', 'monthly:31', 0, '2024-01-31', None, 8, None),
+            ('deleted', 'daily', 0, None, '2024-02-01', 100, '2024-02-01 10:00:00'),
+        ]
+        with database.transaction() as conn:
+            conn.executemany('INSERT INTO dailies (name, frequency, completed_today, last_completed, next_due, '
+                             'penalty_hp, streak, deleted_at) VALUES (?, ?, ?, ?, ?, ?, 5, ?)', rows)
+        database.daily_reset(date(2024, 3, 1))
+        result = {row[0]: tuple(row[1:]) for row in database.get_db_connection().execute(
+            'SELECT name, next_due, completed_today, streak FROM dailies')}
+        self.assertEqual(result, {
+            'daily missed': ('2024-03-01', 0, 0),
+            'daily done': ('2024-03-01', 0, 5),       # Due today again: unchecked, streak kept
+            'weekly missed': ('2024-03-04', 0, 0),    # Next Monday
+            'weekly done': ('2024-03-04', 1, 5),      # Not due yet: stays checked
+            'weekly new': ('2024-03-04', 0, 5),
+            'monthly missed': ('2024-03-31', 0, 0),   # The 31st fell on Feb 29
+            'monthly unscheduled': ('2024-03-31', 0, 0),
+            'deleted': ('2024-02-01', 0, 5),
+        })
+        misses = database.get_db_connection().execute(
+            "SELECT d.name, e.day, e.hp FROM task_events AS e JOIN dailies AS d ON d.id = e.task_id "
+            "WHERE e.kind = 'miss' ORDER BY d.id").fetchall()
+        self.assertEqual([tuple(row) for row in misses], [
+            ('daily missed', '2024-02-28', 1),
+            ('weekly missed', '2024-02-28', 2),
+            ('monthly missed', '2024-02-29', 4),
+            ('monthly unscheduled', '2024-02-29', 8),
+        ])
+        self.assertEqual(get_character_data()['health'], 100 - 15)
+
+    def test_recurrence_rules(self):
+        monday = date(2024, 5, 6)
+        self.assertEqual(recurrence.next_due('daily', monday), date(2024, 5, 7))
+        self.assertEqual(recurrence.next_due('weekly:Mon,Wed', monday), date(2024, 5, 8))
+        self.assertEqual(recurrence.next_due('weekly:Mon', monday), date(2024, 5, 13))
+        self.assertEqual(recurrence.first_due('weekly:Mon', monday), monday)
+        self.assertEqual(recurrence.next_due('monthly:1,15', monday), date(2024, 5, 15))
+        self.assertEqual(recurrence.next_due('monthly:31', date(2024, 2, 1)), date(2024, 2, 29))  # Short month
+        self.assertEqual(recurrence.next_due('monthly:1', date(2024, 12, 1)), date(2025, 1, 1))
+        for bad in ('weekly', 'weekly:Funday', 'monthly:0', 'hourly:1'):
+            with self.assertRaises(ValueError):
+                recurrence.parse(bad)
+        self.assertEqual(recurrence.next_due('bogus', monday), date(2024, 5, 7))  # Scheduled as daily
+
+    def test_weekly_daily_is_penalized_only_when_its_day_passed(self):
+        today = date.today()
+        last_week = (today - timedelta(days=7)).isoformat()
+        weekday = recurrence.WEEKDAYS[today.weekday()]
+        other_day = recurrence.WEEKDAYS[(today.weekday() + 3) % 7]
+        missed_id = add_task('dailies', {'name': 'Review', 'frequency': f'weekly:{weekday}', 'next_due': last_week,
+                                         'penalty_hp': 5})
+        later_id = add_task('dailies', {'name': 'Laundry', 'frequency': f'weekly:{other_day}'})
+        self.assertGreater(database.get_task('dailies', later_id)['next_due'], today.isoformat())
+        database.record_task_event('dailies', later_id, 'complete', today.isoformat())  # Done early
+        database.daily_reset()
+        missed, later = database.get_task('dailies', missed_id), database.get_task('dailies', later_id)
+        self.assertEqual((missed['streak'], missed['next_due']), (0, today.isoformat()))
+        self.assertEqual(database.get_task_events('dailies', missed_id)[-1]['day'], last_week)  # Miss on its due day
+        self.assertEqual((later['completed_today'], later['streak']), (1, 1))  # Not due yet: stays done
+        self.assertEqual(get_character_data()['health'], 95)
+        with self.assertRaises(ValueError):
+            add_task('dailies', {'name': 'Bad', 'frequency': 'weekly:Funday'})
+
+    def test_reset_reads_only_due_rows(self):
+        conn = database.get_db_connection()
+        for where in (database._DAILY_MISSED, database._DAILY_DUE, recurrence.UNSCHEDULED):
+            plan = ' '.join(row[3] for row in conn.execute(
+                f'EXPLAIN QUERY PLAN SELECT * FROM dailies WHERE {where}', {'today': date.today().isoformat()}))
+            self.assertIn('idx_dailies_next_due', plan)
+
+    def test_health_does_not_go_below_zero(self):
+        add_task('dailies', {'name': 'Missed', 'penalty_hp': 500,
+                             'next_due': (date.today() - timedelta(days=1)).isoformat()})
+        database.daily_reset()
+        self.assertEqual(get_character_data()['health'], 0)
+
 class TestUIComponents(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Initialize Pygame for UI tests."""
-        pygame.init()
-        cls.screen = pygame.display.set_mode((800, 600))
+        import main
+        cls.screen = main.init_display()
 
     @classmethod
     def tearDownClass(cls):
@@ -197,6 +1083,533 @@ class TestUIComponents(unittest.TestCase):
         self.assertTrue(any(area[3] == 'toggle_complete' for area in click_areas))
         self.assertTrue(any(area[3] == 'delete' for area in click_areas))
 
+# Import of main.py must stay cheap: no window, no asset decoding
+IMPORT_BUDGET_MS = 500
+
+class TestImportTime(unittest.TestCase):
+    def measure(self, code):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1'))
+        return output.stdout.split()
+
+    def test_main_import_has_no_side_effects_and_fits_budget(self):
+        elapsed_ms, display_init = self.measure(
+            "import time; t = time.perf_counter(); import main; elapsed = time.perf_counter() - t; "
+            "import pygame; print(int(elapsed * 1000), pygame.display.get_init())")
+        self.assertEqual(display_init, 'False')
+        self.assertLess(int(elapsed_ms), IMPORT_BUDGET_MS)
+
+    def test_game_core_does_not_import_pygame(self):
+        (loaded,) = self.measure("import sys, game_core; print('pygame' in sys.modules)")
+        self.assertEqual(loaded, 'False')
+
+class TestGameCore(unittest.TestCase):
+    def test_gain_xp_gold_levels_up(self):
+        character = {'level': 1, 'xp': 90, 'xp_to_next_level': 100, 'health': 40, 'max_health': 100, 'gold': 0}
+        with self.assertLogs('game_core', 'DEBUG') as logs:  # Logged, not printed
+            gain_xp_gold(character, 20, 5)
+        self.assertEqual([record.levelname for record in logs.records], ['DEBUG', 'INFO'])
+        self.assertEqual((character['level'], character['xp'], character['xp_to_next_level']), (2, 10, 150))
+        self.assertEqual((character['health'], character['max_health'], character['gold']), (120, 120, 5))
+
+    def test_lose_health_stops_at_zero(self):
+        character = {'health': 5}
+        lose_health(character, 20)
+        self.assertEqual(character['health'], 0)
+
+def legacy_level_up(character, xp_gain):
+    """The step-by-step loop gain_xp_gold used before progression.py."""
+    character['xp'] += xp_gain
+    while character['xp'] >= character['xp_to_next_level']:
+        character['xp'] -= character['xp_to_next_level']
+        character['level'] += 1
+        character['max_health'] += 20
+        character['health'] = character['max_health']
+        character['xp_to_next_level'] = int(character['xp_to_next_level'] * 1.5)
+
+class TestProgression(unittest.TestCase):
+    def new_character(self, **values):
+        character = {'level': 1, 'xp': 0, 'xp_to_next_level': 100, 'health': 50, 'max_health': 100, 'gold': 0}
+        character.update(values)
+        return character
+
+    def test_matches_step_by_step_loop(self):
+        rng = random.Random(11)
+        for _ in range(2000):
+            start = self.new_character(xp=rng.randint(0, 50), xp_to_next_level=rng.choice([1, 2, 3, 7, 100, 150, 12345]))
+            # The legacy loop takes one pass per level, so keep tiny thresholds to modest grants
+            xp_gain = rng.choice([0, 1, rng.randint(0, 500), rng.randint(0, 10 ** 6 if start['xp_to_next_level'] > 7 else 5000)])
+            expected, actual = dict(start), dict(start)
+            legacy_level_up(expected, xp_gain)
+            progression.add_xp(actual, xp_gain)
+            self.assertEqual(actual, expected, (start, xp_gain))
+
+    def test_huge_grant_is_fast(self):
+        character = self.new_character()
+        progression.add_xp(character, 10 ** 15)
+        expected = self.new_character()
+        legacy_level_up(expected, 10 ** 15)
+        self.assertEqual(character, expected)
+
+    def test_remove_xp_undoes_add_xp(self):
+        rng = random.Random(5)
+        for _ in range(2000):
+            start = self.new_character(xp=rng.randint(0, 99))
+            progression.add_xp(start, rng.randint(0, 10 ** 6))
+            start['health'] = rng.randint(0, start['max_health'])
+            character, xp_gain = dict(start), rng.choice([1, 99, rng.randint(0, 10 ** 6)])
+            levels = progression.add_xp(character, xp_gain)
+            self.assertEqual(progression.remove_xp(character, xp_gain), levels)
+            self.assertEqual(character, dict(start, health=character['health']))
+        character = self.new_character(level=3, xp=5, xp_to_next_level=999)  # Not on the threshold table
+        progression.remove_xp(character, 50)
+        self.assertEqual((character['level'], character['xp']), (3, 0))
+
+    def test_rejects_non_positive_threshold(self):
+        with self.assertRaises(ValueError):
+            progression.levels_for_xp(10, 0)
+
+class TestApplyRewards(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_batch_matches_one_by_one(self):
+        daily_id = add_task('dailies', {'name': 'Run'})
+        todo_id = add_task('todos', {'name': 'Once'})
+        rng = random.Random(5)
+        grants = [progression.Grant('dailies', daily_id, 'complete', rng.randint(0, 40), rng.randint(0, 9), 0, '2024-02-01')
+                  for _ in range(1000)]
+        grants.insert(500, progression.Grant('dailies', daily_id, 'miss', hp=30, day='2024-02-02'))
+        grants.append({'task_type': 'todos', 'task_id': todo_id, 'xp': 20, 'gold': 10, 'day': '2024-02-03'})
+
+        expected = get_character_data()
+        for grant in grants:
+            grant = grant if isinstance(grant, progression.Grant) else progression.Grant(**grant)
+            legacy_level_up(expected, grant.xp)
+            expected['gold'] += grant.gold
+            expected['health'] = max(0, expected['health'] - grant.hp)
+
+        statements = []
+        database.get_db_connection().set_trace_callback(statements.append)
+        character = progression.apply_rewards(grants)
+        database.get_db_connection().set_trace_callback(None)
+        self.assertEqual(character, expected)
+        self.assertEqual(get_character_data(), expected)
+        self.assertEqual(sum(sql.lstrip().startswith('UPDATE character') for sql in statements), 1)
+        self.assertEqual(statements.count('COMMIT'), 1)
+
+        self.assertEqual(database.get_task('dailies', daily_id)['streak'], 500)  # Reset by the miss
+        self.assertEqual(database.get_task('todos', todo_id)['completed'], 1)
+        self.assertEqual(stats.total('xp', '2024-02-01', '2024-02-03'), sum(
+            (g.xp if isinstance(g, progression.Grant) else g['xp']) for g in grants))
+
+class TestCommands(unittest.TestCase):
+    def setUp(self):
+        remove_test_db()
+        init_db()
+        self.store = TaskStore().load()
+        self.character = get_character_data()
+        self.history = commands.CommandHistory(self.store, self.character)
+
+    def tearDown(self):
+        remove_test_db()
+
+    def test_bulk_delete_undo_redo(self):
+        ids = [self.history.execute(commands.AddTask('todos', {'name': f'Todo {i}'})).task['id'] for i in range(300)]
+        listed = get_tasks('todos')
+        statements = []
+        self.history.execute(commands.DeleteTasks('todos', ids[:250]))
+        self.assertEqual(get_tasks('todos'), column(self.store, 'todos'))
+        self.assertEqual(len(get_tasks('todos')), 50)
+
+        database.get_db_connection().set_trace_callback(statements.append)
+        self.history.undo()
+        database.get_db_connection().set_trace_callback(None)
+        self.assertEqual(get_tasks('todos'), listed)
+        self.assertEqual(column(self.store, 'todos'), listed)  # Restored rows are back in list order
+        # Triggers re-report the outer statement, so count distinct statements
+        self.assertEqual(len({sql for sql in statements if sql.lstrip().startswith('UPDATE todos')}), 1)
+
+        self.history.redo()
+        self.assertEqual(len(column(self.store, 'todos')), 50)
+        self.assertEqual(len(get_tasks('todos')), 50)
+
+    def test_undo_completion_reverts_character_and_stats(self):
+        daily = self.history.execute(commands.AddTask('dailies', {'name': 'Run', 'value_xp': 150})).task
+        before = dict(self.character)
+        today = date.today().isoformat()
+        self.history.execute(commands.CompleteTask('dailies', daily['id']))
+        self.assertEqual(self.character['level'], 2)
+        self.assertEqual(stats.total('xp', today, today), 150)
+        self.assertGreater(self.store.get('dailies', daily['id'])['next_due'], today)
+
+        self.history.undo()
+        self.assertEqual(self.store.get('dailies', daily['id'])['next_due'], today)
+        self.assertEqual(self.character, before)
+        self.assertEqual(get_character_data(), before)
+        self.assertEqual(self.store.get('dailies', daily['id'])['streak'], 0)
+        self.assertEqual(stats.total('xp', today, today), 0)
+        database.replay_task_events()  # The reverted event no longer counts
+        self.assertEqual(database.get_task('dailies', daily['id'])['streak'], 0)
+
+        self.history.redo()
+        self.assertEqual(self.character['level'], 2)
+        self.assertEqual(database.get_task('dailies', daily['id'])['streak'], 1)
+        self.assertEqual(stats.total('xp', today, today), 150)
+
+    def test_uncheck_reverses_completion(self):
+        """Check, uncheck, check pays out once and leaves one completion in the stats."""
+        daily = self.history.execute(commands.AddTask('dailies', {'name': 'Run', 'value_xp': 150, 'value_gold': 7})).task
+        before = dict(self.character)
+        today = date.today().isoformat()
+        self.history.execute(commands.CompleteTask('dailies', daily['id']))
+        self.assertIsNone(self.history.execute(commands.CompleteTask('dailies', daily['id'])))  # Already done today
+        self.history.execute(commands.UncompleteTask('dailies', daily['id']))
+        self.assertEqual(self.character, dict(before, health=self.character['health'],
+                                              max_health=self.character['max_health']))
+        self.assertEqual((self.character['level'], self.character['max_health']), (1, before['max_health']))
+        self.assertEqual(get_character_data(), self.character)
+        row = self.store.get('dailies', daily['id'])
+        self.assertEqual((row['completed_today'], row['streak'], row['last_completed'], row['next_due']), (0, 0, None, today))
+        self.assertEqual(stats.total('completions', today, today), 0)
+        self.assertEqual(stats.total('xp', today, today), 0)
+
+        self.history.execute(commands.CompleteTask('dailies', daily['id']))
+        self.assertEqual((self.character['xp'], self.character['gold']), (50, before['gold'] + 7))
+        self.assertEqual(database.get_task('dailies', daily['id'])['streak'], 1)
+        self.assertEqual(stats.total('completions', today, today), 1)
+        self.assertEqual(stats.total('xp', today, today), 150)
+        database.replay_task_events()  # The journal agrees: one completion
+        self.assertEqual(database.get_task('dailies', daily['id'])['last_completed'], today)
+        self.assertEqual(database.get_task('dailies', daily['id'])['streak'], 1)
+
+    def test_undo_uncheck_brings_completion_back(self):
+        daily = self.history.execute(commands.AddTask('dailies', {'name': 'Call', 'value_xp': 30})).task
+        today = date.today().isoformat()
+        self.history.execute(commands.CompleteTask('dailies', daily['id']))
+        self.history.execute(commands.UncompleteTask('dailies', daily['id']))
+        self.assertEqual((self.character['xp'], stats.total('xp', today, today)), (0, 0))
+        self.history.undo()
+        self.assertEqual((self.character['xp'], stats.total('xp', today, today)), (30, 30))
+        self.assertEqual(self.store.get('dailies', daily['id'])['last_completed'], today)
+        self.history.redo()
+        self.assertEqual((self.character['xp'], stats.total('xp', today, today)), (0, 0))
+        self.history.undo()
+        self.history.undo()  # Back before the first check
+        self.assertEqual((self.character['xp'], stats.total('completions', today, today)), (0, 0))
+        self.assertEqual(self.store.get('dailies', daily['id'])['streak'], 0)
+
+    def test_undo_add_and_new_command_drops_redo(self):
+        self.history.execute(commands.AddTask('habits', {'name': 'Read'}))
+        self.history.undo()
+        self.assertEqual(get_tasks('habits'), [])
+        self.assertEqual(column(self.store, 'habits'), [])
+        self.history.execute(commands.AddTask('habits', {'name': 'Write'}))
+        self.assertFalse(self.history.can_redo())
+        self.assertEqual(database.get_db_connection().execute(
+            'SELECT COUNT(*) FROM command_journal WHERE undone = 1').fetchone()[0], 0)
+        self.assertEqual([t['name'] for t in get_tasks('habits')], ['Write'])
+
+    def test_buy_and_equip(self):
+        pets = [r for r in self.store.rewards() if r['type'] == 'pet']
+        self.character['gold'] = 500
+        database.update_character_data(self.character)
+        for pet in pets:
+            self.history.execute(commands.BuyReward(pet['id']))
+        self.history.execute(commands.EquipReward(pets[0]['id']))
+        self.history.execute(commands.EquipReward(pets[1]['id']))
+        self.assertEqual([r['equipped'] for r in database.get_rows('rewards', [p['id'] for p in pets])], [0, 1])
+        self.history.undo()
+        self.assertEqual([self.store.get_reward(p['id'])['equipped'] for p in pets], [1, 0])
+        self.history.undo()
+        self.history.undo()
+        self.assertEqual(self.store.get_reward(pets[1]['id'])['owned'], 0)
+        self.assertEqual(self.character['gold'], 500 - pets[0]['cost'])
+        self.assertIsNone(self.history.execute(commands.BuyReward(pets[0]['id'])))  # Already owned
+
+    def test_compact_purges_unreferenced_tombstones(self):
+        old, recent, journaled = (add_task('todos', {'name': name}) for name in ('Old', 'Recent', 'In journal'))
+        self.store.load()
+        self.history.execute(commands.DeleteTasks('todos', [journaled]))
+        database.delete_tasks('todos', [old, recent])
+        with database.transaction() as conn:
+            conn.execute("UPDATE todos SET deleted_at = datetime('now', '-30 days') WHERE id IN (?, ?)", (old, journaled))
+        self.assertEqual(commands.compact(), 1)
+        remaining = [row['id'] for row in database.get_rows('todos', [old, recent, journaled])]
+        self.assertEqual(remaining, [recent, journaled])
+        self.assertEqual(commands.compact(keep=0), 1)  # Once the journal is gone, the old tombstone goes too
+
+    def test_commands_through_writer(self):
+        writer = WriteQueue().start()
+        try:
+            self.store.writer = writer
+            history = commands.CommandHistory(self.store, self.character, writer)
+            todo = history.execute(commands.AddTask('todos', {'name': 'Later'})).task
+            history.execute(commands.CompleteTask('todos', todo['id']))
+            history.undo()
+            self.assertEqual(self.store.get('todos', todo['id'])['completed'], 0)
+            self.assertEqual(get_character_data(), self.character)
+            daily = history.execute(commands.AddTask('dailies', {'name': 'Run'})).task
+            history.execute(commands.CompleteTask('dailies', daily['id']))
+            history.execute(commands.UncompleteTask('dailies', daily['id']))
+            writer.flush()
+            self.store.settle()  # The unchecked row is read back for its last_completed
+            self.assertEqual(self.store.get('dailies', daily['id']), database.get_task('dailies', daily['id']))
+            self.assertEqual(writer.pop_errors(), [])
+        finally:
+            writer.close()
+
+class TestSpriteCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = SpriteCache('assets')
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_lazy_and_keyed_by_size(self):
+        self.assertNotIn(('axe.png', (32, 32)), self.cache)  # Nothing decoded up front
+        small = self.cache.get('axe.png', (32, 32))
+        self.assertIs(self.cache.get('axe.png', (32, 32)), small)
+        self.assertEqual(self.cache.get('axe.png', (64, 64)).get_size(), (64, 64))
+
+    def test_prefetch_from_reward_rows(self):
+        rewards = [{'sprite_name': 'dragon.png'}, {'sprite_name': 'no_such_sprite.png'}, {'sprite_name': None}]
+        self.cache.prefetch_rewards(rewards, (32, 32))
+        self.cache.close()  # Wait for the worker to finish decoding
+        self.assertEqual(self.cache.get('dragon.png', (32, 32)).get_size(), (32, 32))
+        fallback = self.cache.get('no_such_sprite.png', (32, 32))  # Missing files get a placeholder
+        self.assertEqual(tuple(fallback.get_at((0, 0)))[:3], (255, 0, 0))
+
+class TestTextCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pygame.font.init()
+        cls.font = pygame.font.Font(None, 24)
+
+    def test_hits_and_misses(self):
+        cache = TextCache(capacity=4)
+        first = cache.render(self.font, 'Level: 1', True, (0, 0, 0))
+        second = cache.render(self.font, 'Level: 1', True, (0, 0, 0))
+        self.assertIs(first, second)
+        cache.render(self.font, 'Level: 1', True, (255, 0, 0))  # Different color is a different key
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        cache = TextCache(capacity=2)
+        cache.render(self.font, 'a', True, (0, 0, 0))
+        cache.render(self.font, 'b', True, (0, 0, 0))
+        cache.render(self.font, 'a', True, (0, 0, 0))  # 'a' becomes most recent
+        cache.render(self.font, 'c', True, (0, 0, 0))  # Evicts 'b'
+        self.assertEqual(len(cache), 2)
+        cache.render(self.font, 'a', True, (0, 0, 0))
+        self.assertEqual(cache.hits, 2)
+        cache.render(self.font, 'b', True, (0, 0, 0))
+        self.assertEqual(cache.misses, 4)
+
+        cache.capacity = 1
+        self.assertEqual(len(cache), 1)
+
+def legacy_wrap(text, font, width):
+    """Character-by-character wrapping as draw_text did it before text_layout."""
+    lines = []
+    while text:
+        i = 1
+        while font.size(text[:i])[0] < width and i < len(text):
+            i += 1
+        if i < len(text):
+            i = text.rfind(" ", 0, i) + 1
+        if i == 0:
+            i = 1
+        lines.append(text[:i])
+        text = text[i:]
+    return tuple(lines)
+
+class TestTextLayout(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pygame.font.init()
+        cls.font = pygame.font.Font(None, 24)
+
+    def test_same_breaks_as_legacy_wrap(self):
+        rng = random.Random(7)
+        words = ['a', 'to', 'read', 'exercise', 'Supercalifragilisticexpialidocious', 'Бег', '  ', 'x' * 60]
+        for _ in range(200):
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 15)))
+            width = rng.choice([1, 5, 40, 100, 180, 400])
+            self.assertEqual(wrap_lines(text, self.font, width), legacy_wrap(text, self.font, width),
+                             (text, width))
+
+    def test_draw_text_returns_overflow(self):
+        from main import draw_text
+        surface = pygame.Surface((200, 40))
+        text = 'one two three four five six seven eight nine ten eleven twelve'
+        rest = draw_text(surface, text, self.font, (0, 0, 0), pygame.Rect(0, 0, 80, 40))
+        lines = wrap_lines(text, self.font, 80)
+        self.assertEqual(rest, ''.join(lines[2:]))  # Only two lines fit into 40px
+
+class TestPanels(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.layer = PanelLayer(pygame.Surface((200, 100)))
+        self.layer.add(Panel('left', (0, 0, 100, 100), self.make_draw('left')))
+        self.layer.add(Panel('right', (100, 0, 100, 100), self.make_draw('right')))
+        self.screen = pygame.Surface((200, 100))
+
+    def make_draw(self, name):
+        def draw(surface, rect):
+            self.calls.append(name)
+            surface.fill((255, 0, 0))
+            return [(pygame.Rect(rect.x + 10, rect.y + 10, 20, 20), name, 1, 'delete')]
+        return draw
+
+    def test_only_dirty_panels_are_redrawn(self):
+        self.assertEqual(self.layer.update(self.screen), [self.screen.get_rect()])  # First frame is full
+        self.assertEqual(self.layer.update(self.screen), [])  # Idle frame costs nothing
+        self.layer.invalidate('right')
+        self.assertEqual(self.layer.update(self.screen), [pygame.Rect(100, 0, 100, 100)])
+        self.assertEqual(self.calls, ['left', 'right', 'right'])
+
+    def test_click_areas_in_screen_coordinates(self):
+        self.layer.update(self.screen)
+        rects = [area[0] for area in self.layer.click_areas()]
+        self.assertEqual(rects, [pygame.Rect(10, 10, 20, 20), pygame.Rect(110, 10, 20, 20)])
+
+    def test_restore_uses_cached_panels(self):
+        self.layer.update(self.screen)
+        self.screen.fill((0, 0, 255), (50, 20, 100, 50))  # Something drawn over both panels
+        self.layer.restore(self.screen, (50, 20, 100, 50))
+        self.assertEqual(tuple(self.screen.get_at((60, 30)))[:3], (255, 0, 0))
+        self.assertEqual(tuple(self.screen.get_at((140, 60)))[:3], (255, 0, 0))
+        self.assertEqual(self.calls, ['left', 'right'])
+
+class TestFrameProfiler(unittest.TestCase):
+    TRACE_FILES = ('test_profile.json', 'test_trace.json')
+
+    def tearDown(self):
+        for path in self.TRACE_FILES:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_percentiles_over_ring_buffer(self):
+        profiler = FrameProfiler(history=100)
+        for ms in range(1, 201):  # Only the last 100 samples (101..200 ms) are kept
+            profiler.record('draw', 0, ms * 1_000_000)
+        self.assertEqual(profiler.percentiles('draw'), {50: 150.0, 95: 195.0, 99: 199.0})
+        self.assertEqual(profiler.summary()['draw']['count'], 100)
+        self.assertEqual(profiler.percentiles('missing'), {})
+
+    def test_disabled_profiler_records_nothing(self):
+        profiler = FrameProfiler(enabled=False)
+        with profiler.phase('events'):
+            pass
+        profiler.record_since('frame', profiler.now())
+        self.assertEqual(profiler.summary(), {})
+
+    def test_panel_draws_and_trace_dumps(self):
+        profiler = FrameProfiler()
+        layer = PanelLayer(pygame.Surface((100, 100)), profiler=profiler)
+        layer.add(Panel('list', (0, 0, 100, 100), lambda surface, rect: []))
+        with profiler.phase('frame'):
+            layer.update(pygame.Surface((100, 100)))
+        self.assertEqual(list(profiler.summary()), ['draw:list', 'frame'])
+
+        profiler.dump_chrome_trace('test_trace.json')
+        with open('test_trace.json') as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([(e['name'], e['ph']) for e in events], [('draw:list', 'X'), ('frame', 'X')])
+        self.assertLessEqual(events[1]['ts'], events[0]['ts'])  # The frame encloses the draw
+        profiler.dump_json('test_profile.json')
+        with open('test_profile.json') as f:
+            self.assertIn('frame', json.load(f)['summary'])
+
+class TestHitGrid(unittest.TestCase):
+    def test_matches_linear_scan(self):
+        """The grid returns the same area as scanning the list in order."""
+        rng = random.Random(3)
+        bounds = pygame.Rect(10, 140, 328, 508)
+        areas = [(pygame.Rect(rng.randint(0, 350), rng.randint(130, 660), rng.randint(1, 60), rng.randint(1, 40)),
+                  'todos', i, 'delete') for i in range(300)]
+        grid = HitGrid(bounds)
+        for area in areas:
+            grid.insert(area[0], area)
+        for _ in range(2000):
+            pos = (rng.randint(0, 360), rng.randint(120, 680))
+            expected = None
+            if bounds.collidepoint(pos):
+                expected = next((a for a in areas if a[0].collidepoint(pos)), None)
+            self.assertEqual(grid.query(pos), expected, pos)
+
+    def test_layer_hit_test_and_hover(self):
+        layer = PanelLayer(pygame.Surface((200, 100)), hover_color=(0, 255, 0))
+        layer.add(Panel('todos', (100, 0, 100, 100),
+                        lambda surface, rect: [(pygame.Rect(10, 10, 24, 24), 'todos', 7, 'delete')]))
+        screen = pygame.Surface((200, 100))
+        layer.update(screen)
+        self.assertEqual(layer.hit_test((115, 15))[2:], (7, 'delete'))
+        self.assertIsNone(layer.hit_test((50, 50)))
+
+        self.assertEqual(layer.set_hover(screen, (115, 15)), [pygame.Rect(110, 10, 24, 24)])
+        self.assertEqual(tuple(screen.get_at((110, 20)))[:3], (0, 255, 0))
+        self.assertEqual(layer.set_hover(screen, (116, 16)), [])  # Same area: nothing to update
+        self.assertEqual(layer.set_hover(screen, None), [pygame.Rect(110, 10, 24, 24)])
+        self.assertEqual(tuple(screen.get_at((110, 20)))[:3], (0, 0, 0))
+
+class TestListView(unittest.TestCase):
+    def test_window_and_clamping(self):
+        view = ListView()
+        view.layout(50000, 10)
+        self.assertEqual(list(view.window()), list(range(10)))
+        self.assertFalse(view.scroll(-1))  # Already at the top
+        self.assertTrue(view.scroll_page(2))
+        self.assertEqual(view.first, 20)
+        view.scroll_to(view.count)
+        self.assertEqual(list(view.window()), list(range(49990, 50000)))
+        view.layout(5, 10)  # List shrank: scroll position is clamped
+        self.assertEqual(view.first, 0)
+        self.assertFalse(view.overflows)
+        self.assertIsNone(view.thumb_rect((0, 0, 6, 100)))
+
+    def test_thumb_tracks_position(self):
+        view = ListView()
+        view.layout(100, 10)
+        self.assertEqual(view.thumb_rect((0, 0, 6, 100)), pygame.Rect(0, 0, 6, 10))
+        view.scroll_to(90)
+        self.assertEqual(view.thumb_rect((0, 0, 6, 100)), pygame.Rect(0, 90, 6, 10))
+
+class TestFrameScheduler(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pygame.display.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        pygame.display.quit()
+
+    def test_ms_until_rollover(self):
+        scheduler = FrameScheduler(now=lambda: datetime(2024, 5, 1, 23, 59, 59))
+        self.assertEqual(scheduler.ms_until_rollover(), 1001)
+
+    def test_day_changed_once(self):
+        days = [date(2024, 5, 1)]
+        scheduler = FrameScheduler(today=lambda: days[0])
+        self.assertFalse(scheduler.day_changed())
+        days[0] = date(2024, 5, 2)
+        self.assertTrue(scheduler.day_changed())
+        self.assertFalse(scheduler.day_changed())
+
+    def test_idle_wait_returns_queued_events(self):
+        scheduler = FrameScheduler()
+        pygame.event.clear()
+        pygame.event.post(pygame.event.Event(pygame.USEREVENT, n=1))
+        pygame.event.post(pygame.event.Event(pygame.USEREVENT, n=2))
+        events = scheduler.wait_events(animating=False)
+        self.assertEqual([e.n for e in events if e.type == pygame.USEREVENT], [1, 2])
+
 def run_tests():
     """Run all tests."""
     unittest.main()
@@ -0,0 +1,56 @@
+# text_cache.py
+from collections import OrderedDict
+
+
+class TextCache:
+    """
+    Ограниченный LRU-кэш отрисованного текста.
+
+    Ключ - (font, text, color, antialias, background). Возвращаемые
+    поверхности общие: их можно только блитить, но не изменять.
+    """
+
+    def __init__(self, capacity=1024):
+        self._surfaces = OrderedDict()
+        self._capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, value):
+        self._capacity = value
+        self._evict()
+
+    def render(self, font, text, antialias, color, background=None):
+        """То же, что font.render(...), но повторные вызовы берутся из кэша."""
+        key = (font, text, tuple(color), antialias, tuple(background) if background else None)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color, background)
+        self._surfaces[key] = surface
+        self._evict()
+        return surface
+
+    def _evict(self):
+        while len(self._surfaces) > self._capacity:
+            self._surfaces.popitem(last=False) # Самый давно использованный
+
+    def clear(self):
+        self._surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'size': len(self._surfaces), 'capacity': self._capacity,
+                'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._surfaces)
@@ -0,0 +1,42 @@
+# text_layout.py
+from functools import lru_cache
+
+WRAP_CACHE_SIZE = 4096
+
+
+def _break_index(text, font, width):
+    """
+    Длина первой строки переноса.
+
+    Ищет наименьшее i, при котором ширина text[:i] достигает width, бинарным
+    поиском по font.size (ширина префикса не убывает с ростом i) -
+    O(log n) замеров вместо посимвольного перебора.
+    """
+    n = len(text)
+    if font.size(text)[0] < width:
+        return n
+    lo, hi = 1, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if font.size(text[:mid])[0] < width:
+            lo = mid + 1
+        else:
+            hi = mid
+    i = lo
+    if i < n:
+        # Если текст не поместился, ищем последний пробел
+        i = text.rfind(" ", 0, i) + 1
+    if i == 0: # Если слово слишком длинное
+        i = 1 # Рисуем по одной букве, чтобы избежать бесконечного цикла
+    return i
+
+
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrap_lines(text, font, width):
+    """Разбивает текст на строки не шире width. Результат кэшируется."""
+    lines = []
+    while text:
+        i = _break_index(text, font, width)
+        lines.append(text[:i])
+        text = text[i:]
+    return tuple(lines)
@@ -0,0 +1,124 @@
+# write_queue.py
+import logging
+import queue
+import threading
+from collections import namedtuple
+import database
+
+log = logging.getLogger(__name__)
+
+# Неудавшаяся запись: description - что пытались записать, error - исключение или текст
+WriteError = namedtuple('WriteError', 'description error')
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Асинхронная запись в SQLite из одного фонового потока.
+
+    Поток рисования ставит функции записи в очередь (submit) и не ждет
+    commit/fsync. Поток-писатель забирает накопившиеся записи пачкой и
+    выполняет их в одной транзакции. Ошибки складываются в очередь для
+    потока UI (pop_errors) и передаются в on_error, чтобы разбудить его.
+
+    submitted и committed - сколько записей поставлено и сколько выполнено:
+    изменение, сделанное при submitted == n, уже в БД, когда committed > n.
+    После каждой пачки вызывается on_commit (в потоке-писателе), чтобы UI
+    узнал об этом без flush().
+    """
+
+    def __init__(self, batch_size=256, on_error=None, on_commit=None):
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.on_commit = on_commit
+        self.submitted = 0 # Меняется только в потоке UI
+        self.committed = 0 # Меняется только в потоке-писателе
+        self._queue = queue.Queue()
+        self._errors = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, fn, *args, description=None):
+        """
+        Ставит в очередь вызов fn(*args) (например, database.update_task).
+
+        Функция должна писать через database.transaction(); вернувшая False
+        запись считается неудавшейся.
+        """
+        self.start()
+        self.submitted += 1
+        self._queue.put((fn, args, description or fn.__name__))
+
+    def flush(self):
+        """Блокирует до тех пор, пока все поставленные записи не будут выполнены."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Дописывает очередь и останавливает поток-писатель (вызывать перед close_db)."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def pop_errors(self):
+        """Забирает накопившиеся ошибки записи (вызывается из потока UI)."""
+        errors = []
+        while True:
+            try:
+                errors.append(self._errors.get_nowait())
+            except queue.Empty:
+                return errors
+
+    # --- Поток-писатель ---
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            writes = batch[:-1] if stop else batch
+            if writes:
+                self._apply(writes)
+                self.committed += len(writes) # До task_done: после flush() счетчик уже обновлен
+                if self.on_commit:
+                    self.on_commit()
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _apply(self, writes):
+        try:
+            with database.transaction():
+                results = [fn(*args) for fn, args, _ in writes]
+        except Exception:
+            # Пачка откатилась целиком: повторяем записи по одной, чтобы не потерять удачные
+            for fn, args, description in writes:
+                try:
+                    with database.transaction():
+                        result = fn(*args)
+                except Exception as e:
+                    self._report(description, e)
+                else:
+                    if result is False:
+                        self._report(description, 'write rejected')
+            return
+        for (_, _, description), result in zip(writes, results):
+            if result is False:
+                self._report(description, 'write rejected')
+
+    def _report(self, description, error):
+        log.warning("Error writing to database (%s): %s", description, error)
+        self._errors.put(WriteError(description, error))
+        if self.on_error:
+            self.on_error()